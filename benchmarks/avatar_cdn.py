@@ -0,0 +1,123 @@
+"""Fetch avatars from a local HTTP server standing in for discord's CDN.
+
+The server hands out small fake PNGs, but fails some requests the first
+time they're made: every ``--flaky``th path answers 503 once, every
+``--limited``th answers 429 with a ``Retry-After`` once, and every
+``--missing``th is a 404 for good. ``AvatarFetcher`` should come back
+with every avatar but the missing ones, having retried the rest, and
+the 429s should cost at least their ``Retry-After``.
+
+    python -m benchmarks.avatar_cdn --avatars 5000
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from cogs.avatar_fetch import AvatarFetcher
+
+BODY = b"\x89PNG\r\n\x1a\n" + bytes(2048)
+
+
+class StandIn:
+    def __init__(
+        self, flaky: int, limited: int, missing: int, retry_after: float
+    ) -> None:
+        self.flaky = flaky
+        self.limited = limited
+        self.missing = missing
+        self.retry_after = retry_after
+        self.seen: Dict[int, int] = {}
+        self.statuses: Dict[int, int] = {}
+        # when each rate limited avatar was refused, and asked for again
+        self.limited_at: Dict[int, List[float]] = {}
+
+    async def avatar(self, request: web.Request) -> web.Response:
+        n = int(request.match_info["n"])
+        first = n not in self.seen
+        self.seen[n] = self.seen.get(n, 0) + 1
+        if n % self.limited == 0:
+            self.limited_at.setdefault(n, []).append(time.perf_counter())
+        if n % self.missing == 0:
+            status = 404
+        elif first and n % self.flaky == 0:
+            status = 503
+        elif first and n % self.limited == 0:
+            status = 429
+        else:
+            status = 200
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 429:
+            return web.Response(
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        if status != 200:
+            return web.Response(status=status)
+        return web.Response(body=BODY, content_type="image/png")
+
+
+async def run(args: argparse.Namespace) -> None:
+    stand_in = StandIn(args.flaky, args.limited, args.missing, args.retry_after)
+    app = web.Application()
+    app.router.add_get("/avatars/{n}.png", stand_in.avatar)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    base = f"http://127.0.0.1:{port}/avatars"
+    jobs = [(n, f"{base}/{n}.png") for n in range(args.avatars)]
+    results: Dict[int, Optional[Tuple[bytes, str]]] = {}
+    try:
+        start = time.perf_counter()
+        async with AvatarFetcher[int](
+            concurrency=args.concurrency, backoff=0.05
+        ) as fetcher:
+            async for key, result in fetcher.fetch_many(jobs):
+                results[key] = result
+        elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+
+    requests = sum(stand_in.seen.values())
+    print(
+        f"{len(results)} avatars in {elapsed:.2f}s over {requests} requests "
+        f"({fetcher.done} fetched, {fetcher.failed} failed)"
+    )
+    statuses = sorted(stand_in.statuses.items())
+    print("statuses served: " + ", ".join(f"{s}: {c}" for s, c in statuses))
+
+    missing = {n for n in range(args.avatars) if n % args.missing == 0}
+    assert len(results) == args.avatars
+    for n, result in results.items():
+        if n in missing:
+            assert result is None, f"{n} should have failed"
+        else:
+            assert result == (BODY, "image/png"), f"{n} wasn't retried"
+    for n, times in stand_in.limited_at.items():
+        if n in missing or n % args.flaky == 0:
+            # a 503 came first, its retry was the backoff's
+            continue
+        assert len(times) == 2, f"{n} was asked for {len(times)} times"
+        waited = times[1] - times[0]
+        assert waited >= args.retry_after * 0.9, f"{n} retried after {waited:.2f}s"
+    print("retries and Retry-After: ok")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--avatars", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--flaky", type=int, default=7)
+    parser.add_argument("--limited", type=int, default=11)
+    parser.add_argument("--missing", type=int, default=97)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Time directory listings against the shared directory index.
+
+Fills a temp directory with empty audio files and compares a plain
+``os.listdir`` plus extension filter (what every lookup used to do) with
+the index: the initial scan, a listing, a random pick, and picking up a
+newly added file through inotify and through the polling fallback.
+
+    python -m benchmarks.dir_index --files 50000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable
+
+from cogs import dirindex
+from cogs.dirindex import DirectoryIndex
+
+EXTENSIONS = (".mp3", ".wav", ".ogg", ".m4a")
+
+
+def timed(fn: Callable[[], object], repeat: int = 1) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.files):
+            ext = EXTENSIONS[i % len(EXTENSIONS)]
+            open(os.path.join(directory, f"track {i:06d}{ext}"), "w").close()
+
+        listdir = timed(
+            lambda: [f for f in os.listdir(directory) if f.endswith(EXTENSIONS)],
+            repeat=10,
+        )
+        print(f"os.listdir + filter: {listdir:.2f}ms per call")
+
+        for mode in ("inotify", "polling"):
+            libc = dirindex._libc
+            if mode == "polling":
+                dirindex._libc = None
+            try:
+                index = DirectoryIndex(directory, EXTENSIONS)
+            finally:
+                dirindex._libc = libc
+            if mode == "inotify" and index.watch is None:
+                print("inotify: not available here")
+                continue
+
+            scan = timed(index.scan)
+            index.listing()
+            listing = timed(index.listing, repeat=1000)
+            pick = timed(index.random_name, repeat=10000)
+            open(os.path.join(directory, "new track.mp3"), "w").close()
+            index.next_poll = 0.0
+            added = timed(lambda: "new track.mp3" in index)
+            os.remove(os.path.join(directory, "new track.mp3"))
+            index.refresh()
+            print(
+                f"{mode}: scan {scan:.1f}ms, listing {listing * 1000:.1f}us, "
+                f"random pick {pick * 1000:.2f}us, "
+                f"picking up a new file {added:.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
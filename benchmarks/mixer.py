@@ -0,0 +1,74 @@
+"""Time one 20ms tick of the pcm mixer across many guilds.
+
+Every guild gets a mixer with two pcm inputs, a queued track and ducked
+idle music, at a non-unity volume so nothing is passed through. That is
+compared with mixing the same frames with ``audioop`` (what
+``discord.PCMVolumeTransformer`` scales with): one ``mul`` per input and
+an ``add``. A tick has to finish well within 20ms for every guild.
+
+    python -m benchmarks.mixer --guilds 500
+"""
+
+import argparse
+import time
+import warnings
+from typing import List
+
+import discord
+import numpy as np
+
+from cogs.mixer import FRAME_BYTES, Mixer
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    import audioop
+
+
+class Tone(discord.AudioSource):
+    """Endless pcm source handing out the same frame."""
+
+    def __init__(self, seed: int) -> None:
+        rng = np.random.default_rng(seed)
+        self.frame = rng.integers(-8000, 8000, FRAME_BYTES // 2, np.int16).tobytes()
+
+    def read(self) -> bytes:
+        return self.frame
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=500)
+    parser.add_argument("--ticks", type=int, default=200)
+    args = parser.parse_args()
+
+    mixers: List[Mixer] = []
+    for i in range(args.guilds):
+        mixer = Mixer(volume=0.8)
+        mixer.set_input("queue", Tone(i))
+        mixer.set_input("idle", Tone(i + args.guilds), duck=True)
+        mixers.append(mixer)
+
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        for mixer in mixers:
+            mixer.read()
+    tick = (time.perf_counter() - start) * 1000 / args.ticks
+    per_guild = tick * 1000 / args.guilds
+    print(f"mixer: {tick:.2f}ms per tick, {per_guild:.1f}us per guild")
+
+    sources = [(Tone(i), Tone(i + args.guilds)) for i in range(args.guilds)]
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        for queue, idle in sources:
+            audioop.add(
+                audioop.mul(queue.read(), 2, 0.8),
+                audioop.mul(idle.read(), 2, 0.2),
+                2,
+            )
+    tick = (time.perf_counter() - start) * 1000 / args.ticks
+    per_guild = tick * 1000 / args.guilds
+    print(f"audioop: {tick:.2f}ms per tick, {per_guild:.1f}us per guild")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Time a cold queue restore for many guilds.
+
+Writes a synthetic snapshot plus journal tail into a temp directory and
+times ``timed_load`` on it, the same call the Queue cog makes at startup.
+
+    python -m benchmarks.queue_restore --guilds 10000 --items 20
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+from typing import Any, Dict
+
+from cogs.journal import QueueJournal, timed_load
+
+
+class Item:
+    __slots__ = ("item_id", "record")
+
+    def __init__(self, record: Dict[str, Any]) -> None:
+        self.item_id: int = record["id"]
+        self.record = record
+
+    def to_record(self) -> Dict[str, Any]:
+        return self.record
+
+
+def record(item_id: int) -> Dict[str, Any]:
+    return {
+        "id": item_id,
+        "filepath": f"youtube_cache/{item_id:011d}.opus",
+        "metadata": {"title": f"track {item_id}", "url": f"https://youtu.be/{item_id}"},
+        "is_youtube": True,
+    }
+
+
+async def build(directory: str, guilds: int, items: int, tail: int) -> None:
+    journal = QueueJournal(directory)
+    next_id = 0
+    state: Dict[str, Any] = {"guilds": {}}
+    for guild_id in range(guilds):
+        queue = [record(next_id + i) for i in range(items)]
+        next_id += items
+        shuffled = [r["id"] for r in queue]
+        random.shuffle(shuffled)
+        state["guilds"][str(guild_id)] = {
+            "queue": queue,
+            "shuffled": shuffled,
+            "current": record(next_id),
+            "history": [],
+            "loop": "off",
+            "shuffle": False,
+        }
+        next_id += 1
+    state["last_item_id"] = next_id
+    await journal.snapshot(lambda: state)
+
+    for _ in range(tail):
+        journal.append(
+            {
+                "op": "add",
+                "g": random.randrange(guilds),
+                "item": record(next_id),
+                "pos": items,
+                "spos": random.randint(0, items),
+            }
+        )
+        next_id += 1
+    await journal.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--tail", type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(build(directory, args.guilds, args.items, args.tail))
+        guilds, elapsed = timed_load(QueueJournal(directory), Item)
+        total = sum(len(g.queue) for g in guilds.values())
+        print(
+            f"restored {len(guilds)} guilds, {total} items, "
+            f"{args.tail} journal records in {elapsed:.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Time seeking into an Ogg Opus file with and without its page index.
+
+Writes a temp file of dummy 20ms packets, builds its page index, then
+opens it at a few positions both through the index and by skipping every
+packet before the position (what starting part way through used to cost).
+
+    python -m benchmarks.seek --minutes 60
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.station import write_ogg
+from cogs.opus import OPUS_RATE, OggOpusSource, build_page_index, page_index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=60)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "track.opus")
+        write_ogg(path, int(args.minutes * 60 * 50))
+
+        start = time.perf_counter()
+        index = build_page_index(path)
+        build = (time.perf_counter() - start) * 1000
+        print(f"index: {len(index)} pages in {build:.1f}ms")
+        page_index(path)
+
+        length = args.minutes * 60
+        for fraction in (0.1, 0.5, 0.99):
+            target = length * fraction
+            start = time.perf_counter()
+            source = OggOpusSource(path, target)
+            source.read()
+            indexed = (time.perf_counter() - start) * 1000
+            source.cleanup()
+
+            start = time.perf_counter()
+            source = OggOpusSource(path)
+            source.start = int(target * OPUS_RATE)
+            source.read()
+            linear = (time.perf_counter() - start) * 1000
+            source.cleanup()
+            print(
+                f"seek to {target:.0f}s: {indexed:.2f}ms indexed, "
+                f"{linear:.2f}ms skipping packets"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Time shared stations against one source per guild as listeners grow.
+
+Writes a temp Ogg Opus file of dummy 20ms packets, then plays it to
+every guild, first through a source per guild (what each idle guild used
+to open) and then through one station they all listen to. For each
+number of guilds it prints the time one 20ms tick takes across all of
+them and how many packets were read from the file. Ogg passthrough is
+cheap either way; what the read count stands for is the number of
+ffmpeg encodes running for files that aren't Opus yet.
+
+    python -m benchmarks.station --guilds 1,10,100,500
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import List, Optional, Sequence
+
+import discord
+
+from cogs.opus import OGG_PAGE_HEADER, OggOpusSource
+from cogs.station import Station
+
+# celt fullband stereo, 20ms per packet
+PACKET = bytes([0xFC]) + os.urandom(120)
+PACKETS_PER_PAGE = 50
+
+
+def write_ogg(path: str, packets: int) -> None:
+    def page(body: List[bytes], flags: int, granule: int, seqno: int) -> bytes:
+        segments = bytes(len(p) for p in body)
+        header = OGG_PAGE_HEADER.pack(
+            b"OggS", 0, flags, granule, 1, seqno, 0, len(segments)
+        )
+        return header + segments + b"".join(body)
+
+    with open(path, "wb") as f:
+        f.write(page([b"OpusHead" + bytes(11)], 2, 0, 0))
+        f.write(page([b"OpusTags" + bytes(8)], 0, 0, 1))
+        for seqno, first in enumerate(range(0, packets, PACKETS_PER_PAGE), 2):
+            count = min(PACKETS_PER_PAGE, packets - first)
+            f.write(page([PACKET] * count, 0, (first + count) * 960, seqno))
+
+
+class Counted(discord.AudioSource):
+    def __init__(self, source: discord.AudioSource, reads: List[int]) -> None:
+        self.source = source
+        self.reads = reads
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        self.reads[0] += 1
+        return self.source.read()
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+
+
+def tick_time(sources: Sequence[Optional[discord.AudioSource]], ticks: int) -> float:
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for source in sources:
+            assert source is not None
+            source.read()
+    return (time.perf_counter() - start) * 1000 / ticks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", default="1,10,100,500")
+    parser.add_argument("--ticks", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "track.opus")
+        write_ogg(path, args.ticks + 10)
+        for guilds in (int(n) for n in args.guilds.split(",")):
+            reads = [0]
+            separate = [Counted(OggOpusSource(path), reads) for _ in range(guilds)]
+            tick = tick_time(separate, args.ticks)
+            for source in separate:
+                source.cleanup()
+            print(
+                f"{guilds} guilds, source each: {tick:.3f}ms per tick, "
+                f"{reads[0] / args.ticks:.0f} reads per tick"
+            )
+
+            reads = [0]
+            station = Station("bench", lambda: Counted(OggOpusSource(path), reads))
+            # its first track opens on a thread of its own, wait for that
+            while station.source is None:
+                station.frame(station.seq)
+                time.sleep(0.001)
+            listeners = [station.listen() for _ in range(guilds)]
+            tick = tick_time(listeners, args.ticks)
+            for listener in listeners:
+                assert listener is not None
+                listener.cleanup()
+            print(
+                f"{guilds} guilds, one station: {tick:.3f}ms per tick, "
+                f"{reads[0] / args.ticks:.0f} reads per tick"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from discord.ext import commands
 import os
 from dotenv import load_dotenv
 import asyncio
+import ast
 
 load_dotenv()
 
@@ -10,7 +11,32 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+
+def member_cache_flags() -> discord.MemberCacheFlags:
+    """Which members stay cached, from ``MEMBER_CACHE``.
+
+    ``voice`` (the default) keeps only members in voice channels, which is
+    all playback needs; ``joined`` also keeps members seen joining or
+    speaking; ``all`` keeps everyone. Commands that need the full list,
+    like /avatars, page through it on demand instead.
+    """
+    policy = os.getenv("MEMBER_CACHE", "voice")
+    if policy == "all":
+        return discord.MemberCacheFlags.all()
+    flags = discord.MemberCacheFlags.none()
+    flags.voice = True
+    if policy == "joined":
+        flags.joined = True
+    return flags
+
+
+bot = commands.Bot(
+    command_prefix="!",
+    intents=intents,
+    member_cache_flags=member_cache_flags(),
+    chunk_guilds_at_startup=False,
+)
 
 
 @bot.event
@@ -24,9 +50,27 @@ async def on_ready() -> None:
         print(f"failed to sync commands: {e}")
 
 
+def is_extension(path: str) -> bool:
+    """Whether a module in cogs/ is a cog with a ``setup``, read from its source.
+
+    The rest are helper modules holding shared state (the converter, the
+    mixers, metrics); load_extension would execute a second copy of them
+    next to the one the cogs import, so they're left to plain imports.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    return any(
+        isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+        and node.name == "setup"
+        for node in tree.body
+    )
+
+
 async def load_extensions() -> None:
     for filename in os.listdir("./cogs"):
         if filename.endswith(".py") and not filename.startswith("_"):
+            if not is_extension(os.path.join("./cogs", filename)):
+                continue
             try:
                 await bot.load_extension(f"cogs.{filename[:-3]}")
                 print(f"loaded {filename}")
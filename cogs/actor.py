@@ -0,0 +1,80 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .metrics import metrics
+
+Handler = Callable[..., Any]
+Message = Tuple[str, Tuple[Any, ...], Optional["asyncio.Future[Any]"], float]
+
+
+class GuildActor:
+    """Runs one guild's playback commands one at a time on the event loop.
+
+    Commands and player events go into an inbox and are handled in order
+    by plain (non-async) handlers, so none of them can interleave with
+    another and nothing outside the loop touches the guild's state.
+    Audio player threads post into the inbox with ``send_threadsafe``.
+
+    ``token`` is bumped every time the guild starts something new; events
+    carry the token they were issued under and stale ones are dropped, so
+    e.g. the after callback of a track that was skipped can't advance the
+    queue a second time.
+
+    Once closed, whatever was still waiting in the inbox is dropped and its
+    callers get a cancelled future, as does anyone asking after that.
+    """
+
+    def __init__(self, guild_id: int, handlers: Dict[str, Handler]) -> None:
+        self.guild_id: int = guild_id
+        self.handlers = handlers
+        self.token: int = 0
+        self.inbox: "asyncio.Queue[Message]" = asyncio.Queue()
+        self.closed: bool = False
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self.run())
+
+    def next_token(self) -> int:
+        self.token += 1
+        return self.token
+
+    def send(self, name: str, *args: Any) -> None:
+        """Queue a command without waiting for it. Loop thread only."""
+        if self.closed:
+            return
+        self.inbox.put_nowait((name, args, None, time.perf_counter()))
+
+    def send_threadsafe(self, name: str, *args: Any) -> None:
+        """Queue a command from any thread."""
+        self.loop.call_soon_threadsafe(self.send, name, *args)
+
+    def ask(self, name: str, *args: Any) -> "asyncio.Future[Any]":
+        """Queue a command; the future resolves to what its handler returns."""
+        fut = self.loop.create_future()
+        if self.closed:
+            fut.cancel()
+            return fut
+        self.inbox.put_nowait((name, args, fut, time.perf_counter()))
+        return fut
+
+    async def run(self) -> None:
+        while True:
+            name, args, fut, sent_at = await self.inbox.get()
+            metrics.record("command_wait", (time.perf_counter() - sent_at) * 1000)
+            try:
+                result = self.handlers[name](self.guild_id, *args)
+            except Exception as e:
+                print(f"error handling {name} in guild {self.guild_id}: {e}")
+                if fut is not None and not fut.done():
+                    fut.set_exception(e)
+                continue
+            if fut is not None and not fut.done():
+                fut.set_result(result)
+
+    def close(self) -> None:
+        self.closed = True
+        self.task.cancel()
+        while not self.inbox.empty():
+            _, _, fut, _ = self.inbox.get_nowait()
+            if fut is not None:
+                fut.cancel()
@@ -1,22 +1,55 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import aiohttp
-import zipfile
-from pathlib import Path
 import asyncio
-from PIL import Image
-import io
+import os
+import time
+from typing import AsyncIterator, Dict, List, Tuple
+
+from .avatar_cache import AvatarCache
+from .avatar_encode import AVATAR_SIZE, AvatarEncoder
+from .avatar_fetch import AvatarFetcher
+from .avatar_zip import Part, SplitZipWriter
+from .members import member_pages
+
+# seconds between progress message edits, edits are rate limited too
+PROGRESS_INTERVAL = 2.0
+# room left under the upload limit for the multipart request around the zip
+UPLOAD_MARGIN = 64 * 1024
+
+
+def avatar_source(member: discord.Member) -> Tuple[str, str]:
+    """Url to fetch the member's avatar from and its key in the avatar cache."""
+    asset = member.display_avatar
+    if member.avatar is None and member.guild_avatar is None:
+        # default avatars only exist as png
+        return asset.url, AvatarCache.cache_key(asset.key, AVATAR_SIZE, "png")
+    # ask the cdn for a jpeg at the final size so it can go in the zip as-is
+    return (
+        asset.with_format("jpg").with_size(AVATAR_SIZE).url,
+        AvatarCache.cache_key(asset.key, AVATAR_SIZE, "jpg"),
+    )
 
 
 class Avatars(commands.Cog):
     def __init__(self, bot) -> None:
         self.bot = bot
+        self.encoder = AvatarEncoder()
+        self.cache = AvatarCache(
+            "avatar_cache",
+            int(os.getenv("AVATAR_CACHE_MAX_MB", "512")) * 1024 * 1024,
+        )
+
+    async def cog_unload(self) -> None:
+        self.encoder.shutdown()
+        await asyncio.to_thread(self.cache.close)
 
     @app_commands.command(
         name="avatars", description="download all server avatars as zip"
     )
-    async def avatars(self, interaction: discord.Interaction):
+    async def avatars(
+        self, interaction: discord.Interaction, changed_only: bool = False
+    ):
         print("=== AVATARS COMMAND STARTED ===")
 
         await interaction.response.defer()
@@ -26,117 +59,149 @@ class Avatars(commands.Cog):
             await interaction.followup.send("only works in servers")
             return
 
-        print(f"guild: {interaction.guild.name}")
-        print(f"members before chunk: {len(interaction.guild.members)}")
-
-        try:
-            print("starting chunk with timeout...")
-            await asyncio.wait_for(interaction.guild.chunk(), timeout=30.0)
-            print("chunk completed")
-        except asyncio.TimeoutError:
-            print("chunk timed out, using cached members only")
-            await interaction.followup.send(
-                "using cached members only (some may be missing)"
-            )
-        except discord.HTTPException as e:
-            if e.status == 429:
-                print(f"rate limited: {e}")
-                await interaction.followup.send(
-                    "got rate limited, try again in a minute"
-                )
-                return
-            else:
-                print(f"http error during chunk: {e}")
-                await interaction.followup.send(f"discord api error: {e}")
-                return
-        except Exception as e:
-            print(f"chunk failed: {e}")
-            await interaction.followup.send(f"failed to load members: {e}")
-            return
-
-        print(f"members after chunk: {len(interaction.guild.members)}")
-
-        temp_dir = Path("temp_avatars")
-        temp_dir.mkdir(exist_ok=True)
+        guild = interaction.guild
+        print(f"guild: {guild.name}, ~{guild.member_count} members")
 
         downloaded = 0
         failed = 0
-
-        try:
-            async with aiohttp.ClientSession() as session:
-                for member in interaction.guild.members:
+        unchanged = 0
+        cached = 0
+        parts = 0
+
+        previous = (
+            await asyncio.to_thread(self.cache.manifest, guild.id)
+            if changed_only
+            else {}
+        )
+        total = guild.member_count or 0
+        progress = await interaction.followup.send(
+            f"fetching avatars: 0/{total}", wait=True
+        )
+        last_edit = time.monotonic()
+        writer = SplitZipWriter(guild.filesize_limit - UPLOAD_MARGIN)
+        # finished zip parts waiting to be uploaded
+        ready: List[Part] = []
+
+        def add(name: str, data: bytes) -> None:
+            nonlocal downloaded
+            part = writer.add(name, data)
+            if part is not None:
+                ready.append(part)
+            downloaded += 1
+
+        async def upload() -> None:
+            nonlocal parts
+            while ready:
+                name, fp = ready.pop(0)
+                try:
+                    await interaction.followup.send(
+                        file=discord.File(fp, filename=name)
+                    )
+                    parts += 1
+                finally:
+                    fp.close()
+
+        # member id -> avatar cache key, written back as this guild's manifest
+        exported: Dict[int, str] = {}
+        # zip entry name -> (member id, cache key) for images still in flight
+        wanted: Dict[str, Tuple[int, str]] = {}
+
+        async def jobs() -> AsyncIterator[Tuple[str, str]]:
+            """Fetch jobs for avatars that aren't cached, page by page."""
+            nonlocal unchanged, cached
+            async for page in member_pages(guild):
+                for member in page:
                     if member.bot:
                         continue
+                    url, key = avatar_source(member)
+                    if previous.get(member.id) == key:
+                        unchanged += 1
+                        continue
+                    name = f"{member.name}_{member.id}"
+                    hit = await asyncio.to_thread(self.cache.get, key)
+                    if hit is None:
+                        wanted[name] = (member.id, key)
+                        yield name, url
+                        continue
+                    add(f"{name}.{hit[0]}", hit[1])
+                    exported[member.id] = key
+                    cached += 1
+
+        async def fetched() -> AsyncIterator[Tuple[str, bytes, str]]:
+            nonlocal failed
+            async for name, result in fetcher.fetch_many(jobs()):
+                if result is None:
+                    wanted.pop(name, None)
+                    failed += 1
+                else:
+                    yield name, result[0], result[1]
 
-                    print(f"trying to download {member.name}")
-
-                    avatar_url = member.display_avatar.with_size(256).url
-
-                    filename = f"{member.name}_{member.id}.jpg"
-                    filepath = temp_dir / filename
-
+        try:
+            async with AvatarFetcher[str]() as fetcher:
+                async for filename, data in self.encoder.encode_all(fetched()):
+                    # images that failed to encode come back under their bare name
+                    name, ext = (
+                        (filename, "") if data is None else os.path.splitext(filename)
+                    )
                     try:
-                        async with session.get(avatar_url) as resp:
-                            if resp.status == 200:
-                                data = await resp.read()
-
-                                try:
-                                    img = Image.open(io.BytesIO(data))
-                                    img = img.convert("RGB")
-                                    img.save(
-                                        filepath, "JPEG", quality=70, optimize=True
-                                    )
-                                    downloaded += 1
-                                    print(f"saved {member.name}")
-                                except Exception as e:
-                                    print(
-                                        f"image processing failed for {member.name}: {e}"
-                                    )
-                                    failed += 1
-                            else:
-                                print(f"bad status {resp.status} for {member.name}")
-                                failed += 1
-                    except Exception as e:
-                        print(f"download failed for {member.name}: {e}")
-                        failed += 1
-
-            print(f"downloaded: {downloaded}, failed: {failed}")
-
+                        if data is None:
+                            failed += 1
+                        else:
+                            member_id, key = wanted[name]
+                            await asyncio.to_thread(self.cache.put, key, ext[1:], data)
+                            exported[member_id] = key
+                            add(filename, data)
+                    finally:
+                        wanted.pop(name, None)
+                    await upload()
+
+                    if time.monotonic() - last_edit >= PROGRESS_INTERVAL:
+                        last_edit = time.monotonic()
+                        await progress.edit(
+                            content=f"fetching avatars: "
+                            f"{downloaded + failed + unchanged}/{total}"
+                        )
+
+            print(f"downloaded: {downloaded} ({cached} cached), failed: {failed}")
+            await asyncio.to_thread(self.cache.save_manifest, guild.id, exported)
+            await asyncio.to_thread(self.cache.commit)
             if downloaded == 0:
-                await interaction.followup.send("couldn't download any avatars")
-                temp_dir.rmdir()
+                await progress.edit(
+                    content="no avatars changed since last time"
+                    if unchanged
+                    else "couldn't download any avatars"
+                )
                 return
 
-            zip_path = Path("server_avatars.zip")
-            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for file in temp_dir.iterdir():
-                    zipf.write(file, file.name)
-
-            file_size = zip_path.stat().st_size
-            print(f"zip size: {file_size / (1024 * 1024):.2f}mb")
+            part = writer.finish()
+            if part is not None:
+                ready.append(part)
+            await upload()
+            summary = (
+                f"got {downloaded} avatars in {parts} "
+                f"zip{'s' if parts != 1 else ''} ({failed} failed"
+            )
+            if unchanged:
+                summary += f", {unchanged} unchanged"
+            await progress.edit(content=f"{summary})")
 
-            if file_size > 25 * 1024 * 1024:
-                await interaction.followup.send("zip too big, try with fewer members")
-            else:
+        except discord.HTTPException as e:
+            print(f"http error during avatars: {e}")
+            if e.status == 429:
                 await interaction.followup.send(
-                    f"got {downloaded} avatars",
-                    file=discord.File(zip_path, filename="avatars.zip"),
+                    "got rate limited, try again in a minute"
                 )
-
-            for file in temp_dir.iterdir():
-                file.unlink()
-            temp_dir.rmdir()
-            if zip_path.exists():
-                zip_path.unlink()
-
+            else:
+                await interaction.followup.send(f"discord api error: {e}")
         except Exception as e:
             print(f"overall error: {e}")
             await interaction.followup.send(f"something went wrong: {e}")
-
-            if temp_dir.exists():
-                for file in temp_dir.iterdir():
-                    file.unlink()
-                temp_dir.rmdir()
+        finally:
+            for _, fp in ready:
+                fp.close()
+            part = writer.finish()
+            if part is not None:
+                part[1].close()
 
 
 async def setup(bot):
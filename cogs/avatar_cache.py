@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class AvatarCache:
+    """Processed avatars on disk, addressed by discord's avatar hash.
+
+    An avatar's key only changes when its owner uploads a new one, so a
+    cached image stays valid forever and repeat exports only fetch what
+    changed. Files are named ``<key>_<size>.<ext>`` and indexed in SQLite
+    with their size and last access; the least recently used are deleted
+    once the total passes ``max_bytes``. Each guild's last export is kept
+    as a manifest of member id to avatar key, so an export can be limited
+    to members whose avatar changed since.
+
+    Every method blocks on disk or SQLite, so the cog calls them from
+    worker threads; ``lock`` keeps those off the connection together.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir: str = cache_dir
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            os.path.join(cache_dir, "index.db"), check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS avatars (
+                key TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS avatars_accessed ON avatars (accessed_at)"
+        )
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS manifests (
+                guild_id INTEGER NOT NULL,
+                member_id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (guild_id, member_id)
+            )
+            """
+        )
+        self.db.commit()
+        row = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM avatars").fetchone()
+        self.total_bytes: int = row[0]
+
+    @staticmethod
+    def cache_key(avatar_key: str, size: int, fmt: str) -> str:
+        return f"{avatar_key}_{size}_{fmt}"
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        """Extension and bytes of the cached image, if there is one."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT file FROM avatars WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            try:
+                with open(os.path.join(self.cache_dir, row[0]), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                self.db.execute("DELETE FROM avatars WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self.db.execute(
+                "UPDATE avatars SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+        return os.path.splitext(row[0])[1][1:], data
+
+    def put(self, key: str, ext: str, data: bytes) -> None:
+        filename = f"{key}.{ext}"
+        tmp = os.path.join(self.cache_dir, f"{filename}.tmp")
+        with self.lock:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.cache_dir, filename))
+            old = self.db.execute(
+                "SELECT size FROM avatars WHERE key = ?", (key,)
+            ).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.db.execute(
+                "INSERT OR REPLACE INTO avatars VALUES (?, ?, ?, ?)",
+                (key, filename, len(data), time.time()),
+            )
+            self.total_bytes += len(data)
+
+    def evict(self) -> None:
+        """Delete the least recently used down to ``max_bytes``, holding ``lock``."""
+        rows = self.db.execute(
+            "SELECT key, file, size FROM avatars ORDER BY accessed_at"
+        ).fetchall()
+        for key, filename, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                pass
+            self.db.execute("DELETE FROM avatars WHERE key = ?", (key,))
+            self.total_bytes -= size
+
+    def manifest(self, guild_id: int) -> Dict[int, str]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT member_id, key FROM manifests WHERE guild_id = ?", (guild_id,)
+            )
+            return dict(rows)
+
+    def save_manifest(self, guild_id: int, keys: Dict[int, str]) -> None:
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO manifests VALUES (?, ?, ?)",
+                [(guild_id, member_id, key) for member_id, key in keys.items()],
+            )
+
+    def commit(self) -> None:
+        """Evict down to size and write out everything since the last commit."""
+        with self.lock:
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            self.db.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.commit()
+            self.db.close()
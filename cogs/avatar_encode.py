@@ -0,0 +1,108 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from PIL import Image
+
+AVATAR_SIZE = 256
+
+# content types the cdn can hand back that go into the zip untouched
+PASSTHROUGH: Dict[str, str] = {
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+}
+
+Batch = List[Tuple[str, bytes]]
+
+
+def _encode_one(data: bytes) -> bytes:
+    img = Image.open(io.BytesIO(data))
+    img = img.convert("RGB")
+    if max(img.size) > AVATAR_SIZE:
+        img.thumbnail((AVATAR_SIZE, AVATAR_SIZE))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=70, optimize=True)
+    return out.getvalue()
+
+
+def encode_batch(batch: Batch) -> List[Tuple[str, Optional[bytes]]]:
+    """Re-encode a batch of images to JPEG, runs in a worker process."""
+    results: List[Tuple[str, Optional[bytes]]] = []
+    for name, data in batch:
+        try:
+            results.append((f"{name}.jpg", _encode_one(data)))
+        except Exception as e:
+            print(f"image processing failed for {name}: {e}")
+            results.append((name, None))
+    return results
+
+
+class AvatarEncoder:
+    """Re-encodes downloaded avatars on a pool of worker processes.
+
+    Images are sent over in batches of ``batch_size`` to keep pickling
+    overhead down, with at most ``max_pending`` batches queued so memory
+    stays bounded while downloads outpace the encoders. Images the CDN
+    already served as JPEG or WebP skip the pool entirely.
+    """
+
+    def __init__(self, workers: Optional[int] = None, batch_size: int = 16) -> None:
+        self.workers: int = workers or int(
+            os.getenv("AVATAR_WORKERS", str(os.cpu_count() or 2))
+        )
+        self.batch_size: int = batch_size
+        self.max_pending: int = self.workers * 2
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def encode_all(
+        self, images: AsyncIterator[Tuple[str, bytes, str]]
+    ) -> AsyncIterator[Tuple[str, Optional[bytes]]]:
+        """Turn ``(name, data, content_type)`` into ``(filename, jpeg)``.
+
+        Results come back in completion order, as soon as their batch is
+        done, while later images are still arriving. A None payload means
+        that image couldn't be decoded.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        pending: Set["asyncio.Future[List[Tuple[str, Optional[bytes]]]]"] = set()
+        batch: Batch = []
+
+        async for name, data, content_type in images:
+            ext = PASSTHROUGH.get(content_type)
+            if ext is not None:
+                yield f"{name}.{ext}", data
+            else:
+                batch.append((name, data))
+                if len(batch) >= self.batch_size:
+                    pending.add(loop.run_in_executor(executor, encode_batch, batch))
+                    batch = []
+
+            if len(pending) >= self.max_pending:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in [f for f in pending if f.done()]:
+                pending.discard(fut)
+                for result in fut.result():
+                    yield result
+
+        if batch:
+            pending.add(loop.run_in_executor(executor, encode_batch, batch))
+        for fut in asyncio.as_completed(pending):
+            for result in await fut:
+                yield result
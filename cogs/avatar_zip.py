@@ -0,0 +1,74 @@
+import tempfile
+import zipfile
+from typing import IO, List, Optional, Tuple
+
+# fixed per-entry overhead of a stored zip member: local file header plus
+# its central directory record, each followed by the file name
+LOCAL_HEADER_SIZE = 30
+CENTRAL_HEADER_SIZE = 46
+END_RECORD_SIZE = 22
+
+# keep in memory up to this much of each part before spilling to disk
+SPOOL_SIZE = 8 * 1024 * 1024
+
+Part = Tuple[str, IO[bytes]]
+
+
+class SplitZipWriter:
+    """Writes files into a run of zip archives that each stay under ``limit``.
+
+    Entries are stored, not deflated, since the images are already
+    compressed. The archive size is worked out from the zip layout as
+    entries go in, so a part is closed and handed back as soon as the
+    next entry wouldn't fit, without ever writing a temp directory or
+    re-reading anything. Parts live in spooled temp files that only touch
+    disk once they grow past ``SPOOL_SIZE``.
+    """
+
+    def __init__(self, limit: int, prefix: str = "avatars") -> None:
+        self.limit: int = limit
+        self.prefix: str = prefix
+        self.parts: int = 0
+        self.entries: int = 0
+        self._file: Optional[IO[bytes]] = None
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._size: int = END_RECORD_SIZE
+        self._names: List[str] = []
+
+    def _open(self) -> None:
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self._zip = zipfile.ZipFile(self._file, "w", zipfile.ZIP_STORED)
+        self._size = END_RECORD_SIZE
+
+    def _close(self, name: str) -> Part:
+        assert self._zip is not None and self._file is not None
+        self._zip.close()
+        part = self._file
+        part.seek(0)
+        self._zip = self._file = None
+        self.parts += 1
+        return name, part
+
+    def add(self, name: str, data: bytes) -> Optional[Part]:
+        """Add one file, returning the previous part if this one started a new one."""
+        cost = (
+            LOCAL_HEADER_SIZE + CENTRAL_HEADER_SIZE + 2 * len(name.encode()) + len(data)
+        )
+        finished = None
+        if self._zip is not None and self._size + cost > self.limit:
+            finished = self._close(f"{self.prefix}_part{self.parts + 1}.zip")
+        if self._zip is None:
+            self._open()
+        assert self._zip is not None
+        self._zip.writestr(name, data)
+        self._size += cost
+        self.entries += 1
+        return finished
+
+    def finish(self) -> Optional[Part]:
+        """Close the last part; named plainly if it's the only one."""
+        if self._zip is None:
+            return None
+        if self.parts == 0:
+            return self._close(f"{self.prefix}.zip")
+        return self._close(f"{self.prefix}_part{self.parts + 1}.zip")
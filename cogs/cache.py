@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Union
+
+from .loudness import remove_sidecar
+from .opus import remove_page_index
+
+# seconds index changes are batched for before index.json is rewritten
+INDEX_FLUSH_DELAY = float(os.getenv("CACHE_INDEX_FLUSH_SECONDS", "5"))
+
+YOUTUBE_ID = re.compile(
+    r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/|/v/)([A-Za-z0-9_-]{11})"
+)
+
+
+def canonical_key(url: str) -> str:
+    """Cache key for a url: the video id for youtube links, a hash otherwise.
+
+    ``youtu.be/x``, ``watch?v=x&t=30`` and playlist-context links to the
+    same video all map to ``x``.
+    """
+    match = YOUTUBE_ID.search(url)
+    if match:
+        return match.group(1)
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+def remove_files(paths: List[str]) -> None:
+    """Delete evicted cache files along with their sidecars and page indexes."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        remove_sidecar(path)
+        remove_page_index(path)
+
+
+class AudioCache:
+    """Size-bounded audio file cache with an on-disk index.
+
+    The index maps each key to its file, size, last access time and hit
+    count. When the total size goes over ``max_bytes``, entries are evicted
+    by least recent access (``lru``) or fewest hits (``lfu``), skipping any
+    file ``pinned`` reports as queued or playing.
+
+    Lookups and records only mark the index dirty. It's written out on a
+    worker thread ``INDEX_FLUSH_DELAY`` seconds later, along with whatever
+    else changed meanwhile, and evicted files are deleted off the loop.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int,
+        policy: str = "lru",
+        pinned: Optional[Callable[[], Set[str]]] = None,
+    ) -> None:
+        self.cache_dir: str = cache_dir
+        self.max_bytes: int = max_bytes
+        self.policy: str = policy if policy in ("lru", "lfu") else "lru"
+        self.pinned = pinned
+        self.index_path: str = os.path.join(cache_dir, "index.json")
+        self.entries: Dict[str, Dict[str, Union[str, int, float]]] = {}
+        self.total_bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.lock = threading.RLock()
+        self.dirty: bool = False
+        self.flush_task: Optional[asyncio.Task[None]] = None
+        self._save_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.opus")
+
+    def load(self) -> None:
+        try:
+            with open(self.index_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+
+        entries: Dict[str, Dict[str, Union[str, int, float]]] = {}
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            if filename.endswith(".part"):
+                # left over from a download that never finished
+                os.remove(path)
+                continue
+            if not filename.endswith(".opus"):
+                continue
+            key = filename[: -len(".opus")]
+            st = os.stat(path)
+            entry = saved.get(key) or {"last_access": st.st_mtime, "hits": 0}
+            entry["file"] = filename
+            entry["size"] = st.st_size
+            entries[key] = entry
+
+        with self.lock:
+            self.entries = entries
+            self.total_bytes = sum(int(e["size"]) for e in entries.values())
+        self.save()
+        print(
+            f"youtube cache: {len(entries)} files, "
+            f"{self.total_bytes / (1024 * 1024):.1f}mb"
+        )
+
+    def save(self) -> None:
+        with self._save_lock:
+            with self.lock:
+                data = json.dumps(self.entries)
+            tmp = f"{self.index_path}.tmp"
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, self.index_path)
+
+    def mark_dirty(self) -> None:
+        """Have the index written out soon. Loop thread only."""
+        self.dirty = True
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> None:
+        await asyncio.sleep(INDEX_FLUSH_DELAY)
+        while self.dirty:
+            self.dirty = False
+            await asyncio.to_thread(self.save)
+
+    async def close(self) -> None:
+        """Write out index changes still waiting for their flush."""
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        if self.dirty:
+            self.dirty = False
+            await asyncio.to_thread(self.save)
+
+    def lookup(self, url: str) -> Optional[str]:
+        """Cached file for ``url``, counting the hit or miss."""
+        key = canonical_key(url)
+        path = self.path_for(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or not os.path.exists(path):
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["hits"] = int(entry["hits"]) + 1
+            entry["last_access"] = time.time()
+        self.mark_dirty()
+        return path
+
+    def record(self, path: str) -> None:
+        """Add a freshly written cache file to the index, then evict if needed."""
+        filename = os.path.basename(path)
+        key = filename[: -len(".opus")]
+        size = os.path.getsize(path)
+        with self.lock:
+            old = self.entries.get(key)
+            if old is not None:
+                self.total_bytes -= int(old["size"])
+            self.entries[key] = {
+                "file": filename,
+                "size": size,
+                "last_access": time.time(),
+                "hits": int(old["hits"]) if old else 0,
+            }
+            self.total_bytes += size
+        self.evict()
+
+    def evict(self) -> None:
+        removed: List[str] = []
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                self.mark_dirty()
+                return
+
+            pinned = self.pinned() if self.pinned else set()
+            if self.policy == "lfu":
+                order = sorted(
+                    self.entries.items(),
+                    key=lambda kv: (kv[1]["hits"], kv[1]["last_access"]),
+                )
+            else:
+                order = sorted(
+                    self.entries.items(), key=lambda kv: kv[1]["last_access"]
+                )
+
+            for key, entry in order:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                path = self.path_for(key)
+                if os.path.abspath(path) in pinned:
+                    continue
+                removed.append(path)
+                del self.entries[key]
+                self.total_bytes -= int(entry["size"])
+                self.evictions += 1
+                print(f"evicted {entry['file']} from youtube cache")
+        if removed:
+            asyncio.get_running_loop().run_in_executor(None, remove_files, removed)
+        self.mark_dirty()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
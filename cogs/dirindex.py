@@ -0,0 +1,225 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import random
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# how often the fallback re-stats the directory, in seconds
+POLL_INTERVAL = 2.0
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    path = ctypes.util.find_library("c")
+    if path is None:
+        return None
+    try:
+        libc = ctypes.CDLL(path, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class _Inotify:
+    """Non-blocking inotify watch on one directory."""
+
+    def __init__(self, directory: str) -> None:
+        assert _libc is not None
+        self.fd: int = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, "inotify_add_watch failed")
+
+    def read(self) -> Optional[List[Tuple[int, str]]]:
+        """Drain pending ``(mask, name)`` events; None means rescan."""
+        events: List[Tuple[int, str]] = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            offset = 0
+            while offset < len(buf):
+                _, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & (IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    return None
+                events.append((mask, os.fsdecode(name)))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class DirectoryIndex:
+    """In-memory listing of the audio files in one directory.
+
+    Names live in a list plus a name -> slot dict, so membership, adding,
+    removing (swap with the last slot) and picking a random file are all
+    O(1); the sorted listing is rebuilt only after something changed.
+    Changes are picked up from inotify where it's available, draining
+    whatever events queued up since the last lookup, and otherwise by
+    re-statting the directory every ``POLL_INTERVAL`` seconds and
+    rescanning it when its mtime moves.
+    """
+
+    def __init__(self, directory: str, extensions: Tuple[str, ...]) -> None:
+        self.directory: str = directory
+        self.extensions: Tuple[str, ...] = extensions
+        self.names: List[str] = []
+        self.slots: Dict[str, int] = {}
+        self.sorted_names: Optional[List[str]] = None
+        self.lock = threading.Lock()
+        self.watch: Optional[_Inotify] = None
+        self.dir_mtime: int = 0
+        self.next_poll: float = 0.0
+        os.makedirs(directory, exist_ok=True)
+        if _libc is not None:
+            try:
+                self.watch = _Inotify(directory)
+            except OSError as e:
+                print(f"inotify unavailable for {directory}, polling instead: {e}")
+        self.scan()
+
+    def _add(self, name: str) -> None:
+        if name in self.slots or not name.endswith(self.extensions):
+            return
+        self.slots[name] = len(self.names)
+        self.names.append(name)
+        self.sorted_names = None
+
+    def _discard(self, name: str) -> None:
+        slot = self.slots.pop(name, None)
+        if slot is None:
+            return
+        last = self.names.pop()
+        if slot < len(self.names):
+            self.names[slot] = last
+            self.slots[last] = slot
+        self.sorted_names = None
+
+    def scan(self) -> None:
+        """Rebuild the index from a full directory listing."""
+        with self.lock:
+            self._scan()
+
+    def _scan(self) -> None:
+        # with the lock held
+        self.dir_mtime = os.stat(self.directory).st_mtime_ns
+        self.names = []
+        self.slots = {}
+        self.sorted_names = None
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                self._add(entry.name)
+
+    def refresh(self) -> None:
+        """Apply any changes to the directory since the last refresh.
+
+        The lock is held from reading the events to applying them, so two
+        threads refreshing at once can't each take part of a batch and
+        apply them out of order.
+        """
+        with self.lock:
+            if self.watch is not None:
+                events = self.watch.read()
+                if events is None:
+                    self.watch.close()
+                    self.watch = None
+                    try:
+                        self.watch = _Inotify(self.directory)
+                    except OSError:
+                        pass
+                    self._scan()
+                    return
+                for mask, name in events:
+                    if mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._discard(name)
+                    elif mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE):
+                        self._add(name)
+                return
+
+            now = time.monotonic()
+            if now < self.next_poll:
+                return
+            self.next_poll = now + POLL_INTERVAL
+            if os.stat(self.directory).st_mtime_ns != self.dir_mtime:
+                self._scan()
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        self.refresh()
+        return name in self.slots
+
+    def listing(self) -> List[str]:
+        """Every indexed file name, sorted."""
+        self.refresh()
+        with self.lock:
+            if self.sorted_names is None:
+                self.sorted_names = sorted(self.names)
+            return self.sorted_names
+
+    def random_name(self) -> Optional[str]:
+        self.refresh()
+        with self.lock:
+            if not self.names:
+                return None
+            return random.choice(self.names)
+
+
+_indexes: Dict[str, DirectoryIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def directory_index(directory: str, extensions: Tuple[str, ...]) -> DirectoryIndex:
+    """The process-wide index for ``directory``, created on first use."""
+    key = os.path.abspath(directory)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DirectoryIndex(directory, extensions)
+        return index
@@ -1,5 +1,7 @@
 import os
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+
+from .dirindex import directory_index
 
 
 class Files:
@@ -9,6 +11,11 @@ class Files:
         os.makedirs(self.audio_dir, exist_ok=True)
         os.makedirs(self.bg_music_dir, exist_ok=True)
         self.valid_extensions: Tuple[str, ...] = (".mp3", ".wav", ".ogg", ".m4a")
+        # shared by every Files instance in the process
+        self.audio_index = directory_index(self.audio_dir, self.valid_extensions)
+        self.bg_music_index = directory_index(
+            self.bg_music_dir, self.valid_extensions
+        )
 
     def is_valid_audio(self, filename: str) -> bool:
         return filename.endswith(self.valid_extensions)
@@ -24,7 +31,10 @@ class Files:
         return os.path.exists(filepath)
 
     def list_audio_files(self) -> List[str]:
-        return [f for f in os.listdir(self.audio_dir) if self.is_valid_audio(f)]
+        return self.audio_index.listing()
 
     def list_bg_music_files(self) -> List[str]:
-        return [f for f in os.listdir(self.bg_music_dir) if self.is_valid_audio(f)]
+        return self.bg_music_index.listing()
+
+    def random_bg_music_file(self) -> Optional[str]:
+        return self.bg_music_index.random_name()
@@ -1,67 +1,198 @@
 import asyncio
-import random
+import heapq
+import os
+import threading
 import discord
-from typing import Dict
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from .files import Files
+from .mixer import IDLE_BLEND, mixers
+from .opus import open_source
+from .player import close_in_background
+from .station import stations
+
+# seconds of silence before background music starts
+IDLE_DELAY = 30.0
+# play background music as one station every idle guild tunes into, so
+# each track is read and encoded once however many guilds are listening
+IDLE_STATION = os.getenv("IDLE_STATION", "0") == "1"
 
 
 class Idle:
+    """Plays background music in voice channels that have gone quiet.
+
+    Every connected guild with nothing playing has a deadline ``IDLE_DELAY``
+    seconds out, kept in one heap for all guilds, and a single loop timer
+    is set for the earliest. Playback ending (the player's ``after``
+    callback) and ``update_activity`` push a guild's deadline back;
+    playback starting clears it. Superseded heap entries are skipped when
+    they surface instead of being removed.
+    """
+
     def __init__(self) -> None:
         self.files: Files = Files()
         self.idle_enabled: Dict[int, bool] = {}
-        self.idle_tasks: Dict[int, asyncio.Task[None]] = {}
-        self.last_activity: Dict[int, float] = {}
+        self.voice_clients: Dict[int, discord.VoiceClient] = {}
+        self.deadlines: Dict[int, float] = {}
+        self.heap: List[Tuple[float, int]] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.loop_thread: Optional[int] = None
+        # guilds whose idle track is being opened off the loop
+        self.opening: Set[int] = set()
 
     def set_idle_enabled(self, guild_id: int, enabled: bool) -> None:
         self.idle_enabled[guild_id] = enabled
+        if not enabled:
+            self.deadlines.pop(guild_id, None)
 
-    def update_activity(self, guild_id: int) -> None:
-        self.last_activity[guild_id] = asyncio.get_event_loop().time()
-
-    def start_idle_task(self, guild_id: int, voice_client: discord.VoiceClient) -> None:
-        if guild_id not in self.idle_tasks or self.idle_tasks[guild_id].done():
-            self.idle_enabled.setdefault(guild_id, True)
-            self.update_activity(guild_id)
-            self.idle_tasks[guild_id] = asyncio.create_task(
-                self.idle_loop(guild_id, voice_client)
-            )
-
-    def stop_idle_task(self, guild_id: int) -> None:
-        if guild_id in self.idle_tasks:
-            self.idle_tasks[guild_id].cancel()
-
-    async def idle_loop(self, guild_id: int, voice_client: discord.VoiceClient) -> None:
-        while True:
-            try:
-                await asyncio.sleep(5)
+    def attach(self, guild_id: int, voice_client: discord.VoiceClient) -> None:
+        """Start watching a guild the bot just joined voice in."""
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop_thread = threading.get_ident()
+        self.idle_enabled.setdefault(guild_id, True)
+        self.voice_clients[guild_id] = voice_client
+        self.update_activity(guild_id)
+
+    def detach(self, guild_id: int) -> None:
+        self.voice_clients.pop(guild_id, None)
+        self.deadlines.pop(guild_id, None)
 
-                if not voice_client.is_connected():
-                    break
+    def _call(self, fn: Callable[[int], None], guild_id: int) -> None:
+        # after callbacks run on the audio player thread
+        if self.loop is None:
+            return
+        if threading.get_ident() == self.loop_thread:
+            fn(guild_id)
+        else:
+            self.loop.call_soon_threadsafe(fn, guild_id)
+
+    def update_activity(self, guild_id: int) -> None:
+        """Restart the guild's countdown to idle music."""
+        self._call(self._arm, guild_id)
 
-                if not self.idle_enabled.get(guild_id, True):
-                    continue
+    def playback_started(self, guild_id: int) -> None:
+        self._call(self._disarm, guild_id)
 
-                if voice_client.is_playing():
-                    self.update_activity(guild_id)
-                    continue
+    def playback_ended(self, guild_id: int) -> None:
+        self._call(self._arm, guild_id)
 
-                current_time = asyncio.get_event_loop().time()
-                time_since_activity = current_time - self.last_activity.get(
-                    guild_id, current_time
-                )
+    def _disarm(self, guild_id: int) -> None:
+        self.deadlines.pop(guild_id, None)
 
-                if time_since_activity >= 30:
-                    bg_files = self.files.list_bg_music_files()
+    def _arm(self, guild_id: int) -> None:
+        if guild_id not in self.voice_clients or not self.idle_enabled.get(
+            guild_id, True
+        ):
+            return
+        assert self.loop is not None
+        deadline = self.loop.time() + IDLE_DELAY
+        self.deadlines[guild_id] = deadline
+        heapq.heappush(self.heap, (deadline, guild_id))
+        if self.timer is None or deadline < self.timer.when():
+            self._set_timer()
 
-                    if bg_files:
-                        track = random.choice(bg_files)
-                        filepath = self.files.get_bg_music_path(track)
-                        voice_client.play(discord.FFmpegPCMAudio(filepath))
-                        print(f"playing idle track: {track}")
-                        self.update_activity(guild_id)
+    def _set_timer(self) -> None:
+        assert self.loop is not None
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.heap:
+            deadline, guild_id = self.heap[0]
+            if self.deadlines.get(guild_id) == deadline:
+                self.timer = self.loop.call_at(deadline, self._fire)
+                return
+            heapq.heappop(self.heap)
 
-            except asyncio.CancelledError:
-                break
+    def _fire(self) -> None:
+        assert self.loop is not None
+        self.timer = None
+        now = self.loop.time()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, guild_id = heapq.heappop(self.heap)
+            if self.deadlines.get(guild_id) != deadline:
+                continue
+            del self.deadlines[guild_id]
+            try:
+                self.play_idle(guild_id)
             except Exception as e:
-                print(f"error in idle loop: {e}")
-                await asyncio.sleep(10)
+                print(f"error in idle player: {e}")
+        self._set_timer()
+
+    def idle_voice_client(self, guild_id: int) -> Optional[discord.VoiceClient]:
+        """The guild's voice client, if idle music should start in it now."""
+        voice_client = self.voice_clients.get(guild_id)
+        if voice_client is None or not self.idle_enabled.get(guild_id, True):
+            return None
+        if not voice_client.is_connected():
+            self.detach(guild_id)
+            return None
+        mixer = mixers.get(guild_id)
+        if mixer is not None and (mixer.has_input("idle") or not IDLE_BLEND):
+            # whatever is playing rearms us through its end callback
+            return None
+        return voice_client
+
+    def play_idle(self, guild_id: int) -> None:
+        if guild_id in self.opening:
+            return
+        voice_client = self.idle_voice_client(guild_id)
+        if voice_client is None:
+            return
+        if IDLE_STATION:
+            # the station opens its tracks on its own thread
+            source = stations.listen("idle", self.next_station_track)
+            print(f"guild {guild_id} tuned into the idle station")
+            self.play(guild_id, voice_client, source)
+            return
+        # opening can spawn ffmpeg, keep it off the loop
+        self.opening.add(guild_id)
+        asyncio.create_task(self.open_idle(guild_id))
+
+    async def open_idle(self, guild_id: int) -> None:
+        try:
+            opened = await asyncio.to_thread(self.open_random_track)
+        except Exception as e:
+            print(f"error in idle player: {e}")
+            return
+        finally:
+            self.opening.discard(guild_id)
+        if opened is None:
+            return
+        track, source = opened
+        voice_client = self.idle_voice_client(guild_id)
+        if voice_client is None:
+            # something started playing (or the bot left) meanwhile
+            close_in_background(source)
+            return
+        print(f"playing idle track: {track}")
+        self.play(guild_id, voice_client, source)
+
+    def open_random_track(self) -> Optional[Tuple[str, discord.AudioSource]]:
+        track = self.files.random_bg_music_file()
+        if track is None:
+            return None
+        return track, open_source(self.files.get_bg_music_path(track))
+
+    def play(
+        self,
+        guild_id: int,
+        voice_client: discord.VoiceClient,
+        source: discord.AudioSource,
+    ) -> None:
+        mixers.play(
+            guild_id,
+            voice_client,
+            "idle",
+            source,
+            duck=True,
+            on_end=lambda: self.playback_ended(guild_id),
+        )
+
+    def next_station_track(self) -> Optional[discord.AudioSource]:
+        """Next track of the shared idle station, on the station's own thread."""
+        track = self.files.random_bg_music_file()
+        if track is None:
+            return None
+        print(f"idle station up next: {track}")
+        return open_source(self.files.get_bg_music_path(track), opus=True)
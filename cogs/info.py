@@ -1,45 +1,24 @@
 import discord
 from discord.ext import commands
 from discord import app_commands, ui
-from mutagen import File
-from typing import Dict
+from .metrics import metrics
+from .tags import unknown_tags
+
+
+def format_duration(duration: str) -> str:
+    try:
+        dur_seconds = int(float(duration))
+    except Exception:
+        return "unknown"
+    minutes = dur_seconds // 60
+    seconds = dur_seconds % 60
+    return f"{minutes}:{seconds:02d}"
 
 
 class NowPlaying(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
 
-    def get_file_metadata(self, filepath: str) -> Dict[str, str]:
-        try:
-            audio = File(filepath)
-            if audio is None:
-                return {"title": "unknown", "artist": "unknown", "album": "unknown"}
-
-            title = "unknown"
-            artist = "unknown"
-            album = "unknown"
-
-            if audio.tags:
-                if "title" in audio.tags:
-                    title = str(audio.tags["title"][0])
-                elif "TIT2" in audio.tags:
-                    title = str(audio.tags["TIT2"])
-
-                if "artist" in audio.tags:
-                    artist = str(audio.tags["artist"][0])
-                elif "TPE1" in audio.tags:
-                    artist = str(audio.tags["TPE1"])
-
-                if "album" in audio.tags:
-                    album = str(audio.tags["album"][0])
-                elif "TALB" in audio.tags:
-                    album = str(audio.tags["TALB"])
-
-            return {"title": title, "artist": artist, "album": album}
-        except Exception as e:
-            print(f"error reading metadata: {e}")
-            return {"title": "unknown", "artist": "unknown", "album": "unknown"}
-
     @app_commands.command(name="info", description="show info about current song")
     async def info(self, interaction: discord.Interaction) -> None:
         if interaction.guild is None:
@@ -59,6 +38,7 @@ class NowPlaying(commands.Cog):
             return
 
         metadata = current.metadata
+        position = queue_cog.position(guild_id)
 
         class InfoLayout(ui.LayoutView):
             container = ui.Container(
@@ -75,15 +55,9 @@ class NowPlaying(commands.Cog):
             title = metadata.get("title", "unknown")
             uploader = metadata.get("uploader", "unknown")
 
-            duration_str = "unknown"
-            duration = metadata.get("duration", "0")
-            try:
-                dur_seconds = int(float(duration))
-                minutes = dur_seconds // 60
-                seconds = dur_seconds % 60
-                duration_str = f"{minutes}:{seconds:02d}"
-            except Exception:
-                pass
+            duration_str = format_duration(metadata.get("duration", "0"))
+            if position is not None:
+                duration_str = f"{format_duration(str(position))} / {duration_str}"
 
             layout.container.add_item(
                 ui.Section(
@@ -102,17 +76,48 @@ class NowPlaying(commands.Cog):
                 except Exception:
                     pass
         else:
-            file_meta = self.get_file_metadata(current.filepath)
+            # tags were read in the background when the file was queued
+            file_meta = {**unknown_tags(), **metadata}
+            duration_str = format_duration(metadata.get("duration", ""))
+            if position is not None:
+                duration_str = f"{format_duration(str(position))} / {duration_str}"
             layout.container.add_item(
                 ui.Section(
                     ui.TextDisplay(
-                        f"**{file_meta['title']}**\n{file_meta['artist']}\n\nalbum: {file_meta['album']}\nsource: uploaded file"
+                        f"**{file_meta['title']}**\n{file_meta['artist']}\n\nalbum: {file_meta['album']}\nduration: {duration_str}\nsource: uploaded file"
                     ),
                 )
             )
 
         await interaction.response.send_message(view=layout)
 
+    @app_commands.command(name="stats", description="show playback timing stats")
+    async def stats(self, interaction: discord.Interaction) -> None:
+        lines = []
+        for name in metrics.names():
+            summary = metrics.summary(name)
+            if summary is None:
+                continue
+            lines.append(
+                f"**{name.replace('_', ' ')}**\n"
+                f"p50 {summary['p50']:.0f}ms  •  p95 {summary['p95']:.0f}ms  •  "
+                f"max {summary['max']:.0f}ms  ({summary['count']:.0f} samples)"
+            )
+
+        if not lines:
+            await interaction.response.send_message("no stats recorded yet")
+            return
+
+        class StatsLayout(ui.LayoutView):
+            container = ui.Container(
+                ui.TextDisplay("## playback stats"),
+                ui.Separator(visible=True),
+                ui.TextDisplay("\n\n".join(lines)),
+                accent_color=0x5865F2,
+            )
+
+        await interaction.response.send_message(view=StatsLayout())
+
 
 async def setup(bot: commands.Bot) -> None:
     await bot.add_cog(NowPlaying(bot))
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import uuid
+from typing import List, Optional, Tuple
+
+import aiohttp
+import discord
+
+from .files import Files
+from .opus import converter
+
+CHUNK_SIZE = 64 * 1024
+# buffered chunks are handed to a worker thread once they add up to this
+WRITE_SIZE = 1024 * 1024
+MAX_UPLOAD = 25 * 1024 * 1024
+
+
+def sniff_format(header: bytes) -> Optional[str]:
+    """Extension matching the container in the first bytes of a file."""
+    if header.startswith(b"ID3"):
+        return ".mp3"
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return ".wav"
+    if header.startswith(b"OggS"):
+        return ".ogg"
+    if header[4:8] == b"ftyp":
+        return ".m4a"
+    # bare mpeg audio frame: 11 sync bits, then a valid layer
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0:
+        if header[1] & 0x06:
+            return ".mp3"
+    return None
+
+
+class IngestError(Exception):
+    pass
+
+
+class Ingest:
+    """Takes uploads into content-addressed storage.
+
+    An attachment is streamed to a temp file in chunks, hashed as it
+    arrives and checked against the header of a known audio container.
+    The content is stored once under ``<store>/<sha256[:2]>/<sha256><ext>``
+    and the name in the audio directory is a hard link to it, so the same
+    song uploaded twice takes no extra space. A conversion to Opus (or for
+    Ogg Opus uploads, just the loudness analysis) is queued on the shared
+    converter; it's keyed by inode, so every name linked to the same
+    content shares it.
+    """
+
+    def __init__(self, files: Files, store_dir: str = "audio_store") -> None:
+        self.files = files
+        self.store_dir: str = store_dir
+        self.tmp_dir: str = os.path.join(store_dir, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        for filename in os.listdir(self.tmp_dir):
+            # left over from an upload that never finished
+            os.remove(os.path.join(self.tmp_dir, filename))
+        self.prune()
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def prune(self) -> None:
+        """Delete stored content no name in the audio directory links to."""
+        for shard in os.listdir(self.store_dir):
+            shard_dir = os.path.join(self.store_dir, shard)
+            if shard_dir == self.tmp_dir or not os.path.isdir(shard_dir):
+                continue
+            for filename in os.listdir(shard_dir):
+                path = os.path.join(shard_dir, filename)
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+
+    def store_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.store_dir, digest[:2], f"{digest}{ext}")
+
+    async def _download(self, url: str, part: str) -> Tuple[str, bytes]:
+        """Stream ``url`` into ``part``, returning its sha256 and first bytes."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        sha = hashlib.sha256()
+        header = b""
+        size = 0
+        buffered: List[bytes] = []
+        buffered_size = 0
+        with open(part, "wb") as f:
+            async with self.session.get(url) as resp:
+                if resp.status != 200:
+                    raise IngestError(f"download failed with status {resp.status}")
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_UPLOAD:
+                        raise IngestError("file too big, 25mb max")
+                    if len(header) < 64:
+                        header += chunk[: 64 - len(header)]
+                        if len(header) >= 12 and sniff_format(header) is None:
+                            raise IngestError("that doesn't look like an audio file")
+                    sha.update(chunk)
+                    buffered.append(chunk)
+                    buffered_size += len(chunk)
+                    if buffered_size >= WRITE_SIZE:
+                        await asyncio.to_thread(f.writelines, buffered)
+                        buffered, buffered_size = [], 0
+            if buffered:
+                await asyncio.to_thread(f.writelines, buffered)
+            await asyncio.to_thread(os.fsync, f.fileno())
+        return sha.hexdigest(), header
+
+    def _place(
+        self, part: str, digest: str, ext: str, target: str
+    ) -> Tuple[bool, str]:
+        """Move the upload into the store and link ``target`` to it.
+
+        Returns whether the content was already stored, and the name it is
+        linked under in the audio directory (an older one for duplicates).
+        """
+        stored = self.store_path(digest, ext)
+        existed = os.path.exists(stored)
+        if existed:
+            os.remove(part)
+            st = os.stat(stored)
+            for name in self.files.list_audio_files():
+                try:
+                    other = os.stat(self.files.get_audio_path(name))
+                except FileNotFoundError:
+                    continue
+                if (other.st_dev, other.st_ino) == (st.st_dev, st.st_ino):
+                    return True, name
+        else:
+            os.makedirs(os.path.dirname(stored), exist_ok=True)
+            os.replace(part, stored)
+
+        tmp_link = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.link")
+        try:
+            os.link(stored, tmp_link)
+        except OSError:
+            # store on another filesystem, fall back to a plain copy
+            shutil.copyfile(stored, tmp_link)
+        os.replace(tmp_link, target)
+        return existed, os.path.basename(target)
+
+    async def ingest(self, attachment: discord.Attachment) -> Tuple[bool, str]:
+        """Store an uploaded file, returning (duplicate, name in audio dir)."""
+        if attachment.size > MAX_UPLOAD:
+            raise IngestError("file too big, 25mb max")
+        target = self.files.get_audio_path(attachment.filename)
+        part = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.part")
+        try:
+            digest, header = await self._download(attachment.url, part)
+            ext = sniff_format(header)
+            if ext is None:
+                raise IngestError("that doesn't look like an audio file")
+            duplicate, name = await asyncio.to_thread(
+                self._place, part, digest, ext, target
+            )
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+
+        converter.schedule(self.files.get_audio_path(name))
+        return duplicate, name
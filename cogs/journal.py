@@ -0,0 +1,252 @@
+import asyncio
+import gc
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .tracklist import GuildQueue, reserve_item_ids
+
+Record = Dict[str, Any]
+
+
+class GuildState:
+    __slots__ = ("queue", "current", "history", "loop_mode", "shuffle")
+
+    def __init__(self, guild_id: int) -> None:
+        self.queue = GuildQueue(guild_id)
+        self.current: Optional[Any] = None
+        self.history: Deque[Any] = deque()
+        self.loop_mode: str = "off"
+        self.shuffle: bool = False
+
+
+class QueueJournal:
+    """Write-ahead journal of queue mutations with periodic snapshots.
+
+    Mutations are appended to an in-memory batch from any thread and a
+    background task writes each batch to ``journal.<gen>.log`` in a worker
+    thread, so the event loop never waits on disk. Every
+    ``snapshot_every`` records the full state is written to
+    ``snapshot.json`` and the journal starts a new generation; restoring
+    loads the snapshot and replays the journals written after it.
+    """
+
+    def __init__(
+        self,
+        directory: str = "queue_state",
+        flush_interval: float = 0.5,
+        snapshot_every: int = 10000,
+    ) -> None:
+        self.directory: str = directory
+        self.flush_interval: float = flush_interval
+        self.snapshot_every: int = snapshot_every
+        self.snapshot_path: str = os.path.join(directory, "snapshot.json")
+        self.pending: List[str] = []
+        self.records_since_snapshot: int = 0
+        self.gen: int = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def journal_path(self, gen: int) -> str:
+        return os.path.join(self.directory, f"journal.{gen}.log")
+
+    def append(self, record: Record) -> None:
+        line = json.dumps(record, separators=(",", ":"))
+        with self.lock:
+            self.pending.append(line)
+
+    def _write(self, gen: int, lines: List[str]) -> None:
+        with open(self.journal_path(gen), "a") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def flush(self) -> None:
+        with self.lock:
+            lines, self.pending = self.pending, []
+            gen = self.gen
+        if lines:
+            try:
+                await asyncio.to_thread(self._write, gen, lines)
+            except Exception:
+                # keep them for the next flush, ahead of anything newer
+                with self.lock:
+                    self.pending[:0] = lines
+                raise
+            self.records_since_snapshot += len(lines)
+
+    def _write_snapshot(
+        self,
+        captured: Any,
+        build: Callable[[Any], Dict[str, Any]],
+        gen: int,
+        old_gens: List[int],
+    ) -> None:
+        state = build(captured)
+        state["gen"] = gen
+        tmp = f"{self.snapshot_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        for gen in old_gens:
+            try:
+                os.remove(self.journal_path(gen))
+            except FileNotFoundError:
+                pass
+
+    async def snapshot(
+        self,
+        capture: Callable[[], Any],
+        build: Callable[[Any], Dict[str, Any]] = lambda state: state,
+    ) -> None:
+        """Compact everything journaled so far into a new snapshot.
+
+        ``capture`` runs on the event loop and should only grab references
+        to the state, ``build`` turns those into the full state on the
+        worker thread that writes it. Any records still batched are
+        already part of it and are dropped.
+        """
+        await self.flush()
+        with self.lock:
+            captured = capture()
+            self.pending.clear()
+            old_gens = [g for g in self._journal_gens() if g <= self.gen]
+            self.gen += 1
+            gen = self.gen
+        await asyncio.to_thread(self._write_snapshot, captured, build, gen, old_gens)
+        self.records_since_snapshot = 0
+
+    async def run(
+        self,
+        capture: Callable[[], Any],
+        build: Callable[[Any], Dict[str, Any]] = lambda state: state,
+    ) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if self.records_since_snapshot >= self.snapshot_every:
+                    await self.snapshot(capture, build)
+            except Exception as e:
+                print(f"queue journal write failed: {e}")
+
+    def _journal_gens(self) -> List[int]:
+        gens = []
+        for filename in os.listdir(self.directory):
+            parts = filename.split(".")
+            if len(parts) == 3 and parts[0] == "journal" and parts[1].isdigit():
+                gens.append(int(parts[1]))
+        return sorted(gens)
+
+    def load(self) -> Tuple[Dict[str, Any], List[Record]]:
+        """Read the snapshot and every journal record written after it."""
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            snapshot = {"gen": 0, "guilds": {}}
+
+        records: List[Record] = []
+        gens = [g for g in self._journal_gens() if g >= snapshot.get("gen", 0)]
+        for gen in gens:
+            with open(self.journal_path(gen)) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # torn write from a crash mid-batch
+                        break
+        self.gen = max(gens + [snapshot.get("gen", 0)])
+        return snapshot, records
+
+
+def restore(
+    snapshot: Dict[str, Any],
+    records: List[Record],
+    make_item: Callable[[Dict[str, Any]], Any],
+) -> Dict[int, GuildState]:
+    """Rebuild every guild's state from a snapshot plus journal records."""
+    guilds: Dict[int, GuildState] = {}
+
+    def guild(guild_id: int) -> GuildState:
+        state = guilds.get(guild_id)
+        if state is None:
+            state = guilds[guild_id] = GuildState(guild_id)
+        return state
+
+    for key, data in snapshot.get("guilds", {}).items():
+        state = guild(int(key))
+        state.queue.bulk_load(
+            [make_item(d) for d in data.get("queue", [])], data.get("shuffled", [])
+        )
+        if data.get("current"):
+            state.current = make_item(data["current"])
+        state.history.extend(make_item(d) for d in data.get("history", []))
+        state.loop_mode = data.get("loop", "off")
+        state.shuffle = data.get("shuffle", False)
+
+    for record in records:
+        op = record["op"]
+        state = guild(record["g"])
+        if op == "add":
+            if record["item"]["id"] in state.queue:
+                # journaled before duplicate ids were refused
+                continue
+            state.queue.insert(make_item(record["item"]), record["pos"], record["spos"])
+        elif op == "remove":
+            state.queue.remove(record["id"])
+        elif op == "move":
+            state.queue.move(record["id"], record["pos"], record["shuffle"])
+        elif op == "reshuffle":
+            state.queue.bulk_load(list(state.queue), record["order"])
+        elif op == "clear":
+            state.queue.clear()
+        elif op == "current":
+            item = record["item"]
+            state.current = make_item(item) if item else None
+        elif op == "position":
+            if state.current is not None:
+                state.current.position = record["pos"]
+        elif op == "history_push":
+            state.history.append(make_item(record["item"]))
+            if len(state.history) > 50:
+                state.history.popleft()
+        elif op == "history_pop":
+            if state.history:
+                state.history.pop()
+        elif op == "history_clear":
+            state.history.clear()
+        elif op == "mode":
+            state.loop_mode = record["loop"]
+            state.shuffle = record["shuffle"]
+
+    reserve_item_ids(snapshot.get("last_item_id", 0))
+    for state in guilds.values():
+        for item in state.queue:
+            reserve_item_ids(item.item_id)
+        if state.current is not None:
+            reserve_item_ids(state.current.item_id)
+        for item in state.history:
+            reserve_item_ids(item.item_id)
+    return guilds
+
+
+def timed_load(
+    journal: QueueJournal, make_item: Callable[[Dict[str, Any]], Any]
+) -> Tuple[Dict[int, GuildState], float]:
+    """Load and restore, returning the guilds and the time it took in ms."""
+    start = time.perf_counter()
+    # hundreds of thousands of long-lived objects get allocated here, the
+    # cyclic gc would rescan them over and over for nothing
+    gc.disable()
+    try:
+        snapshot, records = journal.load()
+        guilds = restore(snapshot, records, make_item)
+    finally:
+        gc.enable()
+    return guilds, (time.perf_counter() - start) * 1000
@@ -0,0 +1,271 @@
+import asyncio
+import bisect
+import os
+import re
+import sqlite3
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from .dirindex import DirectoryIndex
+from .tags import read_tags
+
+NON_WORD = re.compile(r"[\W_]+")
+
+# autocomplete can only show this many choices
+MAX_RESULTS = 25
+
+Entry = Dict[str, str]
+
+
+def normalize(text: str) -> str:
+    return NON_WORD.sub(" ", text.casefold()).strip()
+
+
+def _keys(text: str) -> Iterator[str]:
+    """Index keys of a normalized text: 1 and 2 char token prefixes, trigrams."""
+    for token in set(text.split()):
+        yield token[:1]
+        if len(token) >= 2:
+            yield token[:2]
+        for i in range(len(token) - 2):
+            yield token[i : i + 3]
+
+
+class TrackSearch:
+    """Substring search over file names and tags, kept entirely in memory.
+
+    Every token of an entry's text is indexed by its trigrams and by its
+    one and two character prefixes. A query token of three or more
+    characters looks up the sets for its trigrams, a shorter one the set
+    for its prefix; the smallest sets are intersected first and survivors
+    are checked against the full text, so a keystroke costs a few set
+    operations however big the library is.
+    """
+
+    def __init__(self) -> None:
+        self.texts: Dict[str, str] = {}
+        self.keys: Dict[str, Set[str]] = {}
+
+    def add(self, name: str, text: str) -> None:
+        self.remove(name)
+        text = normalize(text)
+        self.texts[name] = text
+        for key in _keys(text):
+            self.keys.setdefault(key, set()).add(name)
+
+    def remove(self, name: str) -> None:
+        text = self.texts.pop(name, None)
+        if text is None:
+            return
+        for key in _keys(text):
+            names = self.keys.get(key)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.keys[key]
+
+    def candidates(self, tokens: List[str]) -> Set[str]:
+        """Names that may contain every token; check with ``matches``.
+
+        The returned set may be one of the index's own, don't modify it.
+        """
+        sets: List[Set[str]] = []
+        for token in tokens:
+            if len(token) < 3:
+                sets.append(self.keys.get(token, set()))
+            else:
+                for i in range(len(token) - 2):
+                    sets.append(self.keys.get(token[i : i + 3], set()))
+        sets.sort(key=len)
+        found = sets[0]
+        for names in sets[1:]:
+            if not found:
+                break
+            found = found & names
+        return found
+
+    def matches(self, name: str, tokens: List[str]) -> bool:
+        text = self.texts[name]
+        return all(token in text for token in tokens)
+
+
+class Library:
+    """Tag index of the uploaded audio files.
+
+    Title, artist, album and duration of each file are read once and kept
+    in SQLite next to its size and mtime, so a restart only re-reads files
+    that changed. Everything a command needs is answered from memory.
+    """
+
+    def __init__(self, index: DirectoryIndex, db_path: str) -> None:
+        self.index = index
+        self.entries: Dict[str, Entry] = {}
+        self.stamps: Dict[str, Tuple[int, int]] = {}
+        self.search_index = TrackSearch()
+        # normalized title and file stem, for ranking search results
+        self.heads: Dict[str, Tuple[str, str]] = {}
+        self.heads_index: Optional[List[Tuple[str, str]]] = None
+        self.sorted_names: Optional[List[str]] = None
+        self.sync_task: Optional["asyncio.Task[None]"] = None
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS library (
+                filename TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                album TEXT NOT NULL,
+                duration TEXT NOT NULL
+            )
+            """
+        )
+        self.db.commit()
+        for row in self.db.execute("SELECT * FROM library"):
+            filename, size, mtime_ns, title, artist, album, duration = row
+            self._remember(
+                filename,
+                (size, mtime_ns),
+                dict(title=title, artist=artist, album=album, duration=duration),
+            )
+
+    def _remember(self, filename: str, stamp: Tuple[int, int], entry: Entry) -> None:
+        self.entries[filename] = entry
+        self.stamps[filename] = stamp
+        self.heads[filename] = (
+            normalize(entry["title"]),
+            normalize(os.path.splitext(filename)[0]),
+        )
+        self.search_index.add(
+            filename,
+            f"{os.path.splitext(filename)[0]} {entry['title']} "
+            f"{entry['artist']} {entry['album']}",
+        )
+        self.sorted_names = self.heads_index = None
+
+    def _forget(self, filename: str) -> None:
+        self.entries.pop(filename, None)
+        self.stamps.pop(filename, None)
+        self.heads.pop(filename, None)
+        self.search_index.remove(filename)
+        self.db.execute("DELETE FROM library WHERE filename = ?", (filename,))
+        self.sorted_names = self.heads_index = None
+
+    def _store(self, filename: str, stamp: Tuple[int, int], entry: Entry) -> None:
+        self._remember(filename, stamp, entry)
+        self.db.execute(
+            "INSERT OR REPLACE INTO library VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                filename,
+                stamp[0],
+                stamp[1],
+                entry["title"],
+                entry["artist"],
+                entry["album"],
+                entry.get("duration", ""),
+            ),
+        )
+
+    def _scan(
+        self, names: List[str], known: Dict[str, Tuple[int, int]]
+    ) -> List[Tuple[str, Tuple[int, int], Entry]]:
+        """Read tags for every file that is new or changed, in a worker thread."""
+        changed = []
+        for filename in names:
+            path = os.path.join(self.index.directory, filename)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stamp = (st.st_size, st.st_mtime_ns)
+            if known.get(filename) != stamp:
+                changed.append((filename, stamp, read_tags(path)))
+        return changed
+
+    async def sync(self) -> None:
+        """Bring the index in line with what's in the audio directory."""
+        names = list(self.index.listing())
+        for filename in set(self.entries) - set(names):
+            self._forget(filename)
+        changed = await asyncio.to_thread(self._scan, names, dict(self.stamps))
+        for filename, stamp, entry in changed:
+            self._store(filename, stamp, entry)
+        self.db.commit()
+        print(f"audio library: {len(self.entries)} files, {len(changed)} re-read")
+
+    async def add(self, filename: str) -> None:
+        """Index one file that was just written."""
+        changed = await asyncio.to_thread(self._scan, [filename], {})
+        for name, stamp, entry in changed:
+            self._store(name, stamp, entry)
+        self.db.commit()
+
+    def get(self, filename: str) -> Optional[Entry]:
+        return self.entries.get(filename)
+
+    def names(self) -> List[str]:
+        """Indexed file names, sorted."""
+        if len(self.entries) != len(self.index) and (
+            self.sync_task is None or self.sync_task.done()
+        ):
+            # files were added or removed outside /upload, catch up in the
+            # background and serve what we have meanwhile
+            self.sync_task = asyncio.get_running_loop().create_task(self.sync())
+        if self.sorted_names is None:
+            self.sorted_names = sorted(self.entries, key=str.casefold)
+        return self.sorted_names
+
+    def _sorted_heads(self) -> List[Tuple[str, str]]:
+        if self.heads_index is None:
+            heads = [(title, f) for f, (title, _) in self.heads.items()]
+            heads.extend((stem, f) for f, (_, stem) in self.heads.items())
+            self.heads_index = sorted(heads)
+        return self.heads_index
+
+    def search(self, query: str, limit: int = MAX_RESULTS) -> List[str]:
+        """Best matches for ``query``: title or name prefix first, then a-z.
+
+        Both passes walk sorted lists and stop once ``limit`` results are
+        in, so common queries don't pay for checking every candidate.
+        """
+        q = normalize(query)
+        tokens = q.split()
+        if not tokens:
+            return self.names()[:limit]
+
+        results: List[str] = []
+        seen: Set[str] = set()
+        heads = self._sorted_heads()
+        i = bisect.bisect_left(heads, (q, ""))
+        while i < len(heads) and len(results) < limit and heads[i][0].startswith(q):
+            filename = heads[i][1]
+            if filename not in seen:
+                seen.add(filename)
+                results.append(filename)
+            i += 1
+        if len(results) >= limit:
+            return results
+
+        found = self.search_index.candidates(tokens)
+        if len(found) <= limit * 4:
+            rest = sorted(found - seen, key=str.casefold)
+        else:
+            rest = (f for f in self.names() if f in found and f not in seen)
+        for filename in rest:
+            if self.search_index.matches(filename, tokens):
+                results.append(filename)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def label(self, filename: str) -> str:
+        entry = self.entries.get(filename)
+        if entry is None or entry["title"] == "unknown":
+            return filename
+        if entry["artist"] == "unknown":
+            return entry["title"]
+        return f"{entry['title']} - {entry['artist']}"
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,253 @@
+import json
+import math
+import os
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+ANALYSIS_RATE = 48000
+# loudness is measured over 400ms blocks overlapping by 75%, built from
+# 100ms hops
+HOP_SIZE = ANALYSIS_RATE // 10
+# pcm is read from ffmpeg this many hops at a time, ~10s of stereo s16le
+READ_HOPS = 100
+
+TARGET_LUFS = float(os.getenv("TARGET_LUFS", "-16"))
+MAX_PEAK_DB = -1.0
+MAX_GAIN_DB = 12.0
+# smaller corrections aren't worth re-encoding a file for
+MIN_GAIN_DB = 1.0
+SILENCE_DB = -50.0
+MIN_TRIM = 0.25
+
+Analysis = Dict[str, Any]
+
+# ITU-R BS.1770 k-weighting at 48khz: high shelf, then high pass
+K_SHELF = (
+    (1.53512485958697, -2.69169618940638, 1.19839281085285),
+    (1.0, -1.69065929318241, 0.73248077421585),
+)
+K_HIGHPASS = (
+    (1.0, -2.0, 1.0),
+    (1.0, -1.99004745483398, 0.99007225036621),
+)
+
+
+def _biquad_power(
+    coeffs: Tuple[Tuple[float, ...], Tuple[float, ...]], freqs: np.ndarray, rate: int
+) -> np.ndarray:
+    b, a = coeffs
+    z = np.exp(-1j * 2 * np.pi * freqs / rate)
+    num = b[0] + b[1] * z + b[2] * z**2
+    den = a[0] + a[1] * z + a[2] * z**2
+    return np.abs(num / den) ** 2
+
+
+def _hop_weights(size: int, rate: int) -> np.ndarray:
+    """Per-bin factors turning an rfft of one hop into its k-weighted mean square.
+
+    The k-weighting filter is applied in the frequency domain, and the
+    one-sided spectrum counts every bin but dc and nyquist twice.
+    """
+    freqs = np.fft.rfftfreq(size, 1 / rate)
+    weights = _biquad_power(K_SHELF, freqs, rate)
+    weights *= _biquad_power(K_HIGHPASS, freqs, rate)
+    weights[1 : (size + 1) // 2] *= 2
+    return (weights / size**2).astype(np.float32)
+
+
+HOP_WEIGHTS = _hop_weights(HOP_SIZE, ANALYSIS_RATE)
+
+
+def hop_powers(pcm: np.ndarray) -> np.ndarray:
+    """K-weighted mean square of each channel of each 100ms hop.
+
+    ``pcm`` is float, shaped (hops * HOP_SIZE, channels); the result is
+    shaped (hops, channels).
+    """
+    hops = pcm.reshape(-1, HOP_SIZE, pcm.shape[1])
+    spectrum = np.fft.rfft(hops, axis=1)
+    power = spectrum.real**2 + spectrum.imag**2
+    return np.einsum("hbc,b->hc", power, HOP_WEIGHTS)
+
+
+def integrated_loudness(powers: np.ndarray) -> Optional[float]:
+    """Gated integrated loudness in LUFS from per-hop channel powers."""
+    if len(powers) < 4:
+        return None
+    summed = np.cumsum(np.concatenate(([0.0], powers.sum(axis=1))))
+    blocks = (summed[4:] - summed[:-4]) / 4
+    with np.errstate(divide="ignore"):
+        levels = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[levels > -70]
+    if not len(gated):
+        return None
+    relative = -0.691 + 10 * math.log10(gated.mean()) - 10
+    gated = blocks[(levels > -70) & (levels > relative)]
+    return -0.691 + 10 * math.log10(gated.mean())
+
+
+def decode(path: str) -> "subprocess.Popen[bytes]":
+    args = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        path,
+        "-vn",
+        "-ac",
+        "2",
+        "-ar",
+        str(ANALYSIS_RATE),
+        "-f",
+        "s16le",
+        "pipe:1",
+    ]
+    return subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+
+
+def analyze(path: str) -> Optional[Analysis]:
+    """Loudness, peak and silent lead-in/tail of a file, in one decode pass.
+
+    PCM is read from ffmpeg in ~10 second chunks, so memory stays flat
+    however long the track is; each chunk is analyzed with a handful of
+    vectorized operations.
+    """
+    process = decode(path)
+    assert process.stdout is not None
+    chunk_bytes = READ_HOPS * HOP_SIZE * 2 * 2
+    threshold = 10 ** (SILENCE_DB / 20)
+    powers: List[np.ndarray] = []
+    peak = 0.0
+    first_loud: Optional[int] = None
+    last_loud = 0
+    samples = 0
+    # a partial frame, and frames short of a whole hop, carried to the next read
+    leftover = b""
+    carry = np.zeros((0, 2), dtype=np.float32)
+    try:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            data = leftover + data
+            cut = len(data) - len(data) % 4
+            leftover = data[cut:]
+            frames = np.frombuffer(data, dtype="<i2", count=cut // 2)
+            frames = frames.reshape(-1, 2).astype(np.float32) / 32768
+
+            level = np.abs(frames).max(axis=1)
+            peak = max(peak, float(level.max()))
+            loud = np.flatnonzero(level > threshold)
+            if len(loud):
+                if first_loud is None:
+                    first_loud = samples + int(loud[0])
+                last_loud = samples + int(loud[-1]) + 1
+            samples += len(frames)
+
+            frames = np.concatenate((carry, frames))
+            whole = len(frames) - len(frames) % HOP_SIZE
+            if whole:
+                powers.append(hop_powers(frames[:whole]))
+            carry = frames[whole:]
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0 or samples == 0:
+        print(f"loudness analysis failed for {path}")
+        return None
+
+    loudness = integrated_loudness(
+        np.concatenate(powers) if powers else np.zeros((0, 2))
+    )
+    peak_db = 20 * math.log10(peak) if peak > 0 else None
+    gain = 0.0
+    if loudness is not None and peak_db is not None:
+        gain = min(TARGET_LUFS - loudness, MAX_PEAK_DB - peak_db, MAX_GAIN_DB)
+    duration = samples / ANALYSIS_RATE
+    start = (first_loud or 0) / ANALYSIS_RATE
+    end = last_loud / ANALYSIS_RATE if first_loud is not None else duration
+    return {
+        "loudness": loudness,
+        "peak_db": peak_db,
+        "gain_db": round(gain, 2),
+        "start": round(start, 3) if start >= MIN_TRIM else 0.0,
+        "end": round(end, 3) if duration - end >= MIN_TRIM else None,
+        "duration": round(duration, 3),
+        "applied": False,
+    }
+
+
+def needs_gain(analysis: Analysis) -> bool:
+    """Whether the gain is big enough to be worth re-encoding an Opus file for.
+
+    Gain is baked in rather than applied at play time: Ogg Opus plays
+    through passthrough, and scaling it live would mean decoding and
+    re-encoding every packet on every play instead of once per file.
+    Trimming alone never needs an encode, Opus packets can be skipped at
+    play time.
+    """
+    return not analysis["applied"] and abs(analysis["gain_db"]) >= MIN_GAIN_DB
+
+
+def filter_args(analysis: Analysis) -> List[str]:
+    """ffmpeg output options that bake the analysis into an encode."""
+    args: List[str] = []
+    if analysis["start"] > 0:
+        args += ["-ss", f"{analysis['start']:.3f}"]
+    if analysis["end"] is not None:
+        args += ["-to", f"{analysis['end']:.3f}"]
+    if abs(analysis["gain_db"]) >= MIN_GAIN_DB:
+        args += ["-af", f"volume={analysis['gain_db']:.2f}dB"]
+    return args
+
+
+def applied(analysis: Analysis) -> Analysis:
+    """The analysis of a file after ``filter_args`` were baked into it."""
+    start = analysis["start"]
+    end = analysis["end"] if analysis["end"] is not None else analysis["duration"]
+    return {
+        **analysis,
+        "start": 0.0,
+        "end": None,
+        "duration": round(end - start, 3),
+        "applied": True,
+    }
+
+
+def sidecar_path(path: str) -> str:
+    return f"{path}.loudness.json"
+
+
+def read_sidecar(path: str) -> Optional[Analysis]:
+    """Stored analysis of ``path``, unless the file changed since."""
+    try:
+        st = os.stat(path)
+        with open(sidecar_path(path)) as f:
+            analysis = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (analysis.get("size"), analysis.get("mtime_ns")) != (
+        st.st_size,
+        st.st_mtime_ns,
+    ):
+        return None
+    return analysis
+
+
+def write_sidecar(path: str, analysis: Analysis) -> None:
+    st = os.stat(path)
+    data = {**analysis, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    tmp = f"{sidecar_path(path)}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, sidecar_path(path))
+
+
+def remove_sidecar(path: str) -> None:
+    try:
+        os.remove(sidecar_path(path))
+    except FileNotFoundError:
+        pass
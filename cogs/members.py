@@ -0,0 +1,53 @@
+import asyncio
+from typing import AsyncIterator, List
+
+import discord
+
+# read-ahead, in pages, between the member fetch and whoever consumes it
+PAGES_AHEAD = 2
+
+
+async def member_pages(
+    guild: discord.Guild, page_size: int = 1000
+) -> AsyncIterator[List[discord.Member]]:
+    """Stream a guild's members in pages without filling the member cache.
+
+    A chunked guild is served from the cache. Otherwise members are
+    fetched over HTTP, ``page_size`` at a time (1000 is what the endpoint
+    returns per request), with the next pages requested while the caller
+    is still working on the current one. Fetched members are never added
+    to the guild, so memory only grows with the pages in flight.
+    """
+    if guild.chunked:
+        members = guild.members
+        for i in range(0, len(members), page_size):
+            yield members[i : i + page_size]
+        return
+
+    pages: "asyncio.Queue[List[discord.Member]]" = asyncio.Queue(
+        maxsize=PAGES_AHEAD
+    )
+
+    async def produce() -> None:
+        page: List[discord.Member] = []
+        async for member in guild.fetch_members(limit=None):
+            page.append(member)
+            if len(page) >= page_size:
+                await pages.put(page)
+                page = []
+        if page:
+            await pages.put(page)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while not (producer.done() and pages.empty()):
+            getter = asyncio.ensure_future(pages.get())
+            await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+        # surfaces any error the fetch ran into
+        await producer
+    finally:
+        producer.cancel()
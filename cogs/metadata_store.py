@@ -0,0 +1,128 @@
+import json
+import re
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Tuple
+
+EXPIRE_PARAM = re.compile(r"[?&]expire=(\d+)")
+
+# reads whose access times are held back before they're written in one go
+ACCESS_BATCH = 100
+
+
+def media_expiry(media: Dict[str, Any]) -> float:
+    """When the stream url in ``media`` stops working.
+
+    Googlevideo urls carry an ``expire`` timestamp; anything else gets an
+    hour. A few minutes are shaved off so queued items don't start on a
+    url that dies mid-track.
+    """
+    match = EXPIRE_PARAM.search(media.get("url", ""))
+    if match:
+        return float(match.group(1)) - 300
+    return time.time() + 3600
+
+
+class MetadataStore:
+    """SQLite store of resolved tracks, keyed by canonical video id.
+
+    Display metadata lives for ``ttl`` seconds. The media selection (the
+    chosen format and its stream url) only lives until the url expires,
+    after which lookups still return the metadata but no media. The
+    least recently used rows are dropped once there are more than
+    ``max_rows``.
+
+    Reads don't write: access times are kept in memory and go out with the
+    next put, prune or close, or once ``ACCESS_BATCH`` have piled up.
+    """
+
+    def __init__(self, path: str, ttl: float, max_rows: int) -> None:
+        self.ttl: float = ttl
+        self.max_rows: int = max_rows
+        self.puts_since_prune: int = 0
+        self.accessed: Dict[str, float] = {}
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tracks (
+                key TEXT PRIMARY KEY,
+                metadata TEXT NOT NULL,
+                media TEXT,
+                fetched_at REAL NOT NULL,
+                media_expires REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS tracks_accessed ON tracks (accessed_at)"
+        )
+        self.db.commit()
+        self.prune()
+
+    def get(
+        self, key: str
+    ) -> Optional[Tuple[Dict[str, str], Optional[Dict[str, Any]]]]:
+        now = time.time()
+        row = self.db.execute(
+            "SELECT metadata, media, fetched_at, media_expires FROM tracks "
+            "WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None or now - row[2] > self.ttl:
+            return None
+        self.accessed[key] = now
+        if len(self.accessed) >= ACCESS_BATCH:
+            self._write_accessed()
+            self.db.commit()
+        media = json.loads(row[1]) if row[1] and row[3] > now else None
+        return json.loads(row[0]), media
+
+    def put(
+        self, key: str, metadata: Dict[str, str], media: Optional[Dict[str, Any]]
+    ) -> None:
+        now = time.time()
+        # before the insert, so a held-back access time can't overwrite the new row's
+        self._write_accessed()
+        self.db.execute(
+            "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                json.dumps(metadata),
+                json.dumps(media) if media is not None else None,
+                now,
+                media_expiry(media) if media is not None else 0,
+                now,
+            ),
+        )
+        self.db.commit()
+        self.puts_since_prune += 1
+        if self.puts_since_prune >= 100:
+            self.puts_since_prune = 0
+            self.prune()
+
+    def _write_accessed(self) -> None:
+        if self.accessed:
+            self.db.executemany(
+                "UPDATE tracks SET accessed_at = ? WHERE key = ?",
+                [(at, key) for key, at in self.accessed.items()],
+            )
+            self.accessed.clear()
+
+    def prune(self) -> None:
+        self._write_accessed()
+        cutoff = time.time() - self.ttl
+        self.db.execute("DELETE FROM tracks WHERE fetched_at < ?", (cutoff,))
+        self.db.execute(
+            "DELETE FROM tracks WHERE key NOT IN "
+            "(SELECT key FROM tracks ORDER BY accessed_at DESC LIMIT ?)",
+            (self.max_rows,),
+        )
+        self.db.commit()
+
+    def close(self) -> None:
+        self._write_accessed()
+        self.db.commit()
+        self.db.close()
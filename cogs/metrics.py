@@ -0,0 +1,40 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+
+class Metrics:
+    """Rolling window of timing samples (in milliseconds) per metric name.
+
+    Safe to record from the audio player threads.
+    """
+
+    def __init__(self, window: int = 500) -> None:
+        self.window: int = window
+        self.samples: Dict[str, Deque[float]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, name: str, value_ms: float) -> None:
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(value_ms)
+
+    def summary(self, name: str) -> Optional[Dict[str, float]]:
+        with self.lock:
+            values: List[float] = sorted(self.samples.get(name, ()))
+        if not values:
+            return None
+        return {
+            "count": len(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1],
+        }
+
+    def names(self) -> List[str]:
+        with self.lock:
+            return sorted(self.samples)
+
+
+metrics = Metrics()
@@ -0,0 +1,326 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+import discord
+import numpy as np
+
+from .player import close_in_background
+
+# one 20ms frame of 48khz stereo s16le
+FRAME_SAMPLES = 960
+FRAME_VALUES = FRAME_SAMPLES * 2
+FRAME_BYTES = FRAME_VALUES * 2
+# the longest opus packet decodes to 120ms
+MAX_DECODED_VALUES = 5760 * 2
+
+# gain of ducked inputs (idle music) while anything else is playing
+DUCK_GAIN = float(os.getenv("DUCK_GAIN", "0.25"))
+# keep idle music going under queued tracks instead of cutting it off
+IDLE_BLEND = os.getenv("IDLE_BLEND", "0") == "1"
+MAX_VOLUME = 2.0
+SILENCE = bytes(FRAME_BYTES)
+# float32 scalars keep numpy from working in float64 and casting back
+_CEILING = np.float32(32767)
+_FLOOR = np.float32(-32768)
+
+# per-sample position within a frame, for ramping a gain change across it
+_RAMP = np.repeat(
+    np.linspace(0.0, 1.0, FRAME_SAMPLES, endpoint=False, dtype=np.float32), 2
+)
+
+
+class _Input:
+    """One source feeding a mixer, with its own gain and frame buffers."""
+
+    __slots__ = (
+        "source",
+        "gain",
+        "applied",
+        "duck",
+        "on_end",
+        "decoder",
+        "decoded",
+        "decoded_len",
+        "decoded_pos",
+        "padded",
+    )
+
+    def __init__(
+        self,
+        source: discord.AudioSource,
+        gain: float,
+        duck: bool,
+        on_end: Optional[Callable[[], None]],
+    ) -> None:
+        self.source = source
+        self.gain: float = gain
+        # the gain the last frame ended at, ramped towards the target
+        self.applied: float = gain
+        self.duck: bool = duck
+        self.on_end = on_end
+        self.decoder: Optional[discord.opus.Decoder] = None
+        self.decoded = np.zeros(MAX_DECODED_VALUES, dtype=np.int16)
+        self.decoded_len: int = 0
+        self.decoded_pos: int = 0
+        self.padded = np.zeros(FRAME_VALUES, dtype=np.int16)
+
+    def frame(self) -> Optional[np.ndarray]:
+        """The next 20ms as int16 samples, or None once the source has ended.
+
+        Opus sources are decoded here with libopus; pcm frames are read as
+        views over the bytes the source returned, without copying.
+        """
+        if self.decoded_pos < self.decoded_len:
+            return self._next_decoded()
+        data = self.source.read()
+        if not data:
+            return None
+        if self.source.is_opus():
+            if self.decoder is None:
+                self.decoder = discord.opus.Decoder()
+            pcm = np.frombuffer(self.decoder.decode(data), dtype=np.int16)
+            if len(pcm) == FRAME_VALUES:
+                return pcm
+            # a longer packet, handed out a frame at a time
+            self.decoded_len = min(len(pcm), MAX_DECODED_VALUES)
+            self.decoded[: self.decoded_len] = pcm[: self.decoded_len]
+            self.decoded_pos = 0
+            return self._next_decoded()
+        if len(data) >= FRAME_BYTES:
+            return np.frombuffer(data, dtype=np.int16, count=FRAME_VALUES)
+        # short last frame
+        values = len(data) // 2
+        self.padded[:values] = np.frombuffer(data, dtype=np.int16, count=values)
+        self.padded[values:] = 0
+        return self.padded
+
+    def _next_decoded(self) -> np.ndarray:
+        start = self.decoded_pos
+        self.decoded_pos += FRAME_VALUES
+        if self.decoded_pos <= self.decoded_len:
+            return self.decoded[start : self.decoded_pos]
+        values = self.decoded_len - start
+        self.padded[:values] = self.decoded[start : self.decoded_len]
+        self.padded[values:] = 0
+        return self.padded
+
+
+class Mixer(discord.AudioSource):
+    """Mixes a guild's named inputs into what its voice client plays.
+
+    Inputs are e.g. ``"queue"`` for queued tracks and ``"idle"`` for
+    background music; ducked inputs drop to ``DUCK_GAIN`` while any other
+    input plays. Gains are applied and inputs summed with numpy into
+    buffers allocated once per mixer, with gain changes ramped across a
+    frame so they don't click.
+
+    A lone Opus input at unity gain is passed through untouched, so the
+    common case costs no decoding or encoding at all. The mixer ends (and
+    the voice client stops) once its last input has ended or been removed.
+    """
+
+    def __init__(self, volume: float = 1.0) -> None:
+        self.inputs: Dict[str, _Input] = {}
+        self.volume: float = volume
+        self.applied_volume: float = volume
+        self.closed: bool = False
+        self._opus: bool = False
+        self._lock = threading.Lock()
+        self._acc = np.zeros(FRAME_VALUES, dtype=np.float32)
+        self._scaled = np.zeros(FRAME_VALUES, dtype=np.float32)
+        self._gains = np.zeros(FRAME_VALUES, dtype=np.float32)
+        self._out = np.zeros(FRAME_VALUES, dtype=np.int16)
+
+    def set_input(
+        self,
+        name: str,
+        source: discord.AudioSource,
+        gain: float = 1.0,
+        duck: bool = False,
+        on_end: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """Play ``source`` as ``name``, replacing (without ending) what was there.
+
+        ``on_end`` is called on the player thread when the source runs out.
+        Returns False if the mixer has already ended.
+        """
+        with self._lock:
+            if self.closed:
+                return False
+            old = self.inputs.get(name)
+            inp = _Input(source, gain, duck, on_end)
+            if duck and any(not i.duck for i in self.inputs.values()):
+                # start out ducked rather than ramping down from full
+                inp.applied = gain * DUCK_GAIN
+            self.inputs[name] = inp
+        if old is not None:
+            close_in_background(old.source)
+        return True
+
+    def remove_input(self, name: str) -> None:
+        with self._lock:
+            old = self.inputs.pop(name, None)
+        if old is not None:
+            close_in_background(old.source)
+
+    def has_input(self, name: str) -> bool:
+        with self._lock:
+            return name in self.inputs
+
+    def is_opus(self) -> bool:
+        return self._opus
+
+    def _passthrough(self, inputs: List[_Input]) -> bool:
+        if len(inputs) != 1:
+            return False
+        only = inputs[0]
+        return (
+            only.gain == only.applied == 1.0
+            and self.volume == self.applied_volume == 1.0
+            and only.decoded_pos >= only.decoded_len
+            and only.source.is_opus()
+        )
+
+    def read(self) -> bytes:
+        with self._lock:
+            inputs = list(self.inputs.values())
+        if self._passthrough(inputs):
+            packet = inputs[0].source.read()
+            if not packet:
+                return self._ended([inputs[0]])
+            # a gapless source can move on to a pcm track within that read;
+            # at unity gain the mix of its frame is the frame itself
+            self._opus = inputs[0].source.is_opus()
+            if not self._opus and len(packet) < FRAME_BYTES:
+                packet = packet.ljust(FRAME_BYTES, b"\0")
+            return packet
+
+        self._opus = False
+        acc = self._acc
+        ended: List[_Input] = []
+        live = 0
+        others = sum(1 for i in inputs if not i.duck)
+        volume_from, self.applied_volume = self.applied_volume, self.volume
+        for inp in inputs:
+            frame = inp.frame()
+            if frame is None:
+                ended.append(inp)
+                continue
+            # the first input is scaled straight into the accumulator
+            scaled = self._scaled if live else acc
+            live += 1
+            target = inp.gain * (DUCK_GAIN if inp.duck and others else 1.0)
+            start = inp.applied * volume_from
+            end = target * self.volume
+            inp.applied = target
+            if start == end:
+                np.multiply(frame, np.float32(end), out=scaled)
+            else:
+                np.multiply(_RAMP, np.float32(end - start), out=self._gains)
+                self._gains += np.float32(start)
+                np.multiply(frame, self._gains, out=scaled)
+            if scaled is not acc:
+                acc += scaled
+        if ended:
+            self._ended(ended)
+        if not live:
+            return self._ended([])
+        np.minimum(acc, _CEILING, out=acc)
+        np.maximum(acc, _FLOOR, out=acc)
+        np.copyto(self._out, acc, casting="unsafe")
+        return self._out.tobytes()
+
+    def _ended(self, ended: List[_Input]) -> bytes:
+        with self._lock:
+            for inp in ended:
+                for name, current in list(self.inputs.items()):
+                    if current is inp:
+                        del self.inputs[name]
+            if not self.inputs:
+                self.closed = True
+            closed = self.closed
+        for inp in ended:
+            close_in_background(inp.source)
+            if inp.on_end is not None:
+                inp.on_end()
+        # an input may have been added meanwhile, keep going for it
+        self._opus = False
+        return b"" if closed else SILENCE
+
+    def cleanup(self) -> None:
+        with self._lock:
+            self.closed = True
+            inputs = list(self.inputs.values())
+            self.inputs.clear()
+        for inp in inputs:
+            inp.source.cleanup()
+            # stopped from outside (or failed), its owner still has to know
+            if inp.on_end is not None:
+                inp.on_end()
+
+
+class Mixers:
+    """The mixer each guild's voice client is playing, and guild volumes."""
+
+    def __init__(self) -> None:
+        self.mixers: Dict[int, Mixer] = {}
+        self.volumes: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, guild_id: int) -> Optional[Mixer]:
+        with self._lock:
+            mixer = self.mixers.get(guild_id)
+        return mixer if mixer is not None and not mixer.closed else None
+
+    def play(
+        self,
+        guild_id: int,
+        voice_client: discord.VoiceClient,
+        name: str,
+        source: discord.AudioSource,
+        gain: float = 1.0,
+        duck: bool = False,
+        on_end: Optional[Callable[[], None]] = None,
+    ) -> Mixer:
+        """Play ``source`` as the guild's ``name`` input.
+
+        It joins the mixer already playing, or a new one is started on
+        ``voice_client``, stopping whatever else was playing there.
+        """
+        mixer = self.get(guild_id)
+        # the mixer may end between being looked up and getting the input
+        if (
+            mixer is not None
+            and voice_client.is_playing()
+            and mixer.set_input(name, source, gain, duck, on_end)
+        ):
+            return mixer
+        mixer = Mixer(self.volumes.get(guild_id, 1.0))
+        # before it plays, an empty mixer would end on its first read
+        mixer.set_input(name, source, gain, duck, on_end)
+        with self._lock:
+            self.mixers[guild_id] = mixer
+        voice_client.stop()
+        voice_client.play(mixer, after=lambda _: self._forget(guild_id, mixer))
+        return mixer
+
+    def remove(self, guild_id: int, name: str) -> None:
+        mixer = self.get(guild_id)
+        if mixer is not None:
+            mixer.remove_input(name)
+
+    def _forget(self, guild_id: int, mixer: Mixer) -> None:
+        with self._lock:
+            if self.mixers.get(guild_id) is mixer:
+                del self.mixers[guild_id]
+
+    def set_volume(self, guild_id: int, volume: float) -> None:
+        volume = min(max(volume, 0.0), MAX_VOLUME)
+        self.volumes[guild_id] = volume
+        mixer = self.get(guild_id)
+        if mixer is not None:
+            mixer.volume = volume
+
+
+mixers = Mixers()
@@ -0,0 +1,539 @@
+import hashlib
+import mmap
+import os
+import struct
+import subprocess
+import threading
+from array import array
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import discord
+
+from .loudness import (
+    analyze,
+    applied,
+    filter_args,
+    needs_gain,
+    read_sidecar,
+    write_sidecar,
+)
+
+# capture pattern, version, header type, granule position, serial, page
+# sequence, checksum, segment count
+OGG_PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+OGG_CONTINUED = 0x01
+OPUS_RATE = 48000
+# discord's player sends one packet per 20ms tick, passthrough packets
+# have to be exactly that long
+PASSTHROUGH_SAMPLES = 960
+# samples per frame for each of the 32 toc configurations: silk, hybrid, celt
+OPUS_FRAME_SAMPLES = (
+    [480, 960, 1920, 2880] * 3 + [480, 960] * 2 + [120, 240, 480, 960] * 4
+)
+# magic, size and mtime of the indexed file, entry count
+PAGE_INDEX_HEADER = struct.Struct("<4sQQI")
+
+
+class OggPage(NamedTuple):
+    offset: int
+    flags: int
+    granule: int
+    segments: bytes
+    body_start: int
+    end: int
+
+
+class OggOpusReader:
+    """Demuxes Opus packets out of an Ogg file through a read-only mmap."""
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self._file = open(path, "rb")
+        self._map: Optional[mmap.mmap] = None
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def page_at(self, offset: int) -> Optional[OggPage]:
+        data = self._map
+        if data is None or offset + OGG_PAGE_HEADER.size > len(data):
+            return None
+        magic, _, flags, granule, _, _, _, count = OGG_PAGE_HEADER.unpack_from(
+            data, offset
+        )
+        if magic != b"OggS":
+            raise ValueError(f"bad ogg page at offset {offset} in {self.path}")
+        seg_start = offset + OGG_PAGE_HEADER.size
+        segments = data[seg_start : seg_start + count]
+        body_start = seg_start + count
+        end = body_start + sum(segments)
+        if end > len(data):
+            # truncated page at the end of the file
+            return None
+        return OggPage(offset, flags, granule, segments, body_start, end)
+
+    def pages(self, offset: int = 0) -> Iterator[OggPage]:
+        page = self.page_at(offset)
+        while page is not None:
+            yield page
+            page = self.page_at(page.end)
+
+    def packets(self, offset: int = 0) -> Iterator[bytes]:
+        """Yield complete packets, starting from the page at ``offset``.
+
+        A packet continued from a page before ``offset`` is dropped.
+        """
+        data = self._map
+        partial = b""
+        skip_continued = offset > 0
+        for page in self.pages(offset):
+            if skip_continued and not page.flags & OGG_CONTINUED:
+                skip_continued = False
+            pos = page.body_start
+            length = 0
+            for lacing in page.segments:
+                length += lacing
+                if lacing == 255:
+                    continue
+                chunk = data[pos : pos + length]  # type: ignore[index]
+                pos += length
+                length = 0
+                if skip_continued:
+                    skip_continued = False
+                    continue
+                yield partial + chunk
+                partial = b""
+            if length and not skip_continued:
+                # packet carries on into the next page
+                partial += data[pos : pos + length]  # type: ignore[index]
+
+
+def opus_packet_samples(packet: bytes) -> int:
+    """Duration of an Opus packet at 48khz, read from its toc byte."""
+    if not packet:
+        return 0
+    toc = packet[0]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code < 3:
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return OPUS_FRAME_SAMPLES[toc >> 3] * frames
+
+
+def is_ogg_opus(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            head = f.read(OGG_PAGE_HEADER.size + 255 + 8)
+    except OSError:
+        return False
+    if len(head) < OGG_PAGE_HEADER.size or not head.startswith(b"OggS"):
+        return False
+    body = OGG_PAGE_HEADER.size + head[OGG_PAGE_HEADER.size - 1]
+    return head[body : body + 8] == b"OpusHead"
+
+
+def is_passthrough_opus(path: str) -> bool:
+    """Whether an Ogg Opus file's packets can be sent to discord as they are.
+
+    Only 20ms frames can: a file encoded with 40 or 60ms frames would play
+    two or three times too fast, so it's converted like any other file.
+    """
+    if not is_ogg_opus(path):
+        return False
+    try:
+        reader = OggOpusReader(path)
+    except OSError:
+        return False
+    try:
+        for packet in reader.packets():
+            if packet.startswith((b"OpusHead", b"OpusTags")):
+                continue
+            return opus_packet_samples(packet) == PASSTHROUGH_SAMPLES
+    except ValueError:
+        pass
+    finally:
+        reader.close()
+    return False
+
+
+class PageIndex:
+    """Where each page of an Ogg Opus file starts, by granule position.
+
+    Entry ``i`` says reading packets from byte ``offsets[i]`` on starts at
+    sample ``granules[i]``: it's the granule of the page before, which
+    counts every sample up to its end. Pages that open with the tail of a
+    packet from the page before aren't listed, since reading from them
+    would drop that packet without counting it.
+    """
+
+    __slots__ = ("granules", "offsets")
+
+    def __init__(self, granules: "array[int]", offsets: "array[int]") -> None:
+        self.granules = granules
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.granules)
+
+    def locate(self, sample: int) -> Tuple[int, int]:
+        """Granule and byte offset of the last page starting at or before ``sample``."""
+        i = bisect_right(self.granules, sample) - 1
+        if i < 0:
+            return 0, 0
+        return self.granules[i], self.offsets[i]
+
+
+def page_index_path(path: str) -> str:
+    return f"{path}.pages"
+
+
+def build_page_index(path: str) -> PageIndex:
+    """Index an Ogg Opus file by walking its page headers, no packet is read."""
+    granules: "array[int]" = array("q")
+    offsets: "array[int]" = array("Q")
+    reader = OggOpusReader(path)
+    try:
+        previous: Optional[OggPage] = None
+        for page in reader.pages():
+            if (
+                previous is not None
+                and previous.granule > (granules[-1] if granules else 0)
+                and not page.flags & OGG_CONTINUED
+            ):
+                granules.append(previous.granule)
+                offsets.append(page.offset)
+            previous = page
+    finally:
+        reader.close()
+    return PageIndex(granules, offsets)
+
+
+def write_page_index(path: str, index: PageIndex) -> None:
+    st = os.stat(path)
+    header = PAGE_INDEX_HEADER.pack(b"OPIX", st.st_size, st.st_mtime_ns, len(index))
+    tmp = f"{page_index_path(path)}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(index.granules.tobytes())
+        f.write(index.offsets.tobytes())
+    os.replace(tmp, page_index_path(path))
+
+
+def read_page_index(path: str) -> Optional[PageIndex]:
+    """Stored index of ``path``, unless the file changed since."""
+    try:
+        st = os.stat(path)
+        with open(page_index_path(path), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < PAGE_INDEX_HEADER.size:
+        return None
+    magic, size, mtime_ns, count = PAGE_INDEX_HEADER.unpack_from(data)
+    if magic != b"OPIX" or (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+        return None
+    body = data[PAGE_INDEX_HEADER.size :]
+    if len(body) != count * 16:
+        return None
+    granules: "array[int]" = array("q", body[: count * 8])
+    offsets: "array[int]" = array("Q", body[count * 8 :])
+    return PageIndex(granules, offsets)
+
+
+def page_index(path: str) -> PageIndex:
+    """Stored index of ``path``, building (and storing) it if there's none."""
+    index = read_page_index(path)
+    if index is None:
+        index = build_page_index(path)
+        try:
+            write_page_index(path, index)
+        except OSError as e:
+            print(f"couldn't store page index for {path}: {e}")
+    return index
+
+
+def remove_page_index(path: str) -> None:
+    try:
+        os.remove(page_index_path(path))
+    except FileNotFoundError:
+        pass
+
+
+class OggOpusSource(discord.AudioSource):
+    """Sends the Opus packets of an Ogg Opus file to discord as-is.
+
+    No ffmpeg process and no decode/re-encode, the packets already are
+    what the voice connection sends. Packets before ``start`` and after
+    ``end`` (seconds) are skipped by their toc duration, without decoding;
+    to get near ``start`` reading jumps straight to the right page through
+    the file's page index, so seeking costs the same anywhere in a file.
+    """
+
+    def __init__(
+        self, path: str, start: float = 0.0, end: Optional[float] = None
+    ) -> None:
+        self.reader = OggOpusReader(path)
+        # samples of audio read so far, played or skipped
+        self.position: int = 0
+        self.start: int = int(start * OPUS_RATE)
+        self.end: Optional[int] = int(end * OPUS_RATE) if end is not None else None
+        offset = 0
+        if self.start > 0:
+            self.position, offset = page_index(path).locate(self.start)
+        self._packets = self.reader.packets(offset)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        for packet in self._packets:
+            if packet.startswith((b"OpusHead", b"OpusTags")):
+                continue
+            if self.end is not None and self.position >= self.end:
+                break
+            self.position += opus_packet_samples(packet)
+            if self.position <= self.start:
+                continue
+            return packet
+        return b""
+
+    def cleanup(self) -> None:
+        self.reader.close()
+
+
+class OpusConverter:
+    """Converts non-Opus files to Ogg Opus once, in the background.
+
+    Converted files are keyed by inode, size and mtime, so a replaced
+    file gets converted again and hard links share one conversion.
+
+    Every file is analyzed for loudness and silence first (see
+    ``loudness``). A conversion bakes the gain and trim into its output.
+    Ogg Opus files are only re-encoded when their gain is off by enough to
+    matter; otherwise the analysis is stored in a sidecar next to them and
+    the silence is skipped at play time. Whatever Ogg Opus file ends up
+    being played also gets a page index stored next to it, for seeking.
+    """
+
+    def __init__(self, cache_dir: str = "opus_cache", workers: int = 2) -> None:
+        self.cache_dir: str = cache_dir
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="opus-convert"
+        )
+        self._inflight: Dict[str, "Future[Optional[str]]"] = {}
+        self._lock = threading.Lock()
+
+    def target_path(self, path: str) -> str:
+        st = os.stat(path)
+        key = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:normalized"
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.opus")
+
+    def converted_path(self, path: str) -> Optional[str]:
+        try:
+            target = self.target_path(path)
+        except OSError:
+            return None
+        return target if os.path.exists(target) else None
+
+    def _submit(
+        self, key: str, fn: Callable[..., Optional[str]], *args: str
+    ) -> "Future[Optional[str]]":
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            fut = self._executor.submit(fn, *args)
+            self._inflight[key] = fut
+        # outside the lock, the callback runs right here if fn already finished
+        fut.add_done_callback(lambda done: self._forget(key, done))
+        return fut
+
+    def schedule(self, path: str) -> "Future[Optional[str]]":
+        """Get a local file ready to play, resolving to the file to play."""
+        target = self.target_path(path)
+        return self._submit(target, self._prepare, path, target)
+
+    def normalize(self, path: str) -> "Future[Optional[str]]":
+        """Analyze and index an Ogg Opus file the bot owns, fixing its gain in place."""
+        return self._submit(os.path.abspath(path), self._normalize, path)
+
+    def _forget(self, key: str, fut: "Future[Optional[str]]") -> None:
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    def _encode(self, path: str, part: str, extra: List[str]) -> bool:
+        args = [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-i",
+            path,
+            "-vn",
+            *extra,
+            "-ac",
+            "2",
+            "-ar",
+            "48000",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            "128k",
+            "-frame_duration",
+            "20",
+            "-f",
+            "ogg",
+            part,
+        ]
+        result = subprocess.run(args, stdin=subprocess.DEVNULL)
+        if result.returncode != 0:
+            if os.path.exists(part):
+                os.remove(part)
+            return False
+        return True
+
+    def _index(self, path: str) -> None:
+        """Store the page index of an Ogg Opus file the bot will play."""
+        if not is_ogg_opus(path) or read_page_index(path) is not None:
+            return
+        try:
+            write_page_index(path, build_page_index(path))
+        except (OSError, ValueError) as e:
+            print(f"indexing {path} failed: {e}")
+
+    def _prepare(self, path: str, target: str) -> Optional[str]:
+        if os.path.exists(target):
+            return target
+        opus = is_passthrough_opus(path)
+        if opus and read_sidecar(path) is not None:
+            self._index(path)
+            return path
+        analysis = analyze(path)
+        if opus and (analysis is None or not needs_gain(analysis)):
+            if analysis is not None:
+                write_sidecar(path, analysis)
+            self._index(path)
+            return path
+
+        # made on first use, importing the module shouldn't touch the disk
+        os.makedirs(self.cache_dir, exist_ok=True)
+        part = f"{target}.part"
+        if not self._encode(path, part, filter_args(analysis) if analysis else []):
+            print(f"opus conversion failed for {path}")
+            return None
+        os.replace(part, target)
+        if analysis is not None:
+            write_sidecar(target, applied(analysis))
+        self._index(target)
+        print(f"converted {path} to opus")
+        return target
+
+    def _normalize(self, path: str) -> Optional[str]:
+        if read_sidecar(path) is not None:
+            self._index(path)
+            return path
+        analysis = analyze(path)
+        if analysis is None:
+            return None
+        if needs_gain(analysis) or not is_passthrough_opus(path):
+            # once, so every later play is passthrough with the gain in it
+            # (see needs_gain); re-encoding also gets the file to 20ms frames
+            part = f"{path}.normalize.part"
+            if not self._encode(path, part, filter_args(analysis)):
+                print(f"normalizing {path} failed")
+                return None
+            os.replace(part, path)
+            analysis = applied(analysis)
+            print(f"normalized {path} by {analysis['gain_db']:+.1f}db")
+        write_sidecar(path, analysis)
+        self._index(path)
+        return path
+
+
+converter = OpusConverter()
+
+
+def _seek_option(start: float) -> Optional[str]:
+    # before the input, so ffmpeg seeks instead of decoding its way there
+    return f"-ss {start:.3f}" if start > 0 else None
+
+
+def open_source(
+    path: str, prepare: bool = True, opus: bool = False, start: float = 0.0
+) -> discord.AudioSource:
+    """Best available source for a local file, from ``start`` seconds in.
+
+    Ogg Opus in 20ms frames plays through passthrough, skipping the silence
+    its sidecar analysis found. Anything else plays through ffmpeg this once while a
+    conversion to Opus is scheduled for next time; with ``opus`` set,
+    ffmpeg encodes it rather than handing out pcm. With ``prepare`` unset
+    nothing is scheduled, for files whose owner takes care of that.
+    """
+    converted = converter.converted_path(path)
+    if converted is not None:
+        return OggOpusSource(converted, start)
+    if is_passthrough_opus(path):
+        analysis = read_sidecar(path)
+        if analysis is None:
+            if prepare:
+                converter.schedule(path)
+            return OggOpusSource(path, start)
+        return OggOpusSource(path, max(start, analysis["start"]), analysis["end"])
+    if prepare:
+        converter.schedule(path)
+    if opus:
+        return discord.FFmpegOpusAudio(path, before_options=_seek_option(start))
+    return discord.FFmpegPCMAudio(path, before_options=_seek_option(start))
+
+
+def playback_length(path: str) -> Optional[float]:
+    """Seconds a local file plays for once its silence is skipped, if analyzed."""
+    analysis = read_sidecar(converter.converted_path(path) or path)
+    if analysis is None:
+        return None
+    end = analysis["end"] if analysis["end"] is not None else analysis["duration"]
+    return end - analysis["start"]
+
+
+def open_pcm_source(
+    path: str, prepare: bool = True, start: float = 0.0
+) -> discord.AudioSource:
+    """Decoded source for a local file, for when its audio gets mixed.
+
+    ffmpeg seeks to ``start`` or past the leading silence, whichever is
+    later, and stops at the end of the audio; a gain that wasn't baked
+    into the file is applied as a fixed volume.
+    """
+    converted = converter.converted_path(path)
+    analysis = read_sidecar(converted or path)
+    if analysis is None:
+        if prepare and converted is None:
+            converter.schedule(path)
+        return discord.FFmpegPCMAudio(
+            converted or path, before_options=_seek_option(start)
+        )
+    begin = max(start, analysis["start"])
+    options = "-vn"
+    if analysis["end"] is not None:
+        options += f" -t {max(analysis['end'] - begin, 0):.3f}"
+    source = discord.FFmpegPCMAudio(
+        converted or path,
+        before_options=_seek_option(begin),
+        options=options,
+    )
+    if analysis["applied"] or not analysis["gain_db"]:
+        return source
+    return discord.PCMVolumeTransformer(source, volume=10 ** (analysis["gain_db"] / 20))
@@ -0,0 +1,232 @@
+import os
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+import discord
+import numpy as np
+
+from .metrics import metrics
+from .opus import OPUS_RATE, OggOpusSource
+
+FRAME_MS = 20
+# 20ms of 48khz stereo s16le, what a pcm source returns per read
+PCM_FRAME_SAMPLES = 960 * 2
+# ask for the next track this long before the current one ends
+PRELOAD_SECONDS = float(os.getenv("PRELOAD_SECONDS", "10"))
+# 0 switches tracks back to back; anything else fades pcm sources into
+# each other over that many milliseconds
+CROSSFADE_MS = int(os.getenv("CROSSFADE_MS", "0"))
+
+
+def close_in_background(source: discord.AudioSource) -> None:
+    # killing ffmpeg waits for the process, keep that off the player thread
+    if sys.is_finalizing():
+        # sources are cleaned up from __del__ too, no new threads by then
+        source.cleanup()
+        return
+    threading.Thread(target=source.cleanup, daemon=True).start()
+
+
+class _Track:
+    __slots__ = ("key", "source", "duration", "offset")
+
+    def __init__(
+        self,
+        key: object,
+        source: discord.AudioSource,
+        duration: Optional[float],
+        offset: float = 0.0,
+    ) -> None:
+        self.key = key
+        self.source = source
+        self.duration = duration
+        # seconds into the file the source starts at
+        self.offset = offset
+
+
+class GaplessSource(discord.AudioSource):
+    """Plays a track and switches to a pre-opened next one without a gap.
+
+    ``on_preload`` is called (on the player thread) once the current
+    track is within ``PRELOAD_SECONDS`` of its end, or right away if its
+    duration isn't known; whoever listens opens the next track and hands
+    it over with ``set_next``. When the current track runs out, the next
+    one's first frame goes out in the same read, so the voice connection
+    never sees a gap, and ``on_switch`` is called with the new key. If
+    nothing was handed over in time, the source ends and the player's
+    ``after`` callback takes over as usual.
+
+    With ``crossfade_ms`` set and both tracks decoding to pcm, the last
+    stretch of the current track is faded into the start of the next.
+
+    ``offset`` is where in its file the first track's source starts, so
+    ``position`` is right for tracks started part way through.
+    """
+
+    def __init__(
+        self,
+        key: object,
+        source: discord.AudioSource,
+        duration: Optional[float],
+        on_preload: Callable[[], None],
+        on_switch: Callable[[object], None],
+        crossfade_ms: int = CROSSFADE_MS,
+        ended_at: Optional[float] = None,
+        offset: float = 0.0,
+    ) -> None:
+        self.current = _Track(key, source, duration, offset)
+        self.next: Optional[_Track] = None
+        self.on_preload = on_preload
+        self.on_switch = on_switch
+        self.fade_frames: int = crossfade_ms // FRAME_MS
+        self.frames: int = 0
+        self.fading: int = 0
+        self.preload_requested: bool = False
+        self.closed: bool = False
+        # when the previous track went silent, for the gap metric
+        self.ended_at: Optional[float] = ended_at
+        self._lock = threading.Lock()
+
+    @property
+    def key(self) -> object:
+        return self.current.key
+
+    @property
+    def next_key(self) -> object:
+        with self._lock:
+            return self.next.key if self.next is not None else None
+
+    @property
+    def position(self) -> float:
+        """Seconds into the current track's file playback has got to."""
+        with self._lock:
+            current, frames = self.current, self.frames
+        if isinstance(current.source, OggOpusSource):
+            # counted from the packets' own durations
+            return current.source.position / OPUS_RATE
+        return current.offset + frames * FRAME_MS / 1000
+
+    def is_opus(self) -> bool:
+        return self.current.source.is_opus()
+
+    def set_next(
+        self, key: object, source: discord.AudioSource, duration: Optional[float]
+    ) -> bool:
+        """Hand over the track to switch to; False if this source is done."""
+        with self._lock:
+            if self.closed:
+                return False
+            old, self.next = self.next, _Track(key, source, duration)
+        if old is not None:
+            close_in_background(old.source)
+        return True
+
+    def clear_next(self) -> None:
+        with self._lock:
+            old, self.next = self.next, None
+            self.fading = 0
+        if old is not None:
+            close_in_background(old.source)
+
+    def take_next(self, key: object) -> Optional[discord.AudioSource]:
+        """Claim the pre-opened source for ``key``, e.g. to play it after a skip."""
+        with self._lock:
+            if self.next is None or self.next.key is not key:
+                return None
+            track, self.next = self.next, None
+            self.fading = 0
+        return track.source
+
+    def _remaining_frames(self) -> Optional[int]:
+        if self.current.duration is None:
+            return None
+        return int(self.current.duration * 1000 / FRAME_MS) - self.frames
+
+    def _gap_ended(self) -> None:
+        if self.ended_at is not None:
+            gap = (time.perf_counter() - self.ended_at) * 1000
+            metrics.record("transition_gap", gap)
+            self.ended_at = None
+
+    def read(self) -> bytes:
+        with self._lock:
+            current, upcoming = self.current, self.next
+        if not self.preload_requested:
+            remaining = self._remaining_frames()
+            if remaining is None or remaining * FRAME_MS <= PRELOAD_SECONDS * 1000:
+                self.preload_requested = True
+                self.on_preload()
+
+        data = current.source.read()
+        self.frames += 1
+        if data:
+            self._gap_ended()
+            if upcoming is not None and self._should_fade(upcoming):
+                return self._mix(data, upcoming)
+            return data
+
+        self.ended_at = time.perf_counter()
+        if upcoming is None or not self._switch(upcoming):
+            return b""
+        data = upcoming.source.read()
+        self.frames += 1
+        if data:
+            self._gap_ended()
+        return data
+
+    def _should_fade(self, upcoming: _Track) -> bool:
+        if self.fading:
+            return True
+        if not self.fade_frames or self.is_opus() or upcoming.source.is_opus():
+            return False
+        remaining = self._remaining_frames()
+        return remaining is not None and remaining < self.fade_frames
+
+    def _mix(self, data: bytes, upcoming: _Track) -> bytes:
+        incoming = upcoming.source.read()
+        if not incoming:
+            # the next track ended before the fade did, nothing to fade to
+            self.clear_next()
+            return data
+        step = self.fading
+        self.fading += 1
+        ramp = np.linspace(
+            step / self.fade_frames,
+            (step + 1) / self.fade_frames,
+            PCM_FRAME_SAMPLES // 2,
+            endpoint=False,
+            dtype=np.float32,
+        ).repeat(2)
+        out = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if len(out) < len(ramp):
+            out = np.pad(out, (0, len(ramp) - len(out)))
+        mixed = out[: len(ramp)] * (1 - ramp)
+        fade_in = np.frombuffer(incoming, dtype=np.int16).astype(np.float32)
+        mixed[: len(fade_in)] += fade_in[: len(ramp)] * ramp[: len(fade_in)]
+        if self.fading >= self.fade_frames and self._switch(upcoming):
+            # the fade is done, the next track carries on from here
+            self.frames = self.fade_frames
+        return np.clip(mixed, -32768, 32767).astype(np.int16).tobytes()
+
+    def _switch(self, upcoming: _Track) -> bool:
+        with self._lock:
+            if self.closed or self.next is not upcoming:
+                return False
+            old, self.current, self.next = self.current, upcoming, None
+            self.frames = 0
+            self.fading = 0
+            self.preload_requested = False
+        close_in_background(old.source)
+        self.on_switch(upcoming.key)
+        return True
+
+    def cleanup(self) -> None:
+        with self._lock:
+            self.closed = True
+            tracks = [self.current, self.next]
+            self.next = None
+        for track in tracks:
+            if track is not None:
+                track.source.cleanup()
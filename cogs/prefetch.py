@@ -0,0 +1,92 @@
+import asyncio
+import os
+from typing import TYPE_CHECKING, Dict, List
+
+from discord.ext import commands
+
+from .loudness import read_sidecar
+from .opus import converter, is_passthrough_opus
+
+if TYPE_CHECKING:
+    from .queue import QueueItem
+
+
+class Prefetcher:
+    """Gets the next few items of each guild's queue ready in the background.
+
+    YouTube items are downloaded into the cache and local files are
+    converted to Opus, and both are analyzed for loudness and silence, so
+    every transition can start from a playback-ready file. ``depth``
+    items are looked at per guild, at most ``concurrency`` jobs run at once
+    across all guilds, and jobs for items that leave the window (skipped,
+    removed, cleared) are cancelled. The download or conversion behind a
+    cancelled job runs on a thread and can't be stopped, so it keeps its
+    slot until it's done.
+    """
+
+    def __init__(self, bot: commands.Bot, depth: int, concurrency: int) -> None:
+        self.bot = bot
+        self.depth: int = depth
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks: Dict[int, Dict["QueueItem", "asyncio.Task[None]"]] = {}
+
+    def needs_work(self, item: "QueueItem") -> bool:
+        if item.is_youtube:
+            return read_sidecar(item.filepath) is None
+        if not os.path.exists(item.filepath):
+            return False
+        if (
+            is_passthrough_opus(item.filepath)
+            and read_sidecar(item.filepath) is not None
+        ):
+            return False
+        return converter.converted_path(item.filepath) is None
+
+    def schedule(self, guild_id: int, upcoming: List["QueueItem"]) -> None:
+        """Make the running jobs for ``guild_id`` match ``upcoming``."""
+        window = upcoming[: self.depth]
+        guild_tasks = self.tasks.setdefault(guild_id, {})
+
+        for item in list(guild_tasks):
+            if not any(item is w for w in window):
+                guild_tasks.pop(item).cancel()
+
+        for item in window:
+            if item in guild_tasks or not self.needs_work(item):
+                continue
+            task = asyncio.create_task(self.prefetch(item))
+            guild_tasks[item] = task
+            task.add_done_callback(
+                lambda t, item=item: self._forget(guild_id, item, t)
+            )
+
+    def cancel_guild(self, guild_id: int) -> None:
+        for task in self.tasks.pop(guild_id, {}).values():
+            task.cancel()
+
+    def _forget(
+        self, guild_id: int, item: "QueueItem", task: "asyncio.Task[None]"
+    ) -> None:
+        guild_tasks = self.tasks.get(guild_id)
+        if guild_tasks is not None and guild_tasks.get(item) is task:
+            del guild_tasks[item]
+
+    async def prefetch(self, item: "QueueItem") -> None:
+        await self.semaphore.acquire()
+        work = asyncio.ensure_future(self._work(item))
+        work.add_done_callback(lambda _: self.semaphore.release())
+        # cancelling only stops the waiting, the slot goes back with the work
+        await asyncio.shield(work)
+
+    async def _work(self, item: "QueueItem") -> None:
+        try:
+            if item.is_youtube:
+                youtube_cog = self.bot.get_cog("YouTube")
+                if youtube_cog is not None:
+                    path = await youtube_cog.download_audio(item.metadata["url"])
+                    if path is not None:
+                        await asyncio.wrap_future(youtube_cog.normalize(path))
+            else:
+                await asyncio.wrap_future(converter.schedule(item.filepath))
+        except Exception as e:
+            print(f"prefetch failed for {item.filepath}: {e}")
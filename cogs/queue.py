@@ -2,94 +2,839 @@ import discord
 from discord.ext import commands
 from discord import app_commands, ui
 from collections import deque
-from typing import Dict, Deque, Optional
-import random
+from typing import Any, Callable, Dict, Deque, List, Optional, Set, Tuple
+import asyncio
+import math
+import os
+import time
+from .actor import GuildActor
+from .idle import Idle
+from .journal import QueueJournal, timed_load
+from .metrics import metrics
+from .mixer import IDLE_BLEND, mixers
+from .loudness import read_sidecar
+from .opus import open_pcm_source, open_source, playback_length
+from .player import CROSSFADE_MS, GaplessSource, close_in_background
+from .prefetch import Prefetcher
+from .stream import CachingStreamSource
+from .tags import tag_cache
+from .tracklist import GuildQueue, last_item_id, next_item_id
+
+# how often the playback position of every guild is journaled, in seconds
+POSITION_INTERVAL = float(os.getenv("POSITION_INTERVAL", "5"))
+
+# metadata that comes with a resolved stream url, which expires, so it isn't
+# persisted; restored items resolve again when they play
+STREAM_FIELDS = frozenset(("stream_url", "stream_headers", "acodec"))
+
+
+def parse_timestamp(text: str) -> Optional[float]:
+    """Seconds from ``90``, ``1:30`` or ``1:01:30``."""
+    try:
+        parts = [float(part) for part in text.strip().split(":")]
+    except ValueError:
+        return None
+    if not 1 <= len(parts) <= 3:
+        return None
+    if any(part < 0 or not math.isfinite(part) for part in parts):
+        return None
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def format_timestamp(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes}:{secs:02d}"
+
+
+def without_stream_fields(metadata: Dict[str, str]) -> Dict[str, str]:
+    return {k: v for k, v in metadata.items() if k not in STREAM_FIELDS}
 
 
 class QueueItem:
-    def __init__(self, filepath: str, metadata: Dict[str, str], is_youtube: bool):
+    __slots__ = (
+        "filepath",
+        "metadata",
+        "is_youtube",
+        "stream_url",
+        "requested_at",
+        "item_id",
+        "position",
+    )
+
+    def __init__(
+        self,
+        filepath: str,
+        metadata: Dict[str, str],
+        is_youtube: bool,
+        stream_url: Optional[str] = None,
+        requested_at: Optional[float] = None,
+        item_id: Optional[int] = None,
+        position: float = 0.0,
+    ):
         self.filepath: str = filepath
         self.metadata: Dict[str, str] = metadata
         self.is_youtube: bool = is_youtube
+        self.stream_url: Optional[str] = stream_url
+        self.requested_at: Optional[float] = requested_at
+        self.item_id: int = item_id if item_id is not None else next_item_id()
+        # seconds in to start at the next time it plays, e.g. to resume it
+        self.position: float = position
+
+    def copy(self) -> "QueueItem":
+        """The same track under a new ``item_id``, to queue it again."""
+        return QueueItem(
+            self.filepath,
+            dict(self.metadata),
+            self.is_youtube,
+            self.stream_url,
+            self.requested_at,
+        )
+
+    def to_record(self) -> Dict[str, Any]:
+        record = {
+            "id": self.item_id,
+            "filepath": self.filepath,
+            "metadata": without_stream_fields(self.metadata),
+            "is_youtube": self.is_youtube,
+        }
+        if self.position:
+            record["position"] = self.position
+        return record
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "QueueItem":
+        return cls(
+            record["filepath"],
+            # records journaled before these were stripped still have them
+            without_stream_fields(record["metadata"]),
+            record["is_youtube"],
+            item_id=record["id"],
+            position=record.get("position", 0.0),
+        )
+
+
+def build_state(captured: Dict[str, Any]) -> Dict[str, Any]:
+    """Snapshot of what ``Queue.capture_state`` grabbed, as plain records."""
+    guilds: Dict[str, Any] = {}
+    for key, data in captured["guilds"].items():
+        current = data["current"]
+        record = current.to_record() if current is not None else None
+        if record is not None and data["position"]:
+            record["position"] = round(data["position"], 2)
+        guilds[key] = {
+            "queue": [item.to_record() for item in data["queue"]],
+            "shuffled": [item.item_id for item in data["shuffled"]],
+            "current": record,
+            "history": [item.to_record() for item in data["history"]],
+            "loop": data["loop"],
+            "shuffle": data["shuffle"],
+        }
+    return {"guilds": guilds, "last_item_id": captured["last_item_id"]}
 
 
 class Queue(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
-        self.queues: Dict[int, Deque[QueueItem]] = {}
+        self.queues: Dict[int, GuildQueue] = {}
         self.current: Dict[int, Optional[QueueItem]] = {}
         self.history: Dict[int, Deque[QueueItem]] = {}
         self.loop_mode: Dict[int, str] = {}
         self.shuffle_enabled: Dict[int, bool] = {}
+        self.prefetcher = Prefetcher(
+            bot,
+            depth=int(os.getenv("PREFETCH_DEPTH", "2")),
+            concurrency=int(os.getenv("PREFETCH_CONCURRENCY", "4")),
+        )
+        self.journal = QueueJournal()
+        self.journal_task: Optional[asyncio.Task[None]] = None
+        self.position_task: Optional[asyncio.Task[None]] = None
+        # what /stop interrupted, for /resume to pick up again
+        self.stopped: Dict[int, QueueItem] = {}
+        # the source each guild's voice client is playing, with the next
+        # item pre-opened in it once the current one nears its end
+        self.players: Dict[int, GaplessSource] = {}
+        self.preload_tasks: Dict[int, asyncio.Task[None]] = {}
+        self.preload_dirty: Set[int] = set()
+        # when the last track of a guild stopped, for the transition gap metric
+        self.ended_at: Dict[int, float] = {}
+        # the last position journaled per guild, so paused ones aren't rewritten
+        self.journaled_positions: Dict[int, Tuple[int, float]] = {}
+        # crossfading mixes decoded audio, so sources are opened as pcm
+        self.pcm: bool = CROSSFADE_MS > 0
+        # every change to what a guild is playing goes through its actor
+        self.actors: Dict[int, GuildActor] = {}
+        self.handlers = {
+            "enqueue": self._on_enqueue,
+            "play": self._on_play,
+            "skip": self._on_skip,
+            "previous": self._on_previous,
+            "jump": self._on_jump,
+            "shuffle": self._on_shuffle,
+            "remove": self._on_remove,
+            "move": self._on_move,
+            "loop": self._on_loop,
+            "stop": self._on_stop,
+            "seek": self._on_seek,
+            "resume": self._on_resume,
+            "ended": self._on_ended,
+            "switched": self._on_switched,
+            "resolved": self._on_resolved,
+            "opened": self._on_opened,
+        }
+
+    async def cog_load(self) -> None:
+        guilds, elapsed = await asyncio.to_thread(
+            timed_load, self.journal, QueueItem.from_record
+        )
+        items = 0
+        for guild_id, state in guilds.items():
+            state.queue.journal = self.journal
+            self.queues[guild_id] = state.queue
+            self.history[guild_id] = state.history
+            self.loop_mode[guild_id] = state.loop_mode
+            self.shuffle_enabled[guild_id] = state.shuffle
+            if state.current is not None:
+                # nothing is playing after a restart, replay the interrupted song
+                state.queue.appendleft(state.current)
+                self.set_current(guild_id, None)
+            items += len(state.queue)
+        metrics.record("queue_restore", elapsed)
+        print(
+            f"restored {len(guilds)} guild queues ({items} items) in {elapsed:.0f}ms"
+        )
+        self.journal_task = asyncio.create_task(
+            self.journal.run(self.capture_state, build_state)
+        )
+        self.position_task = asyncio.create_task(self.journal_positions())
+
+    async def cog_unload(self) -> None:
+        for actor in self.actors.values():
+            actor.close()
+        for task in (self.journal_task, self.position_task):
+            if task is not None:
+                task.cancel()
+        await self.journal.snapshot(self.capture_state, build_state)
+
+    def position(self, guild_id: int) -> Optional[float]:
+        """Seconds into the guild's current item playback has got to.
+
+        None while the item is still being opened; until then its
+        ``position`` holds where it's going to start.
+        """
+        player = self.players.get(guild_id)
+        current = self.current.get(guild_id)
+        if player is None or player.closed or current is None:
+            return None
+        if player.key is not current:
+            return None
+        return player.position
+
+    async def journal_positions(self) -> None:
+        """Journal where every playing guild is, so a restart resumes there.
 
-    def get_queue(self, guild_id: int) -> Deque[QueueItem]:
+        Only positions that moved since the last time are written.
+        """
+        while True:
+            await asyncio.sleep(POSITION_INTERVAL)
+            journaled = self.journaled_positions
+            for guild_id in list(journaled):
+                if guild_id not in self.players:
+                    del journaled[guild_id]
+            for guild_id in list(self.players):
+                position = self.position(guild_id)
+                if position is None:
+                    continue
+                position = round(position, 2)
+                current = self.current[guild_id]
+                assert current is not None
+                if journaled.get(guild_id) == (current.item_id, position):
+                    continue
+                journaled[guild_id] = (current.item_id, position)
+                self.journal.append({"op": "position", "g": guild_id, "pos": position})
+
+    def capture_state(self) -> Dict[str, Any]:
+        """Every guild's queue state as lists of items, for journal snapshots.
+
+        Only references are copied here, on the loop; ``build_state`` turns
+        them into records on the journal's worker thread.
+        """
+        guilds: Dict[str, Any] = {}
+        for guild_id in set(self.queues) | set(self.current) | set(self.history):
+            queue = self.get_queue(guild_id)
+            guilds[str(guild_id)] = {
+                "queue": list(queue),
+                "shuffled": list(queue.shuffled),
+                "current": self.current.get(guild_id),
+                "position": self.position(guild_id),
+                "history": list(self.get_history(guild_id)),
+                "loop": self.loop_mode.get(guild_id, "off"),
+                "shuffle": self.shuffle_enabled.get(guild_id, False),
+            }
+        return {"guilds": guilds, "last_item_id": last_item_id()}
+
+    def set_current(self, guild_id: int, item: Optional[QueueItem]) -> None:
+        self.current[guild_id] = item
+        record = item.to_record() if item is not None else None
+        self.journal.append({"op": "current", "g": guild_id, "item": record})
+
+    def push_history(self, guild_id: int, item: QueueItem) -> None:
+        history = self.get_history(guild_id)
+        if history and history[-1] is item:
+            # replayed by /loop single, it's in there once already
+            return
+        history.append(item)
+        if len(history) > 50:
+            history.popleft()
+        self.journal.append(
+            {"op": "history_push", "g": guild_id, "item": item.to_record()}
+        )
+
+    def pop_history(self, guild_id: int) -> Optional[QueueItem]:
+        history = self.get_history(guild_id)
+        if not history:
+            return None
+        self.journal.append({"op": "history_pop", "g": guild_id})
+        return history.pop()
+
+    def clear_history(self, guild_id: int) -> None:
+        self.get_history(guild_id).clear()
+        self.journal.append({"op": "history_clear", "g": guild_id})
+
+    def set_modes(self, guild_id: int, loop_mode: str, shuffle: bool) -> None:
+        self.loop_mode[guild_id] = loop_mode
+        self.shuffle_enabled[guild_id] = shuffle
+        self.journal.append(
+            {"op": "mode", "g": guild_id, "loop": loop_mode, "shuffle": shuffle}
+        )
+
+    def get_queue(self, guild_id: int) -> GuildQueue:
         if guild_id not in self.queues:
-            self.queues[guild_id] = deque()
+            self.queues[guild_id] = GuildQueue(guild_id, self.journal)
         return self.queues[guild_id]
 
+    def upcoming(self, guild_id: int, n: int) -> List[QueueItem]:
+        """The next ``n`` items in the order they will play."""
+        shuffle = self.shuffle_enabled.get(guild_id, False)
+        return self.get_queue(guild_id).peek(n, shuffle)
+
     def get_history(self, guild_id: int) -> Deque[QueueItem]:
         if guild_id not in self.history:
             self.history[guild_id] = deque()
         return self.history[guild_id]
 
     def add_to_queue(
-        self, guild_id: int, filepath: str, metadata: Dict[str, str], is_youtube: bool
+        self,
+        guild_id: int,
+        filepath: str,
+        metadata: Dict[str, str],
+        is_youtube: bool,
+        stream_url: Optional[str] = None,
+        requested_at: Optional[float] = None,
     ) -> None:
-        queue = self.get_queue(guild_id)
-        item = QueueItem(filepath, metadata, is_youtube)
-        queue.append(item)
+        item = QueueItem(filepath, metadata, is_youtube, stream_url, requested_at)
+        self.add_items(guild_id, [item])
+
+    def add_items(self, guild_id: int, items: List[QueueItem]) -> None:
+        self.actor(guild_id).send("enqueue", items)
+
+    def start(self, guild_id: int) -> None:
+        """Play the guild's queue, unless a queued track already is playing.
+
+        Idle music gives way right away.
+        """
+        self.actor(guild_id).send("play")
+
+    def actor(self, guild_id: int) -> GuildActor:
+        actor = self.actors.get(guild_id)
+        if actor is None:
+            actor = self.actors[guild_id] = GuildActor(guild_id, self.handlers)
+        return actor
+
+    def voice_client(self, guild_id: int) -> Optional[discord.VoiceClient]:
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild is not None else None
+        if isinstance(voice_client, discord.VoiceClient):
+            return voice_client
+        return None
+
+    def attach_tags(self, item: QueueItem) -> None:
+        """Fill in a local item's tags from the tag cache, in the background.
+
+        Safe to call from the audio player thread.
+        """
+        if item.is_youtube or "duration" in item.metadata:
+            return
+
+        async def attach() -> None:
+            tags = await tag_cache.get(item.filepath)
+            item.metadata.update(
+                {key: value for key, value in tags.items() if value != "unknown"}
+            )
+
+        asyncio.run_coroutine_threadsafe(attach(), self.bot.loop)
+
+    def refresh_prefetch(self, guild_id: int) -> None:
+        """Point the prefetcher at the guild's upcoming items.
+
+        Safe to call from the audio player thread, the work is posted back
+        to the event loop.
+        """
+
+        def refresh() -> None:
+            upcoming = self.upcoming(guild_id, self.prefetcher.depth)
+            self.prefetcher.schedule(guild_id, upcoming)
+            player = self.players.get(guild_id)
+            if (
+                player is not None
+                and player.preload_requested
+                and player.next_key is not self.peek_next(guild_id)
+            ):
+                self.request_preload(guild_id)
+
+        self.bot.loop.call_soon_threadsafe(refresh)
+
+    def active_files(self) -> Set[str]:
+        """Absolute paths of every queued or playing item, across all guilds."""
+        files = set()
+        for queue in list(self.queues.values()):
+            files.update(os.path.abspath(item.filepath) for item in list(queue))
+        for item in list(self.current.values()):
+            if item is not None:
+                files.add(os.path.abspath(item.filepath))
+        return files
+
+    def create_source(
+        self, item: QueueItem, pcm: bool = False, start: float = 0.0
+    ) -> discord.AudioSource:
+        """Source for ``item`` from ``start`` seconds in, except for streams."""
+        if item.stream_url and not os.path.exists(item.filepath):
+            on_complete: Optional[Callable[[str], None]] = None
+            youtube_cog = self.bot.get_cog("YouTube")
+            if youtube_cog is not None:
+                cached = youtube_cog.cached
+
+                # the stream finishes on the player thread, index it on the loop
+                def on_complete(path: str) -> None:
+                    self.bot.loop.call_soon_threadsafe(cached, path)
+
+            return CachingStreamSource(
+                item.stream_url,
+                item.filepath,
+                headers=item.metadata.get("stream_headers", ""),
+                acodec=item.metadata.get("acodec", ""),
+                requested_at=item.requested_at,
+                on_complete=on_complete,
+            )
+        if item.is_youtube:
+            # the youtube cog analyzes its own cache files
+            youtube_cog = self.bot.get_cog("YouTube")
+            if youtube_cog is not None and read_sidecar(item.filepath) is None:
+                loop = self.bot.loop
+                loop.call_soon_threadsafe(youtube_cog.normalize, item.filepath)
+            if pcm:
+                return open_pcm_source(item.filepath, prepare=False, start=start)
+            return open_source(item.filepath, prepare=False, start=start)
+        if pcm:
+            return open_pcm_source(item.filepath, start=start)
+        return open_source(item.filepath, start=start)
+
+    def item_duration(self, item: QueueItem) -> Optional[float]:
+        """Seconds ``item`` will play for, if known."""
+        if os.path.exists(item.filepath):
+            length = playback_length(item.filepath)
+            if length is not None:
+                return length
+        try:
+            return float(item.metadata["duration"])
+        except (KeyError, ValueError):
+            return None
+
+    def peek_next(self, guild_id: int) -> Optional[QueueItem]:
+        """The item ``get_next`` will return, if that's known ahead of time."""
+        current = self.current.get(guild_id)
+        if self.loop_mode.get(guild_id, "off") == "single" and current is not None:
+            return current
+        upcoming = self.upcoming(guild_id, 1)
+        return upcoming[0] if upcoming else None
+
+    def request_preload(self, guild_id: int) -> None:
+        task = self.preload_tasks.get(guild_id)
+        if task is not None and not task.done():
+            # let the running one go again once it's done
+            self.preload_dirty.add(guild_id)
+            return
+        self.preload_tasks[guild_id] = asyncio.create_task(self.preload(guild_id))
+
+    async def preload(self, guild_id: int) -> None:
+        """Open the next item's source and hand it to the guild's player."""
+        while True:
+            self.preload_dirty.discard(guild_id)
+            try:
+                await self._preload_once(guild_id)
+            except Exception as e:
+                print(f"preload failed: {e}")
+            if guild_id not in self.preload_dirty:
+                return
+
+    async def _preload_once(self, guild_id: int) -> None:
+        player = self.players.get(guild_id)
+        if player is None or player.closed:
+            return
+        item = self.peek_next(guild_id)
+        if item is None:
+            player.clear_next()
+            return
+        if player.next_key is item:
+            return
+        if self.needs_resolve(item):
+            youtube_cog = self.bot.get_cog("YouTube")
+            if youtube_cog is None or not await youtube_cog.prepare_item(item):
+                return
+
+        def still_wanted() -> bool:
+            return (
+                self.players.get(guild_id) is player
+                and not player.closed
+                and self.peek_next(guild_id) is item
+            )
 
-    def get_next(self, guild_id: int) -> Optional[QueueItem]:
+        if not still_wanted():
+            return
+        source = await asyncio.to_thread(self.create_source, item, self.pcm)
+        if not still_wanted() or not player.set_next(
+            item, source, self.item_duration(item)
+        ):
+            await asyncio.to_thread(source.cleanup)
+
+    def get_next(
+        self, guild_id: int, skip_single: bool = False
+    ) -> Optional[QueueItem]:
+        """Take the item to play next; ``skip_single`` ignores /loop single."""
         queue = self.get_queue(guild_id)
         loop = self.loop_mode.get(guild_id, "off")
 
-        if loop == "single" and guild_id in self.current and self.current[guild_id]:
+        if loop == "single" and not skip_single and self.current.get(guild_id):
             return self.current[guild_id]
 
         if not queue:
             if loop == "queue" and guild_id in self.history:
                 history = self.history[guild_id]
                 if history:
-                    queue.extend(history)
-                    history.clear()
+                    # fresh ids, the same item may be in history more than once
+                    queue.extend([item.copy() for item in history])
+                    self.clear_history(guild_id)
 
         if not queue:
             return None
 
-        if self.shuffle_enabled.get(guild_id, False):
-            idx = random.randint(0, len(queue) - 1)
-            items = list(queue)
-            item = items.pop(idx)
-            queue.clear()
-            queue.extend(items)
-            return item
-        else:
-            return queue.popleft()
-
-    def play_next(self, guild_id: int, voice_client: discord.VoiceClient) -> None:
+        return queue.pop_next(self.shuffle_enabled.get(guild_id, False))
+
+    def advance(self, guild_id: int, skip_single: bool = False) -> None:
+        """Move on from the current item to the next one, if there is one."""
+        current_item = self.current.get(guild_id)
+        if current_item is not None:
+            self.push_history(guild_id, current_item)
+
+        next_item = self.get_next(guild_id, skip_single)
+        self.refresh_prefetch(guild_id)
+        if next_item is not None:
+            self.set_current(guild_id, next_item)
+            self.start_item(guild_id, next_item)
+            return
+
+        self.actor(guild_id).next_token()
+        self.set_current(guild_id, None)
+        self.players.pop(guild_id, None)
+        self.ended_at.pop(guild_id, None)
+        if current_item is not None:
+            # skipped past the last track
+            mixers.remove(guild_id, "queue")
+        idle = self.idle_player()
+        if idle is not None:
+            idle.playback_ended(guild_id)
+
+    def idle_player(self) -> Optional[Idle]:
+        voice_cog = self.bot.get_cog("Voice")
+        return voice_cog.idle_player if voice_cog is not None else None
+
+    def needs_resolve(self, item: QueueItem) -> bool:
+        """Placeholder youtube item (e.g. from a playlist) with nothing to play yet."""
+        return (
+            item.is_youtube
+            and item.stream_url is None
+            and not os.path.exists(item.filepath)
+        )
+
+    def start_item(self, guild_id: int, item: QueueItem) -> None:
+        """Play ``item`` now, cutting off whatever is playing.
+
+        The source is opened off the loop (that can spawn ffmpeg or build a
+        page index) and handed back to the actor as an ``opened`` event.
+        """
+        actor = self.actor(guild_id)
+        token = actor.next_token()
+        voice_client = self.voice_client(guild_id)
+        if voice_client is None or not voice_client.is_connected():
+            self.set_current(guild_id, None)
+            return
+        ended_at = self.ended_at.pop(guild_id, None)
+        mixer = mixers.get(guild_id)
+        if mixer is not None and mixer.has_input("queue"):
+            ended_at = time.perf_counter()
+        # the old player's end callback carries an old token now, so it
+        # won't advance
+        mixers.remove(guild_id, "queue")
+        if not IDLE_BLEND:
+            mixers.remove(guild_id, "idle")
+
+        if self.needs_resolve(item):
+            asyncio.create_task(self.resolve(guild_id, token, item))
+            return
+
+        previous = self.players.pop(guild_id, None)
+        # skipping to the item that was already pre-opened reuses its source
+        source = None
+        if previous is not None and not item.position:
+            source = previous.take_next(item)
+        asyncio.create_task(self.open_item(guild_id, token, item, source, ended_at))
+
+    async def open_item(
+        self,
+        guild_id: int,
+        token: int,
+        item: QueueItem,
+        source: Optional[discord.AudioSource],
+        ended_at: Optional[float],
+    ) -> None:
+        """Open ``item`` from its saved position, on a worker thread."""
+        start = item.position
+        try:
+            if source is None:
+                source = await asyncio.to_thread(
+                    self.create_source, item, self.pcm, start
+                )
+                if isinstance(source, CachingStreamSource):
+                    # still downloading, it can only play from the start
+                    start = 0.0
+            duration = await asyncio.to_thread(self.item_duration, item)
+        except Exception as e:
+            print(f"couldn't open {item.filepath}: {e}")
+            source, duration = None, None
+        actor = self.actor(guild_id)
+        actor.send("opened", token, item, source, start, duration, ended_at)
+
+    async def resolve(self, guild_id: int, token: int, item: QueueItem) -> None:
+        youtube_cog = self.bot.get_cog("YouTube")
+        try:
+            ready = youtube_cog is not None and await youtube_cog.prepare_item(item)
+        except Exception as e:
+            print(f"resolve failed: {e}")
+            ready = False
+        self.actor(guild_id).send("resolved", token, item, ready)
+
+    # actor handlers, each runs alone on the event loop
+
+    def _on_enqueue(self, guild_id: int, items: List[QueueItem]) -> None:
+        self.get_queue(guild_id).extend(items)
+        for item in items:
+            self.attach_tags(item)
+        self.refresh_prefetch(guild_id)
+
+    def _on_play(self, guild_id: int) -> None:
+        if self.current.get(guild_id) is None:
+            self.advance(guild_id)
+
+    def _on_skip(self, guild_id: int) -> bool:
         if self.current.get(guild_id) is not None:
-            history = self.get_history(guild_id)
-            current_item = self.current[guild_id]
-            if current_item is not None:
-                history.append(current_item)
-                if len(history) > 50:
-                    history.popleft()
+            self.advance(guild_id)
+            return True
+        mixer = mixers.get(guild_id)
+        if mixer is not None and mixer.has_input("idle"):
+            # idle music, its end callback schedules the next track
+            mixer.remove_input("idle")
+            idle = self.idle_player()
+            if idle is not None:
+                idle.playback_ended(guild_id)
+            return True
+        return False
+
+    def _on_previous(self, guild_id: int) -> Optional[QueueItem]:
+        prev_item = self.pop_history(guild_id)
+        if prev_item is None:
+            return None
+        current_item = self.current.get(guild_id)
+        if current_item is not None:
+            # coming back to it later picks up where it was left
+            current_item.position = self.position(guild_id) or current_item.position
+            self.get_queue(guild_id).appendleft(current_item)
+        self.set_current(guild_id, prev_item)
+        self.refresh_prefetch(guild_id)
+        self.start_item(guild_id, prev_item)
+        return prev_item
+
+    def _on_jump(self, guild_id: int, item_id: int) -> bool:
+        shuffle = self.shuffle_enabled.get(guild_id, False)
+        if not self.get_queue(guild_id).move(item_id, 0, shuffle):
+            return False
+        # the target is what was asked for, even when looping a single item
+        self.advance(guild_id, skip_single=True)
+        return True
+
+    def _on_shuffle(self, guild_id: int, enabled: bool) -> None:
+        if enabled and not self.shuffle_enabled.get(guild_id, False):
+            self.get_queue(guild_id).reshuffle()
+        self.set_modes(guild_id, self.loop_mode.get(guild_id, "off"), enabled)
+        self.refresh_prefetch(guild_id)
+
+    def _on_remove(self, guild_id: int, item_id: int) -> Optional[QueueItem]:
+        item = self.get_queue(guild_id).remove(item_id)
+        if item is not None:
+            self.refresh_prefetch(guild_id)
+        return item
+
+    def _on_move(self, guild_id: int, item_id: int, position: int) -> Optional[int]:
+        """Move an item to ``position`` (from 1), returning where it ended up."""
+        queue = self.get_queue(guild_id)
+        shuffle = self.shuffle_enabled.get(guild_id, False)
+        if not queue.move(item_id, position - 1, shuffle):
+            return None
+        self.refresh_prefetch(guild_id)
+        return queue.position(item_id, shuffle) + 1
+
+    def _on_loop(self, guild_id: int, mode: str) -> None:
+        self.set_modes(guild_id, mode, self.shuffle_enabled.get(guild_id, False))
+        # looping a single item changes what plays next
+        self.refresh_prefetch(guild_id)
+
+    def _on_stop(self, guild_id: int) -> None:
+        current = self.current.get(guild_id)
+        if current is not None:
+            current.position = self.position(guild_id) or current.position
+            self.stopped[guild_id] = current
+        self.actor(guild_id).next_token()
+        self.set_current(guild_id, None)
+        self.prefetcher.cancel_guild(guild_id)
+        self.players.pop(guild_id, None)
+        voice_client = self.voice_client(guild_id)
+        if voice_client is not None:
+            voice_client.stop()
+        idle = self.idle_player()
+        if idle is not None:
+            idle.playback_ended(guild_id)
+
+    def _on_seek(self, guild_id: int, seconds: float) -> bool:
+        item = self.current.get(guild_id)
+        if item is None or not os.path.exists(item.filepath):
+            return False
+        item.position = seconds
+        self.start_item(guild_id, item)
+        return True
+
+    def _on_resume(self, guild_id: int) -> Optional[QueueItem]:
+        item = self.stopped.pop(guild_id, None)
+        if item is None:
+            return None
+        current = self.current.get(guild_id)
+        if current is not None:
+            current.position = self.position(guild_id) or current.position
+            self.get_queue(guild_id).appendleft(current)
+        self.set_current(guild_id, item)
+        self.refresh_prefetch(guild_id)
+        self.start_item(guild_id, item)
+        return item
 
-        next_item = self.get_next(guild_id)
-        if next_item is None:
-            self.current[guild_id] = None
+    def _on_ended(
+        self, guild_id: int, token: int, error: Optional[Exception], ended_at: float
+    ) -> None:
+        if error:
+            print(f"playback error: {error}")
+        if token != self.actor(guild_id).token:
+            # skipped, stopped or replaced since
             return
+        self.ended_at[guild_id] = ended_at
+        self.advance(guild_id)
 
-        self.current[guild_id] = next_item
+    def _on_switched(self, guild_id: int, token: int, item: QueueItem) -> None:
+        """The player moved on to its pre-opened item, catch the queue up."""
+        if token != self.actor(guild_id).token:
+            return
+        current = self.current.get(guild_id)
+        if current is not None:
+            self.push_history(guild_id, current)
+        if item is not current:
+            self.get_queue(guild_id).remove(item.item_id)
+        self.set_current(guild_id, item)
+        self.refresh_prefetch(guild_id)
+        self.attach_tags(item)
+
+    def _on_opened(
+        self,
+        guild_id: int,
+        token: int,
+        item: QueueItem,
+        source: Optional[discord.AudioSource],
+        start: float,
+        duration: Optional[float],
+        ended_at: Optional[float],
+    ) -> None:
+        actor = self.actor(guild_id)
+        if token != actor.token or self.current.get(guild_id) is not item:
+            if source is not None:
+                close_in_background(source)
+            return
+        if source is None:
+            self.set_current(guild_id, None)
+            self.advance(guild_id)
+            return
+        voice_client = self.voice_client(guild_id)
+        if voice_client is None or not voice_client.is_connected():
+            close_in_background(source)
+            self.set_current(guild_id, None)
+            return
+        item.position = 0.0
+        if duration is not None:
+            duration = max(duration - start, 0.0)
 
-        def after_playing(error: Optional[Exception]) -> None:
-            if error:
-                print(f"playback error: {error}")
-            self.play_next(guild_id, voice_client)
+        def after_playing() -> None:
+            ended_at = player.ended_at or time.perf_counter()
+            actor.send_threadsafe("ended", token, None, ended_at)
 
-        voice_client.play(
-            discord.FFmpegPCMAudio(next_item.filepath), after=after_playing
+        loop = self.bot.loop
+        player = GaplessSource(
+            item,
+            source,
+            duration,
+            on_preload=lambda: loop.call_soon_threadsafe(
+                self.request_preload, guild_id
+            ),
+            on_switch=lambda key: actor.send_threadsafe("switched", token, key),
+            ended_at=ended_at,
+            offset=start,
         )
+        self.players[guild_id] = player
+        mixers.play(guild_id, voice_client, "queue", player, on_end=after_playing)
+        # restored items were journaled before their tags came in
+        self.attach_tags(item)
+        idle = self.idle_player()
+        if idle is not None:
+            idle.playback_started(guild_id)
+
+    def _on_resolved(
+        self, guild_id: int, token: int, item: QueueItem, ready: bool
+    ) -> None:
+        if token != self.actor(guild_id).token:
+            return
+        if self.current.get(guild_id) is not item:
+            return
+        if not ready:
+            print(f"couldn't resolve {item.metadata.get('url')}, skipping")
+            self.set_current(guild_id, None)
+            self.advance(guild_id)
+            return
+        self.start_item(guild_id, item)
 
     @app_commands.command(name="queue", description="show current queue")
     async def show_queue(self, interaction: discord.Interaction) -> None:
@@ -129,9 +874,9 @@ class Queue(commands.Cog):
 
         if queue:
             queue_text = "**up next**\n"
-            for i, item in enumerate(list(queue)[:10], 1):
+            for i, item in enumerate(self.upcoming(guild_id, 10), 1):
                 title = item.metadata.get("title", "unknown")
-                queue_text += f"{i}. {title}\n"
+                queue_text += f"{i}. {title}  `#{item.item_id}`\n"
 
             if len(queue) > 10:
                 queue_text += f"\n... and {len(queue) - 10} more"
@@ -164,13 +909,14 @@ class Queue(commands.Cog):
             await interaction.response.send_message("only works in servers")
             return
 
-        voice_client = interaction.guild.voice_client
-        if voice_client is None or not isinstance(voice_client, discord.VoiceClient):
+        guild_id = interaction.guild.id
+        if self.voice_client(guild_id) is None:
             await interaction.response.send_message("not playing anything")
             return
 
-        if voice_client.is_playing():
-            voice_client.stop()
+        if not await self.actor(guild_id).ask("skip"):
+            await interaction.response.send_message("not playing anything")
+            return
 
         await interaction.response.send_message("skipped")
 
@@ -180,17 +926,12 @@ class Queue(commands.Cog):
             await interaction.response.send_message("only works in servers")
             return
 
-        voice_client = interaction.guild.voice_client
-        if voice_client is None or not isinstance(voice_client, discord.VoiceClient):
+        guild_id = interaction.guild.id
+        if self.voice_client(guild_id) is None:
             await interaction.response.send_message("not playing anything")
             return
 
-        if voice_client.is_playing():
-            voice_client.stop()
-
-        guild_id = interaction.guild.id
-        self.current[guild_id] = None
-
+        await self.actor(guild_id).ask("stop")
         await interaction.response.send_message("stopped")
 
     @app_commands.command(name="previous", description="go back to previous song")
@@ -200,42 +941,72 @@ class Queue(commands.Cog):
             return
 
         guild_id = interaction.guild.id
-        history = self.get_history(guild_id)
+        if self.voice_client(guild_id) is None:
+            await interaction.response.send_message("not connected to voice")
+            return
 
-        if not history:
+        prev_item = await self.actor(guild_id).ask("previous")
+        if prev_item is None:
             await interaction.response.send_message("no previous song")
             return
 
-        prev_item = history.pop()
-
-        if self.current.get(guild_id) is not None:
-            queue = self.get_queue(guild_id)
-            current_item = self.current[guild_id]
-            if current_item is not None:
-                queue.appendleft(current_item)
+        await interaction.response.send_message(
+            f"playing: {prev_item.metadata.get('title', 'unknown')}"
+        )
 
-        voice_client = interaction.guild.voice_client
-        if voice_client is None or not isinstance(voice_client, discord.VoiceClient):
-            await interaction.response.send_message("not connected to voice")
+    @app_commands.command(name="seek", description="jump to a time in the song")
+    async def seek(self, interaction: discord.Interaction, position: str) -> None:
+        if interaction.guild is None:
+            await interaction.response.send_message("only works in servers")
             return
 
-        self.current[guild_id] = prev_item
+        seconds = parse_timestamp(position)
+        if seconds is None:
+            await interaction.response.send_message("use a time like 90 or 1:30")
+            return
 
-        def after_playing(error: Optional[Exception]) -> None:
-            if error:
-                print(f"playback error: {error}")
-            self.play_next(guild_id, voice_client)
+        guild_id = interaction.guild.id
+        current = self.current.get(guild_id)
+        if self.voice_client(guild_id) is None or current is None:
+            await interaction.response.send_message("not playing anything")
+            return
+        if not os.path.exists(current.filepath):
+            await interaction.response.send_message(
+                "still downloading, can't seek in this one yet"
+            )
+            return
+        duration = self.item_duration(current)
+        if duration is not None and seconds >= duration:
+            await interaction.response.send_message("that's past the end of the song")
+            return
 
-        if voice_client.is_playing():
-            voice_client.stop()
+        if not await self.actor(guild_id).ask("seek", seconds):
+            await interaction.response.send_message("not playing anything")
+            return
 
-        voice_client.play(
-            discord.FFmpegPCMAudio(prev_item.filepath), after=after_playing
-        )
         await interaction.response.send_message(
-            f"playing: {prev_item.metadata.get('title', 'unknown')}"
+            f"seeked to {format_timestamp(seconds)}"
         )
 
+    @app_commands.command(name="resume", description="resume what /stop stopped")
+    async def resume(self, interaction: discord.Interaction) -> None:
+        if interaction.guild is None:
+            await interaction.response.send_message("only works in servers")
+            return
+
+        guild_id = interaction.guild.id
+        if self.voice_client(guild_id) is None:
+            await interaction.response.send_message("not connected to voice")
+            return
+
+        item = await self.actor(guild_id).ask("resume")
+        if item is None:
+            await interaction.response.send_message("nothing to resume")
+            return
+
+        title = item.metadata.get("title", "unknown")
+        await interaction.response.send_message(f"resumed: {title}")
+
     @app_commands.command(name="shuffle", description="toggle shuffle mode")
     async def shuffle(self, interaction: discord.Interaction, mode: str) -> None:
         if interaction.guild is None:
@@ -246,14 +1017,67 @@ class Queue(commands.Cog):
             await interaction.response.send_message("use /shuffle on or /shuffle off")
             return
 
-        guild_id = interaction.guild.id
         enabled = mode.lower() == "on"
-        self.shuffle_enabled[guild_id] = enabled
+        await self.actor(interaction.guild.id).ask("shuffle", enabled)
 
         await interaction.response.send_message(
             f"shuffle {'enabled' if enabled else 'disabled'}"
         )
 
+    @app_commands.command(name="remove", description="remove a song from the queue")
+    async def remove(self, interaction: discord.Interaction, item_id: int) -> None:
+        if interaction.guild is None:
+            await interaction.response.send_message("only works in servers")
+            return
+
+        item = await self.actor(interaction.guild.id).ask("remove", item_id)
+        if item is None:
+            await interaction.response.send_message(
+                "no song with that id, use /queue to see ids"
+            )
+            return
+
+        await interaction.response.send_message(
+            f"removed: {item.metadata.get('title', 'unknown')}"
+        )
+
+    @app_commands.command(name="move", description="move a song to a new position")
+    async def move(
+        self, interaction: discord.Interaction, item_id: int, position: int
+    ) -> None:
+        if interaction.guild is None:
+            await interaction.response.send_message("only works in servers")
+            return
+
+        actor = self.actor(interaction.guild.id)
+        new_position = await actor.ask("move", item_id, position)
+        if new_position is None:
+            await interaction.response.send_message(
+                "no song with that id, use /queue to see ids"
+            )
+            return
+
+        await interaction.response.send_message(f"moved to position {new_position}")
+
+    @app_commands.command(name="jump", description="skip straight to a queued song")
+    async def jump(self, interaction: discord.Interaction, item_id: int) -> None:
+        if interaction.guild is None:
+            await interaction.response.send_message("only works in servers")
+            return
+
+        guild_id = interaction.guild.id
+        if self.voice_client(guild_id) is None:
+            await interaction.response.send_message("not connected to voice")
+            return
+
+        if not await self.actor(guild_id).ask("jump", item_id):
+            await interaction.response.send_message(
+                "no song with that id, use /queue to see ids"
+            )
+            return
+
+        await interaction.response.send_message("jumped")
+
     @app_commands.command(name="loop", description="set loop mode (single, queue, off)")
     async def loop(self, interaction: discord.Interaction, mode: str) -> None:
         if interaction.guild is None:
@@ -267,11 +1091,23 @@ class Queue(commands.Cog):
             )
             return
 
-        guild_id = interaction.guild.id
-        self.loop_mode[guild_id] = mode_lower
+        await self.actor(interaction.guild.id).ask("loop", mode_lower)
 
         await interaction.response.send_message(f"loop mode: {mode_lower}")
 
+    @app_commands.command(name="volume", description="set volume (0-200%)")
+    async def volume(self, interaction: discord.Interaction, percent: int) -> None:
+        if interaction.guild is None:
+            await interaction.response.send_message("only works in servers")
+            return
+
+        if not 0 <= percent <= 200:
+            await interaction.response.send_message("volume goes from 0 to 200")
+            return
+
+        mixers.set_volume(interaction.guild.id, percent / 100)
+        await interaction.response.send_message(f"volume: {percent}%")
+
 
 async def setup(bot: commands.Bot) -> None:
     await bot.add_cog(Queue(bot))
@@ -0,0 +1,184 @@
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import discord
+from discord.opus import OPUS_SILENCE
+
+from .player import close_in_background
+
+# frames a listener may lag behind the station before it skips ahead, 1s
+RING_FRAMES = 50
+
+# hands out the station's next track as an Opus source, None when it's done
+SourceFactory = Callable[[], Optional[discord.AudioSource]]
+
+
+class Station:
+    """One stream of Opus frames shared by every guild listening to it.
+
+    Tracks come from ``next_source`` one after another and are read (and,
+    for anything that isn't Ogg Opus already, encoded by ffmpeg) once, no
+    matter how many guilds listen. Frames go into a small ring; there's no
+    thread of its own, whichever listener is furthest along reads the next
+    frame from the source when it needs it, and the others pick it up from
+    the ring. A guild joining mid-stream starts at the newest frame, and
+    one that falls more than ``RING_FRAMES`` behind skips ahead to it.
+
+    ``next_source`` can spawn ffmpeg, so it never runs under the lock or on
+    a player thread: each track is opened on a thread of its own while the
+    one before it plays, and listeners get silence if it isn't ready in
+    time.
+
+    The station stops (and closes its source) once its last listener is
+    gone, or ``next_source`` has nothing more to play.
+    """
+
+    def __init__(self, name: str, next_source: SourceFactory) -> None:
+        self.name: str = name
+        self.next_source = next_source
+        self.source: Optional[discord.AudioSource] = None
+        # opened ahead of time, to play once ``source`` runs out
+        self.upcoming: Optional[discord.AudioSource] = None
+        self.opening: bool = False
+        # next_source had nothing more to play
+        self.exhausted: bool = False
+        self.frames: List[bytes] = [b""] * RING_FRAMES
+        # frames read so far; frame n sits at n % RING_FRAMES
+        self.seq: int = 0
+        self.listeners: int = 0
+        self.closed: bool = False
+        self._lock = threading.Lock()
+
+    def listen(self) -> Optional["StationListener"]:
+        """A source for one more guild, or None if the station has ended."""
+        with self._lock:
+            if self.closed:
+                return None
+            self.listeners += 1
+            # start with the newest frame, or the first one if there's none
+            return StationListener(self, max(self.seq - 1, 0))
+
+    def frame(self, seq: int) -> Tuple[bytes, int]:
+        """Frame ``seq`` (or the closest still around) and the seq after it."""
+        with self._lock:
+            if seq < self.seq - RING_FRAMES:
+                seq = self.seq - 1
+            if seq >= self.seq:
+                data = self._read()
+                if not data:
+                    return b"", seq
+                self.frames[self.seq % RING_FRAMES] = data
+                self.seq += 1
+                seq = self.seq - 1
+            return self.frames[seq % RING_FRAMES], seq + 1
+
+    def _read(self) -> bytes:
+        # with the lock held
+        while not self.closed:
+            opened = self.source is None
+            if opened:
+                if self.upcoming is None:
+                    if self.exhausted:
+                        break
+                    self._open_upcoming()
+                    return OPUS_SILENCE
+                self.source, self.upcoming = self.upcoming, None
+                # the track after this one opens while this one plays
+                self._open_upcoming()
+            data = self.source.read()
+            if data:
+                return data
+            close_in_background(self.source)
+            self.source = None
+            if opened:
+                # a track that won't play at all, don't spin through the rest
+                print(f"station {self.name}: track ended right away, stopping")
+                break
+        self._close()
+        return b""
+
+    def _open_upcoming(self) -> None:
+        # with the lock held
+        if self.opening or self.upcoming is not None or self.exhausted:
+            return
+        self.opening = True
+        threading.Thread(
+            target=self._open, name=f"station-{self.name}", daemon=True
+        ).start()
+
+    def _open(self) -> None:
+        try:
+            source = self.next_source()
+        except Exception as e:
+            print(f"station {self.name}: couldn't open the next track: {e}")
+            source = None
+        with self._lock:
+            self.opening = False
+            if source is None:
+                self.exhausted = True
+            elif self.closed:
+                close_in_background(source)
+            else:
+                self.upcoming = source
+
+    def leave(self) -> None:
+        with self._lock:
+            self.listeners -= 1
+            if self.listeners <= 0:
+                self._close()
+
+    def _close(self) -> None:
+        self.closed = True
+        for source in (self.source, self.upcoming):
+            if source is not None:
+                close_in_background(source)
+        self.source = self.upcoming = None
+
+
+class StationListener(discord.AudioSource):
+    """One guild's view of a station, played like any other Opus source."""
+
+    def __init__(self, station: Station, seq: int) -> None:
+        self.station = station
+        self.seq: int = seq
+        self.left: bool = False
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        data, self.seq = self.station.frame(self.seq)
+        return data
+
+    def cleanup(self) -> None:
+        if not self.left:
+            self.left = True
+            self.station.leave()
+
+
+class Stations:
+    """Shared stations by name, started when the first guild tunes in."""
+
+    def __init__(self) -> None:
+        self.stations: Dict[str, Station] = {}
+        self._lock = threading.Lock()
+
+    def listen(self, name: str, next_source: SourceFactory) -> StationListener:
+        """Tune into ``name``, starting it with ``next_source`` if it isn't on."""
+        with self._lock:
+            station = self.stations.get(name)
+            listener = station.listen() if station is not None else None
+            if listener is None:
+                station = Station(name, next_source)
+                self.stations[name] = station
+                listener = station.listen()
+            assert listener is not None
+            return listener
+
+    def listeners(self, name: str) -> int:
+        with self._lock:
+            station = self.stations.get(name)
+        return station.listeners if station is not None else 0
+
+
+stations = Stations()
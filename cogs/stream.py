@@ -0,0 +1,123 @@
+import os
+import subprocess
+import threading
+import time
+from typing import IO, Callable, Iterator, Optional
+
+import discord
+from discord.oggparse import OggStream
+
+from .metrics import metrics
+
+
+class _TeeReader:
+    """File-like wrapper that copies everything read from ``source`` into ``sink``."""
+
+    def __init__(self, source: IO[bytes], sink: IO[bytes]) -> None:
+        self.source = source
+        self.sink = sink
+
+    def read(self, size: int) -> bytes:
+        data = self.source.read(size)
+        if data:
+            self.sink.write(data)
+        return data
+
+
+class CachingStreamSource(discord.AudioSource):
+    """Plays a remote audio stream while writing it into the cache.
+
+    ffmpeg remuxes (or encodes, if the source isn't opus) the stream into
+    Ogg Opus on stdout. Packets are handed to discord as they arrive and
+    the same bytes are written to a part file that replaces ``cache_file``
+    once the stream completes, so later plays hit the cache.
+    """
+
+    def __init__(
+        self,
+        stream_url: str,
+        cache_file: str,
+        headers: str = "",
+        acodec: str = "",
+        requested_at: Optional[float] = None,
+        on_complete: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.cache_file: str = cache_file
+        self.on_complete = on_complete
+        self.part_file: str = f"{cache_file}.{os.getpid()}.{id(self)}.part"
+        self.requested_at: float = requested_at or time.perf_counter()
+        self.first_audio: bool = False
+
+        args = [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "warning",
+            "-reconnect",
+            "1",
+            "-reconnect_streamed",
+            "1",
+            "-reconnect_delay_max",
+            "5",
+        ]
+        if headers:
+            args += ["-headers", headers]
+        args += ["-i", stream_url, "-vn", "-map", "0:a:0"]
+        if acodec == "opus":
+            args += ["-c:a", "copy"]
+        else:
+            args += ["-c:a", "libopus", "-b:a", "128k"]
+        args += ["-f", "opus", "pipe:1"]
+
+        self._process = subprocess.Popen(
+            args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE
+        )
+        assert self._process.stdout is not None
+        self._sink = open(self.part_file, "wb")
+        self._tee = _TeeReader(self._process.stdout, self._sink)
+        self._packets: Iterator[bytes] = OggStream(self._tee).iter_packets()
+        self._finished: bool = False
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        for packet in self._packets:
+            # the header packets aren't audio, skip them
+            if packet.startswith((b"OpusHead", b"OpusTags")):
+                continue
+            if not self.first_audio:
+                self.first_audio = True
+                elapsed = (time.perf_counter() - self.requested_at) * 1000
+                metrics.record("time_to_first_audio", elapsed)
+                print(f"time to first audio: {elapsed:.0f}ms")
+            return packet
+        self._finished = True
+        return b""
+
+    def cleanup(self) -> None:
+        if self._finished:
+            self._finalize()
+        else:
+            # stopped early (skip/stop), keep filling the cache in the background
+            threading.Thread(target=self._drain, daemon=True).start()
+
+    def _drain(self) -> None:
+        try:
+            while self._tee.read(65536):
+                pass
+        except Exception as e:
+            print(f"stream drain failed: {e}")
+        self._finalize()
+
+    def _finalize(self) -> None:
+        returncode = self._process.wait()
+        self._sink.close()
+        if returncode == 0 and os.path.getsize(self.part_file) > 0:
+            os.replace(self.part_file, self.cache_file)
+            print(f"cached stream to {self.cache_file}")
+            if self.on_complete is not None:
+                self.on_complete(self.cache_file)
+        else:
+            print(f"stream ended with code {returncode}, discarding partial cache")
+            os.remove(self.part_file)
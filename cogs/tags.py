@@ -0,0 +1,98 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from mutagen import File
+
+# mutagen key for each field: easy/vorbis style first, then the id3 frame
+TAG_KEYS = {
+    "title": ("title", "TIT2"),
+    "artist": ("artist", "TPE1"),
+    "album": ("album", "TALB"),
+}
+
+
+def unknown_tags() -> Dict[str, str]:
+    return {"title": "unknown", "artist": "unknown", "album": "unknown"}
+
+
+def read_tags(filepath: str) -> Dict[str, str]:
+    """Title, artist, album and duration (seconds, as a string) of a file."""
+    tags = unknown_tags()
+    try:
+        audio = File(filepath)
+        if audio is None:
+            return tags
+
+        if audio.tags:
+            for field, keys in TAG_KEYS.items():
+                for key in keys:
+                    if key in audio.tags:
+                        value = audio.tags[key]
+                        if isinstance(value, list):
+                            value = value[0]
+                        tags[field] = str(value)
+                        break
+
+        length = getattr(audio.info, "length", None)
+        if length:
+            tags["duration"] = f"{length:.0f}"
+    except Exception as e:
+        print(f"error reading metadata: {e}")
+    return tags
+
+
+class TagCache:
+    """Bounded cache of tag reads, keyed by path, size and mtime.
+
+    Files are opened and parsed on a small thread pool, never on the
+    event loop. An entry is only reused while the file's size and mtime
+    still match, so a file rewritten in place is read again; the least
+    recently used entries are dropped past ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = 4096, workers: int = 2) -> None:
+        self.max_entries: int = max_entries
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="tag-read"
+        )
+        # abspath -> (size, mtime_ns, tags)
+        self._entries: "OrderedDict[str, Tuple[int, int, Dict[str, str]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def cached(self, path: str) -> Optional[Dict[str, str]]:
+        """Tags last read for ``path``, without touching the file."""
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(path))
+        return entry[2] if entry is not None else None
+
+    def _read(self, path: str) -> Dict[str, str]:
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return unknown_tags()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+                self._entries.move_to_end(path)
+                return entry[2]
+        tags = read_tags(path)
+        with self._lock:
+            self._entries[path] = (st.st_size, st.st_mtime_ns, tags)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return tags
+
+    async def get(self, path: str) -> Dict[str, str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._read, path)
+
+
+tag_cache = TagCache()
@@ -0,0 +1,315 @@
+import random
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .journal import QueueJournal
+    from .queue import QueueItem
+
+
+class _Node:
+    __slots__ = ("value", "priority", "size", "left", "right", "parent")
+
+    def __init__(self, value: object) -> None:
+        self.value = value
+        self.priority: float = random.random()
+        self.size: int = 1
+        self.left: Optional["_Node"] = None
+        self.right: Optional["_Node"] = None
+        self.parent: Optional["_Node"] = None
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node is not None else 0
+
+
+def _update(node: _Node) -> None:
+    node.size = 1 + _size(node.left) + _size(node.right)
+    if node.left is not None:
+        node.left.parent = node
+    if node.right is not None:
+        node.right.parent = node
+
+
+def _split(
+    node: Optional[_Node], k: int
+) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Split into the first ``k`` nodes and the rest."""
+    if node is None:
+        return None, None
+    if _size(node.left) >= k:
+        left, right = _split(node.left, k)
+        node.left = right
+        _update(node)
+        if left is not None:
+            left.parent = None
+        return left, node
+    left, right = _split(node.right, k - _size(node.left) - 1)
+    node.right = left
+    _update(node)
+    if right is not None:
+        right.parent = None
+    return node, right
+
+
+def _merge(a: Optional[_Node], b: Optional[_Node]) -> Optional[_Node]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+
+class IndexedList:
+    """Sequence with O(log n) positional insert, remove and lookup.
+
+    An implicit treap: nodes are ordered by position and carry subtree
+    sizes, and parent links let a node handed out by ``insert`` find its
+    own index without scanning.
+    """
+
+    def __init__(self) -> None:
+        self.root: Optional[_Node] = None
+
+    def __len__(self) -> int:
+        return _size(self.root)
+
+    def _set_root(self, root: Optional[_Node]) -> None:
+        self.root = root
+        if root is not None:
+            root.parent = None
+
+    def insert(self, index: int, value: object) -> _Node:
+        index = max(0, min(index, len(self)))
+        node = _Node(value)
+        if index == len(self):
+            self._set_root(_merge(self.root, node))
+            return node
+        left, right = _split(self.root, index)
+        self._set_root(_merge(_merge(left, node), right))
+        return node
+
+    def index(self, node: _Node) -> int:
+        i = _size(node.left)
+        while node.parent is not None:
+            if node is node.parent.right:
+                i += _size(node.parent.left) + 1
+            node = node.parent
+        return i
+
+    def remove(self, node: _Node) -> None:
+        left, rest = _split(self.root, self.index(node))
+        _, right = _split(rest, 1)
+        node.parent = node.left = node.right = None
+        node.size = 1
+        self._set_root(_merge(left, right))
+
+    def node_at(self, index: int) -> Optional[_Node]:
+        node = self.root
+        while node is not None:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node
+            else:
+                index -= left + 1
+                node = node.right
+        return None
+
+    def __iter__(self) -> Iterator[object]:
+        stack: List[_Node] = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.value
+            node = node.right
+
+    def load(self, values: List[object]) -> List[_Node]:
+        """Replace the contents with ``values`` in O(n), returning their nodes.
+
+        Builds a perfectly balanced tree whose priorities fall by depth, so
+        it is a valid treap that later random inserts can work with.
+        """
+        nodes = [_Node(value) for value in values]
+
+        def build(lo: int, hi: int, depth: int) -> Optional[_Node]:
+            if lo >= hi:
+                return None
+            mid = (lo + hi) // 2
+            node = nodes[mid]
+            node.priority = 1.0 - (depth + random.random()) / 64
+            node.left = build(lo, mid, depth + 1)
+            node.right = build(mid + 1, hi, depth + 1)
+            _update(node)
+            return node
+
+        self._set_root(build(0, len(nodes), 0))
+        return nodes
+
+    def clear(self) -> None:
+        self.root = None
+
+
+_last_item_id = 0
+
+
+def next_item_id() -> int:
+    global _last_item_id
+    _last_item_id += 1
+    return _last_item_id
+
+
+def last_item_id() -> int:
+    return _last_item_id
+
+
+def reserve_item_ids(up_to: int) -> None:
+    """Make sure new ids never collide with ids restored from disk."""
+    global _last_item_id
+    _last_item_id = max(_last_item_id, up_to)
+
+
+class GuildQueue:
+    """One guild's upcoming items, in play order and in shuffle order.
+
+    Both orders hold the same items. The shuffle order is built by
+    inside-out Fisher-Yates: each new item lands at a uniformly random
+    position, so enabling shuffle costs nothing per track and adding
+    items doesn't reorder what's already there. Items are addressed by
+    their stable ``item_id``. Every mutation is recorded in ``journal``
+    when one is attached.
+    """
+
+    def __init__(
+        self, guild_id: int = 0, journal: Optional["QueueJournal"] = None
+    ) -> None:
+        self.guild_id: int = guild_id
+        self.journal = journal
+        self.order = IndexedList()
+        self.shuffled = IndexedList()
+        self.nodes: Dict[int, Tuple[_Node, _Node]] = {}
+
+    def _log(self, op: str, **fields: object) -> None:
+        if self.journal is not None:
+            self.journal.append({"op": op, "g": self.guild_id, **fields})
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __bool__(self) -> bool:
+        return self.order.root is not None
+
+    def __iter__(self) -> Iterator["QueueItem"]:
+        return iter(self.order)  # type: ignore[return-value]
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self.nodes
+
+    def _sequence(self, shuffle: bool) -> IndexedList:
+        return self.shuffled if shuffle else self.order
+
+    def insert(
+        self, item: "QueueItem", position: int, shuffle_position: int
+    ) -> None:
+        if item.item_id in self.nodes:
+            # a second node under the same id would be unreachable
+            raise ValueError(f"item {item.item_id} is already queued")
+        self.nodes[item.item_id] = (
+            self.order.insert(position, item),
+            self.shuffled.insert(shuffle_position, item),
+        )
+        if self.journal is not None:
+            self._log(
+                "add", item=item.to_record(), pos=position, spos=shuffle_position
+            )
+
+    def append(self, item: "QueueItem") -> None:
+        self.insert(item, len(self), random.randint(0, len(self)))
+
+    def appendleft(self, item: "QueueItem") -> None:
+        self.insert(item, 0, 0)
+
+    def extend(self, items: List["QueueItem"]) -> None:
+        for item in items:
+            self.append(item)
+
+    def remove(self, item_id: int) -> Optional["QueueItem"]:
+        nodes = self.nodes.pop(item_id, None)
+        if nodes is None:
+            return None
+        self.order.remove(nodes[0])
+        self.shuffled.remove(nodes[1])
+        self._log("remove", id=item_id)
+        return nodes[0].value  # type: ignore[return-value]
+
+    def pop_next(self, shuffle: bool) -> Optional["QueueItem"]:
+        node = self._sequence(shuffle).node_at(0)
+        if node is None:
+            return None
+        return self.remove(node.value.item_id)  # type: ignore[attr-defined]
+
+    def position(self, item_id: int, shuffle: bool) -> int:
+        """Zero-based position of the item in the order that will play."""
+        nodes = self.nodes[item_id]
+        return self._sequence(shuffle).index(nodes[1] if shuffle else nodes[0])
+
+    def move(self, item_id: int, position: int, shuffle: bool) -> bool:
+        """Move an item to ``position`` in the order that will play."""
+        nodes = self.nodes.get(item_id)
+        if nodes is None:
+            return False
+        # only the active order changes, the other keeps its place
+        if shuffle:
+            self.shuffled.remove(nodes[1])
+            moved = self.shuffled.insert(position, nodes[1].value)
+            self.nodes[item_id] = (nodes[0], moved)
+        else:
+            self.order.remove(nodes[0])
+            moved = self.order.insert(position, nodes[0].value)
+            self.nodes[item_id] = (moved, nodes[1])
+        self._log("move", id=item_id, pos=position, shuffle=shuffle)
+        return True
+
+    def peek(self, n: int, shuffle: bool) -> List["QueueItem"]:
+        return list(islice(self._sequence(shuffle), n))  # type: ignore[arg-type]
+
+    def reshuffle(self) -> None:
+        """Draw a fresh shuffle order with a full Fisher-Yates pass."""
+        items: List["QueueItem"] = list(self.order)  # type: ignore[arg-type]
+        for i in range(len(items) - 1, 0, -1):
+            j = random.randint(0, i)
+            items[i], items[j] = items[j], items[i]
+        order = [item.item_id for item in items]
+        self.bulk_load(list(self.order), order)  # type: ignore[arg-type]
+        self._log("reshuffle", order=order)
+
+    def bulk_load(self, items: List["QueueItem"], shuffled_ids: List[int]) -> None:
+        """Replace the contents with ``items``, shuffled as ``shuffled_ids``.
+
+        Items missing from ``shuffled_ids`` go to the end of the shuffle order.
+        """
+        by_id = {item.item_id: item for item in items}
+        order_nodes = dict(zip(by_id, self.order.load(items)))  # type: ignore[arg-type]
+        shuffled = [by_id.pop(i) for i in shuffled_ids if i in by_id]
+        shuffled.extend(by_id.values())
+        shuffled_nodes = self.shuffled.load(shuffled)  # type: ignore[arg-type]
+        self.nodes = {
+            item.item_id: (order_nodes[item.item_id], node)
+            for item, node in zip(shuffled, shuffled_nodes)
+        }
+
+    def clear(self) -> None:
+        self.order.clear()
+        self.shuffled.clear()
+        self.nodes.clear()
+        self._log("clear")
@@ -1,8 +1,15 @@
 import discord
+import os
 from discord.ext import commands
 from discord import app_commands, ui
+from typing import List
 from .files import Files
 from .idle import Idle
+from .ingest import Ingest, IngestError
+from .library import Library
+
+# files shown per /list page
+LIST_PAGE_SIZE = 30
 
 
 class Voice(commands.Cog):
@@ -10,6 +17,17 @@ class Voice(commands.Cog):
         self.bot = bot
         self.files = Files()
         self.idle_player = Idle()
+        self.ingest = Ingest(self.files)
+        self.library = Library(
+            self.files.audio_index, os.path.join(self.files.audio_dir, ".library.db")
+        )
+
+    async def cog_load(self) -> None:
+        await self.library.sync()
+
+    async def cog_unload(self) -> None:
+        self.library.close()
+        await self.ingest.close()
 
     @commands.command()
     async def join(self, ctx: commands.Context) -> None:
@@ -28,7 +46,7 @@ class Voice(commands.Cog):
             print(f"connected successfully: {voice_client}")
             await ctx.send("joined")
             if ctx.guild is not None:
-                self.idle_player.start_idle_task(ctx.guild.id, voice_client)
+                self.idle_player.attach(ctx.guild.id, voice_client)
         except Exception as e:
             print(f"failed to connect: {e}")
             await ctx.send(f"couldn't join: {e}")
@@ -55,7 +73,7 @@ class Voice(commands.Cog):
         try:
             voice_client = await channel.connect()
             await interaction.response.send_message("joined")
-            self.idle_player.start_idle_task(interaction.guild.id, voice_client)
+            self.idle_player.attach(interaction.guild.id, voice_client)
         except Exception as e:
             await interaction.response.send_message(f"couldn't join: {e}")
 
@@ -73,7 +91,7 @@ class Voice(commands.Cog):
             await interaction.response.send_message("not in a voice channel")
             return
 
-        self.idle_player.stop_idle_task(interaction.guild.id)
+        self.idle_player.detach(interaction.guild.id)
         await voice_client.disconnect(force=True)
         await interaction.response.send_message("left")
 
@@ -87,27 +105,34 @@ class Voice(commands.Cog):
             await interaction.followup.send("only audio files please")
             return
 
-        if file.size > 25 * 1024 * 1024:
-            await interaction.followup.send("file too big, 25mb max")
-            return
-
         try:
-            from pathlib import Path
-
-            filepath = self.files.get_audio_path(file.filename)
-            await file.save(Path(filepath))
-            await interaction.followup.send(f"saved as {file.filename}")
+            duplicate, name = await self.ingest.ingest(file)
+        except IngestError as e:
+            await interaction.followup.send(str(e))
+            return
         except Exception as e:
             await interaction.followup.send(f"failed to save file: {e}")
+            return
+
+        if duplicate and name != os.path.basename(file.filename):
+            await interaction.followup.send(f"already uploaded as {name}")
+            return
+        await self.library.add(name)
+        await interaction.followup.send(f"saved as {name}")
 
     @app_commands.command(name="list", description="list uploaded audio files")
-    async def list_files(self, interaction: discord.Interaction) -> None:
-        files = self.files.list_audio_files()
+    async def list_files(self, interaction: discord.Interaction, page: int = 1) -> None:
+        files = self.library.names()
 
         if not files:
             await interaction.response.send_message("no files uploaded yet")
             return
 
+        pages = (len(files) + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+        page = max(1, min(page, pages))
+        start = (page - 1) * LIST_PAGE_SIZE
+        page_files = files[start : start + LIST_PAGE_SIZE]
+
         class FilesLayout(ui.LayoutView):
             container = ui.Container(
                 ui.Section(
@@ -119,10 +144,10 @@ class Voice(commands.Cog):
 
         layout = FilesLayout()
 
-        file_chunks = [files[i : i + 15] for i in range(0, len(files), 15)]
+        file_chunks = [page_files[i : i + 15] for i in range(0, len(page_files), 15)]
 
         for chunk in file_chunks:
-            file_text = "\n".join(f"• {f}" for f in chunk)
+            file_text = "\n".join(f"• {self.library.label(f)}" for f in chunk)
             layout.container.add_item(
                 ui.Section(
                     ui.TextDisplay(file_text),
@@ -133,6 +158,10 @@ class Voice(commands.Cog):
                     ui.Separator(spacing=ui.SeparatorSpacing.small)
                 )
 
+        layout.container.add_item(
+            ui.TextDisplay(f"-# page {page}/{pages} • {len(files)} files")
+        )
+
         await interaction.response.send_message(view=layout)
 
     @app_commands.command(name="playfile", description="play an uploaded file")
@@ -161,7 +190,10 @@ class Voice(commands.Cog):
             await interaction.response.send_message("queue system not loaded")
             return
 
-        metadata = {"title": filename, "artist": "unknown", "album": "unknown"}
+        metadata = dict(
+            self.library.get(filename)
+            or {"title": filename, "artist": "unknown", "album": "unknown"}
+        )
         guild_id = interaction.guild.id
         queue_cog.add_to_queue(guild_id, filepath, metadata, False)
 
@@ -175,17 +207,26 @@ class Voice(commands.Cog):
                 )
                 return
             voice_client = await channel.connect()
-            self.idle_player.start_idle_task(guild_id, voice_client)
+            self.idle_player.attach(guild_id, voice_client)
 
         if isinstance(voice_client, discord.VoiceClient):
-            if not voice_client.is_playing():
-                queue_cog.play_next(guild_id, voice_client)
+            queue_cog.start(guild_id)
             await interaction.response.send_message(f"added {filename} to queue")
         else:
             await interaction.response.send_message(
                 "Failed to play: not connected to a voice channel properly."
             )
 
+    @playfile.autocomplete("filename")
+    async def playfile_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> List[app_commands.Choice[str]]:
+        return [
+            app_commands.Choice(name=self.library.label(f)[:100], value=f)
+            for f in self.library.search(current)
+            if len(f) <= 100
+        ]
+
     @app_commands.command(name="idle", description="toggle idle background music")
     async def idle_toggle(self, interaction: discord.Interaction, mode: str) -> None:
         if interaction.guild is None:
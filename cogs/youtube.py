@@ -1,10 +1,15 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import yt_dlp
 import os
-import hashlib
-from typing import Optional, Dict
+import time
+from concurrent.futures import Future
+from typing import Any, Optional, Dict, Set, Tuple
+from .cache import AudioCache, canonical_key
+from .metadata_store import MetadataStore
+from .opus import converter
+from .queue import QueueItem
+from .ytdl import YtdlPool, is_playlist_url, iter_playlist, stream_fields
 
 
 class YouTube(commands.Cog):
@@ -12,76 +17,187 @@ class YouTube(commands.Cog):
         self.bot = bot
         self.cache_dir: str = "youtube_cache"
         os.makedirs(self.cache_dir, exist_ok=True)
-        self.metadata_cache: Dict[str, Dict[str, str]] = {}
+        self.store = MetadataStore(
+            os.path.join(self.cache_dir, "metadata.db"),
+            ttl=float(os.getenv("METADATA_TTL_HOURS", "168")) * 3600,
+            max_rows=int(os.getenv("METADATA_MAX_ROWS", "50000")),
+        )
+        self.cache = AudioCache(
+            self.cache_dir,
+            int(os.getenv("YOUTUBE_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+            policy=os.getenv("YOUTUBE_CACHE_POLICY", "lru"),
+            pinned=self.active_files,
+        )
+        self.pool = YtdlPool()
+        self.streaming: bool = os.getenv("YOUTUBE_STREAMING", "1") == "1"
+
+    async def cog_load(self) -> None:
+        await self.pool.warm()
+
+    async def cog_unload(self) -> None:
+        self.pool.shutdown()
+        self.store.close()
+        await self.cache.close()
 
     def get_cache_filename(self, url: str) -> str:
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return os.path.join(self.cache_dir, f"{url_hash}.opus")
+        return self.cache.path_for(canonical_key(url))
 
-    def get_video_metadata(self, url: str) -> Optional[Dict[str, str]]:
-        if url in self.metadata_cache:
-            return self.metadata_cache[url]
+    def active_files(self) -> Set[str]:
+        """Files queued or playing in any guild, which must not be evicted."""
+        queue_cog = self.bot.get_cog("Queue")
+        if queue_cog is None:
+            return set()
+        return queue_cog.active_files()
 
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "quiet": True,
-            "no_warnings": True,
-            "extract_flat": False,
-        }
+    async def resolve(
+        self, url: str, need_media: bool
+    ) -> Optional[Tuple[Dict[str, str], Optional[Dict[str, Any]]]]:
+        """Metadata and media selection for ``url``, extracting only if needed.
+
+        A stored entry is enough unless ``need_media`` is set and its
+        stream url has expired.
+        """
+        key = canonical_key(url)
+        stored = self.store.get(key)
+        if stored is not None and (stored[1] is not None or not need_media):
+            return stored
 
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if info:
-                    metadata = {
-                        "title": info.get("title", "Unknown"),
-                        "uploader": info.get("uploader", "Unknown"),
-                        "duration": str(info.get("duration", 0)),
-                        "thumbnail": info.get("thumbnail", ""),
-                        "url": url,
-                    }
-                    self.metadata_cache[url] = metadata
-                    return metadata
+            resolved = await self.pool.resolve(url, key)
         except Exception as e:
             print(f"failed to get metadata: {e}")
             return None
 
-    def download_audio(self, url: str) -> Optional[str]:
+        if resolved is None:
+            return None
+        metadata, media = resolved
+        self.store.put(key, metadata, media)
+        return metadata, media
+
+    async def get_video_metadata(self, url: str) -> Optional[Dict[str, str]]:
+        resolved = await self.resolve(url, need_media=False)
+        return resolved[0] if resolved is not None else None
+
+    async def download_audio(
+        self, url: str, media: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
         cache_file = self.get_cache_filename(url)
 
         if os.path.exists(cache_file):
             print(f"using cached file for {url}")
             return cache_file
 
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "outtmpl": cache_file.replace(".opus", ".%(ext)s"),
-            "postprocessors": [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": "opus",
-                    "preferredquality": "192",
-                }
-            ],
-            "quiet": True,
-            "no_warnings": True,
-        }
+        if media is None:
+            resolved = await self.resolve(url, need_media=True)
+            if resolved is None or resolved[1] is None:
+                return None
+            media = resolved[1]
 
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print(f"downloading {url}")
-                ydl.download([url])
-                if os.path.exists(cache_file):
-                    return cache_file
-                else:
-                    print(f"file not found after download: {cache_file}")
-                    return None
+            print(f"downloading {url}")
+            filepath = await self.pool.download_info(media, cache_file)
         except Exception as e:
             print(f"failed to download: {e}")
             return None
 
+        if filepath is None:
+            print(f"file not found after download: {cache_file}")
+        else:
+            self.cached(filepath)
+        return filepath
+
+    def cached(self, path: str) -> None:
+        """Index a freshly written cache file and queue its loudness analysis."""
+        self.cache.record(path)
+        self.normalize(path)
+
+    def normalize(self, path: str) -> "Future[Optional[str]]":
+        """Analyze a cache file, re-encoding it if its gain is off.
+
+        The file may change size, so it's recorded in the cache again.
+        """
+        fut = converter.normalize(path)
+
+        def done(fut: "Future[Optional[str]]") -> None:
+            if fut.cancelled() or fut.exception() is not None:
+                return
+            if fut.result() is not None and os.path.exists(path):
+                self.cache.record(path)
+
+        fut.add_done_callback(lambda f: self.bot.loop.call_soon_threadsafe(done, f))
+        return fut
+
+    async def prepare_item(self, item: QueueItem) -> bool:
+        """Fully resolve a placeholder item once it's about to play."""
+        url = item.metadata["url"]
+        if self.cache.lookup(url) is not None:
+            return True
+
+        resolved = await self.resolve(url, need_media=True)
+        if resolved is None or resolved[1] is None:
+            return False
+        metadata, media = resolved
+        item.metadata.update(metadata)
+
+        if self.streaming and media.get("url"):
+            item.metadata.update(stream_fields(media))
+            item.stream_url = item.metadata["stream_url"]
+            return True
+        return await self.download_audio(url, media) is not None
+
+    async def play_playlist(
+        self,
+        interaction: discord.Interaction,
+        member: discord.Member,
+        url: str,
+    ) -> None:
+        queue_cog = self.bot.get_cog("Queue")
+        if queue_cog is None or interaction.guild is None:
+            await interaction.followup.send("queue system not loaded")
+            return
+
+        voice_client = interaction.guild.voice_client
+        if voice_client is None:
+            channel = member.voice.channel if member.voice else None
+            if channel is None:
+                await interaction.followup.send("join a voice channel first")
+                return
+            try:
+                voice_client = await channel.connect()
+            except Exception as e:
+                await interaction.followup.send(f"couldn't connect: {e}")
+                return
+
+        if not isinstance(voice_client, discord.VoiceClient):
+            await interaction.followup.send("not connected properly")
+            return
+
+        guild_id = interaction.guild.id
+        added = 0
+        try:
+            async for batch in iter_playlist(url):
+                # placeholders only, the real resolve happens near the head
+                queue_cog.add_items(
+                    guild_id,
+                    [
+                        QueueItem(self.get_cache_filename(m["url"]), m, True)
+                        for m in batch
+                    ],
+                )
+                if added == 0:
+                    queue_cog.start(guild_id)
+                added += len(batch)
+        except Exception as e:
+            print(f"playlist enumeration failed: {e}")
+            if added == 0:
+                await interaction.followup.send("couldn't read that playlist")
+                return
+
+        await interaction.followup.send(f"added {added} tracks from playlist")
+
     @app_commands.command(name="play", description="play audio from youtube url")
     async def play(self, interaction: discord.Interaction, url: str) -> None:
+        requested_at = time.perf_counter()
         await interaction.response.defer()
 
         if interaction.guild is None:
@@ -93,15 +209,31 @@ class YouTube(commands.Cog):
             await interaction.followup.send("join a voice channel first")
             return
 
-        metadata = self.get_video_metadata(url)
-        if metadata is None:
-            await interaction.followup.send("couldn't get video info")
+        if is_playlist_url(url):
+            await self.play_playlist(interaction, member, url)
             return
 
-        filepath = self.download_audio(url)
-        if filepath is None:
-            await interaction.followup.send("couldn't download audio")
+        cached = self.cache.lookup(url)
+        resolved = await self.resolve(url, need_media=cached is None)
+        if resolved is None:
+            await interaction.followup.send("couldn't get video info")
             return
+        metadata, media = resolved
+
+        filepath = self.get_cache_filename(url)
+        stream_url = None
+        if cached is not None:
+            print(f"using cached file for {url}")
+        elif self.streaming and media is not None and media.get("url"):
+            # play straight from the stream, the source fills the cache as it goes
+            metadata = dict(metadata, **stream_fields(media))
+            stream_url = metadata["stream_url"]
+        else:
+            downloaded = await self.download_audio(url, media)
+            if downloaded is None:
+                await interaction.followup.send("couldn't download audio")
+                return
+            filepath = downloaded
 
         queue_cog = self.bot.get_cog("Queue")
         if queue_cog is None:
@@ -109,7 +241,9 @@ class YouTube(commands.Cog):
             return
 
         guild_id = interaction.guild.id
-        queue_cog.add_to_queue(guild_id, filepath, metadata, True)
+        queue_cog.add_to_queue(
+            guild_id, filepath, metadata, True, stream_url, requested_at
+        )
 
         voice_client = interaction.guild.voice_client
 
@@ -125,12 +259,22 @@ class YouTube(commands.Cog):
                 return
 
         if isinstance(voice_client, discord.VoiceClient):
-            if not voice_client.is_playing():
-                queue_cog.play_next(guild_id, voice_client)
+            queue_cog.start(guild_id)
             await interaction.followup.send(f"added to queue: {metadata['title']}")
         else:
             await interaction.followup.send("not connected properly")
 
+    @app_commands.command(name="cache", description="show youtube cache stats")
+    async def cache_stats(self, interaction: discord.Interaction) -> None:
+        stats = self.cache.stats()
+        used_mb = stats["bytes"] / (1024 * 1024)
+        max_mb = stats["max_bytes"] / (1024 * 1024)
+        await interaction.response.send_message(
+            f"cache: {stats['files']} files, {used_mb:.1f}/{max_mb:.0f}mb\n"
+            f"hits: {stats['hits']}  •  misses: {stats['misses']}  •  "
+            f"hit rate: {stats['hit_rate']:.0%}  •  evictions: {stats['evictions']}"
+        )
+
 
 async def setup(bot: commands.Bot) -> None:
     await bot.add_cog(YouTube(bot))
@@ -0,0 +1,278 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+)
+
+import yt_dlp
+
+EXTRACT_OPTS: Dict[str, Any] = {
+    "format": "bestaudio/best",
+    "quiet": True,
+    "no_warnings": True,
+    "extract_flat": False,
+    "noplaylist": True,
+}
+
+PLAYLIST_OPTS: Dict[str, Any] = {
+    "quiet": True,
+    "no_warnings": True,
+    "extract_flat": "in_playlist",
+    "lazy_playlist": True,
+}
+
+PLAYLIST_BATCH = 50
+
+DOWNLOAD_OPTS: Dict[str, Any] = {
+    "format": "bestaudio/best",
+    "postprocessors": [
+        {
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "opus",
+            "preferredquality": "192",
+        }
+    ],
+    "quiet": True,
+    "no_warnings": True,
+}
+
+# bulky parts of the info dict that downloading the chosen format doesn't need
+MEDIA_DROP_KEYS = (
+    "formats",
+    "requested_formats",
+    "thumbnails",
+    "subtitles",
+    "automatic_captions",
+    "requested_subtitles",
+    "heatmap",
+)
+
+# one extractor and one downloader per worker process, built once by
+# _init_worker and reused for every job that process runs
+_extractor: Optional[yt_dlp.YoutubeDL] = None
+_downloader: Optional[yt_dlp.YoutubeDL] = None
+
+
+def _init_worker() -> None:
+    global _extractor, _downloader
+    _extractor = yt_dlp.YoutubeDL(EXTRACT_OPTS)
+    _downloader = yt_dlp.YoutubeDL(DOWNLOAD_OPTS)
+    # instantiating the extractor up front pays the import/setup cost
+    # before the first real job lands on this worker
+    _extractor.get_info_extractor("Youtube")
+    _downloader.get_info_extractor("Youtube")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _resolve(url: str) -> Optional[Tuple[Dict[str, str], Dict[str, Any]]]:
+    """Extract once, returning display metadata and the selected media.
+
+    The media dict is the info dict cut down to the chosen format, enough
+    for ``_download_info`` to download it without extracting again.
+    """
+    assert _extractor is not None
+    info = _extractor.extract_info(url, download=False)
+    if not info:
+        return None
+    info = _extractor.sanitize_info(info)
+    media = {k: v for k, v in info.items() if k not in MEDIA_DROP_KEYS}
+    for fmt in info.get("formats") or []:
+        if fmt.get("format_id") == info.get("format_id"):
+            media["formats"] = [fmt]
+            break
+    metadata = {
+        "title": info.get("title", "Unknown"),
+        "uploader": info.get("uploader", "Unknown"),
+        "duration": str(info.get("duration", 0)),
+        "thumbnail": info.get("thumbnail", ""),
+        "url": url,
+    }
+    return metadata, media
+
+
+def _prepare_download(cache_file: str) -> None:
+    assert _downloader is not None
+    # each worker runs one job at a time, so swapping the template on the
+    # shared downloader is safe
+    template = cache_file.replace(".opus", ".%(ext)s")
+    _downloader.params["outtmpl"] = {"default": template}
+
+
+def _download_info(media: Dict[str, Any], cache_file: str) -> Optional[str]:
+    assert _downloader is not None
+    if os.path.exists(cache_file):
+        return cache_file
+    _prepare_download(cache_file)
+    _downloader.process_ie_result(media, download=True)
+    if os.path.exists(cache_file):
+        return cache_file
+    return None
+
+
+def stream_fields(media: Dict[str, Any]) -> Dict[str, str]:
+    """Stream url, ffmpeg header string and codec of a resolved media dict."""
+    headers = media.get("http_headers") or {}
+    return {
+        "stream_url": media.get("url", ""),
+        "stream_headers": "".join(f"{k}: {v}\r\n" for k, v in headers.items()),
+        "acodec": media.get("acodec") or "",
+    }
+
+
+def is_playlist_url(url: str) -> bool:
+    """A link to a playlist itself, not a video opened from one."""
+    return "list=" in url and "v=" not in url and "youtu.be/" not in url
+
+
+def _entry_metadata(entry: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    url = entry.get("url") or entry.get("webpage_url")
+    if not url:
+        return None
+    if not url.startswith("http"):
+        # flat youtube entries can carry just the video id
+        url = f"https://www.youtube.com/watch?v={entry.get('id', url)}"
+    return {
+        "title": entry.get("title") or "Unknown",
+        "uploader": entry.get("uploader") or entry.get("channel") or "Unknown",
+        "duration": str(entry.get("duration") or 0),
+        "thumbnail": "",
+        "url": url,
+    }
+
+
+def _enumerate_playlist(
+    url: str, emit: Callable[[List[Dict[str, str]]], None]
+) -> str:
+    """Walk a playlist in flat mode, handing entries to ``emit`` in batches.
+
+    With ``process=False`` the extractor's entries stay a lazy generator,
+    so each page of the playlist is emitted as soon as it has been fetched.
+    """
+    with yt_dlp.YoutubeDL(PLAYLIST_OPTS) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        if not info:
+            return "playlist"
+        batch: List[Dict[str, str]] = []
+        for entry in info.get("entries") or []:
+            metadata = _entry_metadata(entry or {})
+            if metadata is None:
+                continue
+            batch.append(metadata)
+            if len(batch) >= PLAYLIST_BATCH:
+                emit(batch)
+                batch = []
+        if batch:
+            emit(batch)
+        return info.get("title") or "playlist"
+
+
+async def iter_playlist(url: str) -> AsyncIterator[List[Dict[str, str]]]:
+    """Yield batches of placeholder metadata while the playlist is enumerated.
+
+    Enumeration is network bound, so it runs in a thread rather than the
+    process pool and streams batches back through an asyncio queue.
+    """
+    loop = asyncio.get_running_loop()
+    batches: "asyncio.Queue[Optional[List[Dict[str, str]]]]" = asyncio.Queue()
+
+    def emit(batch: List[Dict[str, str]]) -> None:
+        loop.call_soon_threadsafe(batches.put_nowait, batch)
+
+    def run() -> str:
+        try:
+            return _enumerate_playlist(url, emit)
+        finally:
+            loop.call_soon_threadsafe(batches.put_nowait, None)
+
+    job = loop.run_in_executor(None, run)
+    while True:
+        batch = await batches.get()
+        if batch is None:
+            break
+        yield batch
+    title = await job
+    print(f"finished enumerating {title}")
+
+
+class YtdlPool:
+    """Long-lived pool of yt-dlp worker processes.
+
+    Extraction and downloads run off the event loop, and concurrent
+    requests for the same job share a single in-flight future.
+    """
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers: int = workers or int(os.getenv("YTDL_WORKERS", "2"))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    async def warm(self) -> None:
+        """Spawn every worker now instead of on the first request."""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        pids = await asyncio.gather(
+            *(loop.run_in_executor(executor, _ping) for _ in range(self.workers))
+        )
+        print(f"ytdl pool ready: {len(set(pids))} workers")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _submit(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        except BrokenProcessPool:
+            print("ytdl worker died, restarting pool")
+            self.shutdown()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+
+    async def _run(self, key: Hashable, fn: Callable[..., Any], *args: Any) -> Any:
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._submit(fn, *args))
+            self._inflight[key] = fut
+
+            def _done(f: "asyncio.Future[Any]") -> None:
+                if self._inflight.get(key) is f:
+                    del self._inflight[key]
+
+            fut.add_done_callback(_done)
+        # shield so one caller giving up doesn't cancel the job for the others
+        return await asyncio.shield(fut)
+
+    async def resolve(
+        self, url: str, key: Optional[str] = None
+    ) -> Optional[Tuple[Dict[str, str], Dict[str, Any]]]:
+        return await self._run(("resolve", key or url), _resolve, url)
+
+    async def download_info(
+        self, media: Dict[str, Any], cache_file: str
+    ) -> Optional[str]:
+        return await self._run(
+            ("download", cache_file), _download_info, media, cache_file
+        )
@@ -0,0 +1,47 @@
+from unittest import mock
+
+import pytest
+
+from cogs.queue import Queue, QueueItem
+from cogs.tracklist import GuildQueue
+
+
+def make_item(name: str) -> QueueItem:
+    return QueueItem(f"{name}.mp3", {"title": name}, False)
+
+
+def test_insert_refuses_a_queued_id() -> None:
+    queue = GuildQueue()
+    a = make_item("a")
+    queue.append(a)
+    with pytest.raises(ValueError):
+        queue.append(a)
+    assert len(queue) == 1
+    assert queue.pop_next(False) is a
+    assert not queue
+
+
+def test_loop_single_then_loop_queue(tmp_path, monkeypatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    cog = Queue(mock.Mock())
+    a, b = make_item("a"), make_item("b")
+    cog.get_queue(1).append(b)
+    cog.current[1] = a
+
+    # what advance does on each replay under /loop single
+    cog.loop_mode[1] = "single"
+    for _ in range(3):
+        cog.push_history(1, a)
+        assert cog.get_next(1) is a
+
+    cog.loop_mode[1] = "queue"
+    played = []
+    for _ in range(4):
+        cog.push_history(1, cog.current[1])
+        item = cog.get_next(1)
+        assert item is not None
+        played.append(item.metadata["title"])
+        cog.current[1] = item
+    assert played == ["b", "a", "b", "a"]
+    queue = cog.get_queue(1)
+    assert len(queue) == len(list(queue))